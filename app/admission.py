@@ -0,0 +1,247 @@
+# app/admission.py
+
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+import jwt
+from flask import request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from app.auth import JWT_SECRET_KEY, JWT_ALGORITHM
+
+# Capacidad de la base de datos que se reparte entre los workers
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', '100'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '4'))
+# Conexiones que puede abrir una petición (handler + logger + credit_logger)
+CONNECTIONS_PER_REQUEST = 3
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get(
+    'ADMISSION_MAX_CONCURRENCY',
+    str(max(1, int(DB_MAX_CONNECTIONS * 0.8) // (WEB_CONCURRENCY * CONNECTIONS_PER_REQUEST)))
+))
+ADMISSION_QUEUE_TARGET_MS = float(os.environ.get('ADMISSION_QUEUE_TARGET_MS', '50'))
+ADMISSION_USER_RATE = float(os.environ.get('ADMISSION_USER_RATE', '10'))
+ADMISSION_USER_BURST = float(os.environ.get('ADMISSION_USER_BURST', '20'))
+ADMISSION_IP_RATE = float(os.environ.get('ADMISSION_IP_RATE', '50'))
+ADMISSION_IP_BURST = float(os.environ.get('ADMISSION_IP_BURST', '100'))
+ADMISSION_MAX_BUCKETS = int(os.environ.get('ADMISSION_MAX_BUCKETS', '100000'))
+
+# Prioridad por endpoint (0 = la más alta). Las peticiones de mayor prioridad
+# toleran más tiempo en cola antes de ser descartadas y se atienden primero.
+ENDPOINT_PRIORITIES = {
+    '/bank/verify-otp': 0,
+    '/bank/pay-credit-balance': 1,
+    '/bank/withdraw': 1,
+    '/bank/transfer': 1,
+    '/bank/credit-payment': 1,
+    '/bank/deposit': 2,
+}
+DEFAULT_PRIORITY = 2
+# Multiplicador del objetivo de tiempo en cola según la prioridad
+PRIORITY_QUEUE_FACTOR = {0: 4.0, 1: 2.0, 2: 1.0}
+
+
+class TokenBucket:
+    """Cubeta de tokens: `rate` tokens por segundo con ráfaga máxima `burst`."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Consume un token. Devuelve 0 si hay, o los segundos hasta el siguiente."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class TokenBuckets:
+    """Cubetas por clave (usuario o IP) con un máximo de claves en memoria (LRU)."""
+
+    def __init__(self, rate, burst, max_keys=ADMISSION_MAX_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+
+class PriorityLimiter:
+    """
+    Límite de concurrencia con cola por prioridad. Al liberar un hueco se
+    entrega directamente al waiter de mayor prioridad (y más antiguo).
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority, deadline):
+        """Espera un hueco hasta `deadline` (monotonic). Devuelve False si vence."""
+        with self._cond:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            waiter = [priority, next(self._seq), False]
+            heapq.heappush(self._waiters, waiter)
+            while not waiter[2]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def release(self):
+        with self._cond:
+            if self._waiters:
+                # El hueco pasa al siguiente waiter sin decrementar `active`
+                heapq.heappop(self._waiters)[2] = True
+                self._cond.notify_all()
+            else:
+                self.active -= 1
+
+    def queued(self):
+        return len(self._waiters)
+
+
+class AdmissionController:
+    """
+    Control de admisión delante de los handlers que dependen de la base de datos:
+    cubetas de tokens por usuario y por IP, límite de concurrencia ligado a la
+    capacidad de Postgres y descarte por tiempo en cola (503 + Retry-After).
+    """
+
+    def __init__(self, max_concurrency=ADMISSION_MAX_CONCURRENCY, queue_target_ms=ADMISSION_QUEUE_TARGET_MS):
+        self.limiter = PriorityLimiter(max_concurrency)
+        self.queue_target = queue_target_ms / 1000.0
+        self.user_buckets = TokenBuckets(ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+        self.ip_buckets = TokenBuckets(ADMISSION_IP_RATE, ADMISSION_IP_BURST)
+        self._service_time = 0.05  # media móvil exponencial en segundos
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._stats_lock = threading.Lock()
+
+    def _count(self, endpoint, outcome):
+        with self._stats_lock:
+            self._stats[endpoint][outcome] += 1
+
+    def _user_key(self):
+        """Identifica al usuario a partir del JWT, sin consultar la base de datos."""
+        auth_header = request.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            return None
+        try:
+            payload = jwt.decode(auth_header.split(' ')[1], JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            return payload.get('user_id')
+        except jwt.InvalidTokenError:
+            return None
+
+    def _upstream_queue_time(self):
+        """
+        Tiempo que la petición ya esperó antes de llegar al worker, si el proxy
+        envía X-Request-Start (formato "t=<epoch en s, ms o µs>").
+        """
+        header = request.headers.get('X-Request-Start', '')
+        if not header:
+            return 0.0
+        try:
+            started = float(header.split('=')[-1])
+        except ValueError:
+            return 0.0
+        if started > 1e14:
+            started /= 1e6
+        elif started > 1e11:
+            started /= 1e3
+        return max(0.0, time.time() - started)
+
+    def _retry_after(self):
+        """Estimación en segundos de cuándo se habrá vaciado la cola."""
+        limit = max(1, self.limiter.limit)
+        backlog = self.limiter.queued() + limit
+        return max(1, math.ceil(backlog * self._service_time / limit))
+
+    def admit(self, f):
+        """Decorator de admisión para las vistas de un namespace."""
+
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return f(*args, **kwargs)
+
+            endpoint = request.path
+            priority = ENDPOINT_PRIORITIES.get(endpoint, DEFAULT_PRIORITY)
+
+            wait = self.ip_buckets.take(request.remote_addr)
+            if wait:
+                self._count(endpoint, 'rate_limited_ip')
+                raise TooManyRequests("Too many requests from this address", retry_after=math.ceil(wait))
+            user_id = self._user_key()
+            if user_id is not None:
+                wait = self.user_buckets.take(user_id)
+                if wait:
+                    self._count(endpoint, 'rate_limited_user')
+                    raise TooManyRequests("Too many requests for this user", retry_after=math.ceil(wait))
+
+            budget = self.queue_target * PRIORITY_QUEUE_FACTOR.get(priority, 1.0)
+            budget -= self._upstream_queue_time()
+            if budget <= 0 or not self.limiter.acquire(priority, time.monotonic() + budget):
+                self._count(endpoint, 'shed')
+                raise ServiceUnavailable("Server overloaded, retry later", retry_after=self._retry_after())
+
+            self._count(endpoint, 'admitted')
+            started = time.monotonic()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._stats_lock:
+                    self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+                self.limiter.release()
+
+        return decorated
+
+    def stats(self):
+        """Contadores de admisión y descarte por endpoint para este worker."""
+        with self._stats_lock:
+            endpoints = {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+        return {
+            'pid': os.getpid(),
+            'max_concurrency': self.limiter.limit,
+            'active': self.limiter.active,
+            'queued': self.limiter.queued(),
+            'queue_target_ms': self.queue_target * 1000,
+            'avg_service_ms': round(self._service_time * 1000, 3),
+            'endpoints': endpoints,
+        }
+
+
+# Crear una instancia global del controlador
+admission_controller = AdmissionController()
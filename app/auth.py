@@ -1,9 +1,11 @@
 import jwt
+import secrets
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import g, request
 from flask_restx import abort
 import os
+from app.revocation import token_denylist
 
 # Configuración JWT
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'tu_clave_secreta_desarrollo')
@@ -20,7 +22,8 @@ def generate_jwt_token(user_data):
         'email': user_data.get('email'),  # Añadimos el email
         'full_name': user_data.get('full_name'),  # También el nombre completo por si lo necesitamos
         'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS),
-        'iat': datetime.utcnow()
+        'iat': datetime.utcnow(),
+        'jti': secrets.token_hex(16)  # Identificador único para poder revocarlo
     }
     return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
@@ -49,6 +52,9 @@ def jwt_required(f):
 
         try:
             payload = decode_jwt_token(token)
+            # Los tokens emitidos antes de incluir jti no se pueden revocar
+            if payload.get('jti') and token_denylist.is_revoked(payload['jti']):
+                abort(401, "Token has been revoked")
             g.user = {
                 'id': payload['user_id'],
                 'username': payload['username'],
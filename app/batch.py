@@ -0,0 +1,151 @@
+# app/batch.py
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from psycopg2.extras import execute_values
+from app.db import get_shard_connection, SHARD_COUNT
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', str(os.cpu_count() or 4)))
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', '5000'))
+# Filas que trae cada viaje del cursor de servidor y que se escriben por INSERT
+BATCH_FETCH_SIZE = int(os.environ.get('BATCH_FETCH_SIZE', '2000'))
+BATCH_START_METHOD = os.environ.get('BATCH_START_METHOD', 'fork')
+
+
+class BatchJob:
+    """
+    Trabajo por lotes sobre rangos de id de una tabla de cada shard.
+
+    Una subclase define la tabla que se trocea (table), la consulta de lectura
+    para un rango (read_sql, con %(first_id)s, %(last_id)s y sus parámetros)
+    y el INSERT masivo de resultados (write_sql, con un único VALUES %s para
+    execute_values). Cada trozo lee con un cursor de servidor, escribe en
+    páginas y registra su checkpoint en la misma transacción, así que
+    relanzar el trabajo solo procesa los trozos pendientes.
+    """
+
+    name = None
+    table = None
+    read_sql = None
+    write_sql = None
+
+    def params(self, run_key):
+        """Parámetros de las consultas para una ejecución (por ejemplo, un periodo)."""
+        return {}
+
+    def transform(self, rows, params):
+        """Ajusta las filas leídas antes de escribirlas; por defecto, sin cambios."""
+        return rows
+
+
+def _chunk_ranges(low, high, chunk_size):
+    """Rangos alineados a múltiplos de chunk_size: estables entre ejecuciones."""
+    if high is None:
+        return []
+    first_chunk = (low - 1) // chunk_size
+    last_chunk = (high - 1) // chunk_size
+    return [(k * chunk_size + 1, (k + 1) * chunk_size) for k in range(first_chunk, last_chunk + 1)]
+
+
+def _pending_chunks(job, run_key, chunk_size):
+    pending = []
+    for shard in range(SHARD_COUNT):
+        conn = get_shard_connection(shard)
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT min(id), max(id) FROM {job.table}")
+            low, high = cur.fetchone()
+            cur.execute("""
+                SELECT first_id FROM bank.batch_checkpoints
+                WHERE job = %s AND run_key = %s
+            """, (job.name, run_key))
+            done = {row[0] for row in cur.fetchall()}
+        finally:
+            cur.close()
+            conn.close()
+        pending.extend((shard, first, last) for first, last in _chunk_ranges(low, high, chunk_size)
+                       if first not in done)
+    return pending
+
+
+def run_chunk(job, run_key, shard, first_id, last_id, fetch_size=BATCH_FETCH_SIZE):
+    """Procesa un trozo en una transacción. Devuelve las filas escritas."""
+    params = dict(job.params(run_key), first_id=first_id, last_id=last_id)
+    conn = get_shard_connection(shard)
+    written = 0
+    try:
+        reader = conn.cursor(name=f"batch_{job.name}_{first_id}")
+        reader.itersize = fetch_size
+        writer = conn.cursor()
+        reader.execute(job.read_sql, params)
+        while True:
+            rows = reader.fetchmany(fetch_size)
+            if not rows:
+                break
+            rows = job.transform(rows, params)
+            execute_values(writer, job.write_sql, rows, page_size=fetch_size)
+            written += len(rows)
+        reader.close()
+        writer.execute("""
+            INSERT INTO bank.batch_checkpoints (job, run_key, first_id, last_id, rows_written)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (job, run_key, first_id) DO UPDATE
+            SET last_id = EXCLUDED.last_id, rows_written = EXCLUDED.rows_written, completed_at = now()
+        """, (job.name, run_key, first_id, last_id, written))
+        conn.commit()
+        writer.close()
+        return written
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def run_job(job, run_key, workers=BATCH_WORKERS, chunk_size=BATCH_CHUNK_SIZE, restart=False):
+    """
+    Ejecuta job para run_key repartiendo los trozos pendientes en un pool de
+    procesos. restart=True borra antes los checkpoints de esa ejecución.
+    Devuelve un resumen con filas, trozos, errores y filas por segundo.
+    """
+    if restart:
+        for shard in range(SHARD_COUNT):
+            conn = get_shard_connection(shard)
+            cur = conn.cursor()
+            try:
+                cur.execute("DELETE FROM bank.batch_checkpoints WHERE job = %s AND run_key = %s",
+                            (job.name, run_key))
+                conn.commit()
+            finally:
+                cur.close()
+                conn.close()
+
+    pending = _pending_chunks(job, run_key, chunk_size)
+    started = time.perf_counter()
+    rows = done = failed = 0
+    print(f"{job.name} {run_key}: {len(pending)} trozos pendientes")
+    context = multiprocessing.get_context(BATCH_START_METHOD)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(run_chunk, job, run_key, *chunk): chunk for chunk in pending}
+        for future in as_completed(futures):
+            shard, first_id, last_id = futures[future]
+            try:
+                rows += future.result()
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"Error en shard {shard} ids {first_id}-{last_id}: {str(e)}")
+            elapsed = time.perf_counter() - started
+            if done % 10 == 0 or done + failed == len(pending):
+                print(f"  {done}/{len(pending)} trozos, {rows} filas, {rows / elapsed:.0f} filas/s")
+
+    elapsed = time.perf_counter() - started
+    return {
+        'chunks': done,
+        'failed': failed,
+        'rows': rows,
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(rows / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -1,6 +1,17 @@
 
+import contextvars
 import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
 import psycopg2
+import psycopg2.errorcodes
+from app.passwords import hash_password
+from app.tracing import tracer
 
 # Variables de entorno (definidas en docker-compose o con valores por defecto)
 DB_HOST = os.environ.get('POSTGRES_HOST', 'db')
@@ -9,21 +20,484 @@ DB_NAME = os.environ.get('POSTGRES_DB', 'corebank')
 DB_USER = os.environ.get('POSTGRES_USER', 'postgres')
 DB_PASSWORD = os.environ.get('POSTGRES_PASSWORD', 'postgres')
 
+# Shards de usuarios: lista separada por comas de bases ("corebank_0") o de
+# "host:puerto/base". Por defecto un único shard, la propia base principal.
+SHARD_DATABASES = [entry.strip() for entry in os.environ.get('SHARD_DATABASES', '').split(',')
+                   if entry.strip()] or [DB_NAME]
+DIRECTORY_CACHE_SIZE = int(os.environ.get('DIRECTORY_CACHE_SIZE', '10000'))
 
-def get_connection():
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD
-    )
+# Unidades transaccionales de movimientos de dinero: aislamiento y reintentos.
+# Con REPEATABLE READ una actualización concurrente de la misma fila falla con
+# 40001 en lugar de perderse; SERIALIZABLE haría chocar además los depósitos a
+# slots distintos de una cuenta hot, porque todos leen la suma de los slots.
+TX_ISOLATION_LEVEL = os.environ.get('TX_ISOLATION_LEVEL', 'REPEATABLE READ')
+TX_MAX_ATTEMPTS = int(os.environ.get('TX_MAX_ATTEMPTS', '5'))
+TX_BACKOFF_BASE_MS = float(os.environ.get('TX_BACKOFF_BASE_MS', '5'))
+TX_BACKOFF_MAX_MS = float(os.environ.get('TX_BACKOFF_MAX_MS', '250'))
+# Reintentos que puede gastar una petición entre todas sus unidades
+TX_RETRY_BUDGET = int(os.environ.get('TX_RETRY_BUDGET', '8'))
+
+# Conexiones libres que cada proceso guarda por base de datos (0 = sin pool)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '0'))
+# Ejecutar las sentencias calientes de STATEMENTS con PREPARE/EXECUTE
+PREPARED_STATEMENTS = os.environ.get('PREPARED_STATEMENTS', 'true').lower() == 'true'
+
+
+class TracingCursor(psycopg2.extensions.cursor):
+    """Cursor que registra cada sentencia como un span de la traza activa."""
+
+    def execute(self, query, vars=None):
+        with tracer.db_span(query):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with tracer.db_span(query):
+            return super().executemany(query, vars_list)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Conexión que recuerda las sentencias preparadas en su sesión y que, si
+    pertenece al pool, vuelve a él al cerrarse en lugar de desconectar.
+    Solo las conexiones del pool preparan sentencias.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_key = None
+        self.prepared = set()
+        # Sentencias cuyo PREPARE falló: se ejecutan sin preparar
+        self.unprepared = set()
+
+    def detach(self):
+        """Saca la conexión del pool (p. ej. una conexión LISTEN de larga duración)."""
+        self.pool_key = None
+
+    def close(self):
+        if self.pool_key is not None and connection_pool.release(self):
+            return
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Conexiones libres por base de datos y proceso. Al devolverse se deshace
+    cualquier transacción y se restauran los parámetros de sesión, pero las
+    sentencias preparadas se conservan: es lo que amortiza prepararlas.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = size
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # Conexiones heredadas del fork: no se usan ni se cierran desde el hijo
+        self._inherited = []
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._inherited.extend(conn for idle in self._idle.values() for conn in idle)
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def acquire(self, key):
+        if self.size <= 0:
+            return None
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.get(key)
+            while idle:
+                conn = idle.pop()
+                if not conn.closed:
+                    return conn
+        return None
+
+    def release(self, conn):
+        """Devuelve conn al pool; False si hay que cerrarla."""
+        if conn.closed or conn.pool_key is None:
+            return False
+        # Sin conn.reset(): envía DISCARD ALL y borraría las sentencias preparadas
+        try:
+            conn.rollback()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("RESET ALL; UNLISTEN *")
+            conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT',
+                             deferrable='DEFAULT', autocommit=False)
+        except psycopg2.Error:
+            return False
+        del conn.notifies[:]
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.setdefault(conn.pool_key, [])
+            if len(idle) >= self.size:
+                return False
+            idle.append(conn)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size, 'pid': os.getpid(),
+                    'idle': {'/'.join(map(str, key)): len(idle) for key, idle in self._idle.items()}}
+
+
+# Crear una instancia global del pool de conexiones
+connection_pool = ConnectionPool()
+
+
+def _connect(host, port, dbname, **span_attrs):
+    key = (host, port, dbname)
+    conn = connection_pool.acquire(key)
+    if conn is not None:
+        return conn
+    with tracer.span('db connect', database=dbname, **span_attrs):
+        conn = psycopg2.connect(
+            host=host,
+            port=port,
+            dbname=dbname,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            connection_factory=PooledConnection,
+            cursor_factory=TracingCursor
+        )
+    if connection_pool.size > 0:
+        conn.pool_key = key
     return conn
 
 
-def init_db():
+def get_connection():
+    return _connect(DB_HOST, DB_PORT, DB_NAME)
+
+
+def _shard_params(entry):
+    """Una entrada de SHARD_DATABASES: "base" o "host:puerto/base"."""
+    if '/' not in entry:
+        return DB_HOST, DB_PORT, entry
+    address, dbname = entry.rsplit('/', 1)
+    host, _, port = address.partition(':')
+    return host or DB_HOST, port or DB_PORT, dbname
+
+
+_PRIMARY_PARAMS = (DB_HOST, DB_PORT, DB_NAME)
+_SHARD_PARAMS = [_shard_params(entry) for entry in SHARD_DATABASES]
+SHARD_COUNT = len(_SHARD_PARAMS)
+
+
+def get_shard_connection(shard):
+    host, port, dbname = _SHARD_PARAMS[shard]
+    return _connect(host, port, dbname, shard=shard)
+
+
+def shard_for_user(user_id):
+    """Shard de los datos de un usuario (users, accounts, credit_cards, tarjetas)."""
+    return zlib.crc32(str(user_id).encode()) % SHARD_COUNT
+
+
+def shard_for_account(account_id):
+    """Los ids de cuenta se intercalan: el shard i emite i+1, i+1+N, i+1+2N..."""
+    return (account_id - 1) % SHARD_COUNT
+
+
+def get_user_connection(user_id):
+    return get_shard_connection(shard_for_user(user_id))
+
+
+class Statement:
+    """Sentencia con nombre: el SQL con %s de psycopg2 y su versión con $n para PREPARE."""
+
+    __slots__ = ('name', 'query', 'prepare_sql', 'params')
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+        self.params = 0
+
+        def number(match):
+            if match.group() == '%%':
+                return '%'
+            self.params += 1
+            return f'${self.params}'
+
+        # PREPARE se envía sin parámetros, así que no pasa por la interpolación
+        body = re.sub(r'%%|%s', number, query)
+        self.prepare_sql = f"PREPARE {name} AS {body}"
+
+
+# Sentencias calientes: se preparan una vez por conexión y se ejecutan con
+# EXECUTE, sin volver a analizar ni planificar el SQL en cada petición
+STATEMENTS = {statement.name: statement for statement in (
+    Statement('user_directory', "SELECT user_id, shard FROM bank.user_directory WHERE username = %s"),
+    Statement('login_user', "SELECT id, username, password, role, full_name, email FROM bank.users WHERE id = %s"),
+    Statement('account_balance', "SELECT balance FROM bank.accounts WHERE user_id = %s"),
+    Statement('account_debit',
+              "UPDATE bank.accounts SET balance = balance - %s WHERE user_id = %s RETURNING balance"),
+    Statement('credit_card_balance', "SELECT balance FROM bank.credit_cards WHERE user_id = %s"),
+    Statement('credit_card_payment', "UPDATE bank.credit_cards SET balance = balance - %s WHERE user_id = %s"),
+    Statement('active_merchant', "SELECT id, name FROM bank.merchants WHERE id = %s AND status = true"),
+    Statement('pending_credit_transaction', """
+        SELECT t.id, t.amount, t.otp_code, m.name as merchant_name,
+               m.id as merchant_id, COALESCE(t.user_id, ec.user_id)
+        FROM bank.credit_transactions t
+        JOIN bank.merchants m ON t.merchant_id = m.id
+        LEFT JOIN bank.encrypted_cards ec ON t.card_id = ec.id
+        WHERE t.id = %s AND t.status = 'PENDING'
+    """),
+    Statement('access_log_insert', """
+        INSERT INTO bank.logs
+        (timestamp, log_type, remote_ip, username, action, http_code)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """),
+    Statement('credit_log_insert', """
+        INSERT INTO bank.credit_transaction_logs
+        (log_type, transaction_id, user_id, merchant_id, amount, status, extra_data, ip_address)
+        VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s)
+        RETURNING id
+    """),
+)}
+
+
+def execute_statement(cur, name, params=()):
+    """
+    Ejecuta la sentencia registrada name. En una conexión del pool la prepara
+    la primera vez y después solo envía EXECUTE. En conexiones que no se
+    reutilizan, o con PREPARED_STATEMENTS=false, ejecuta el SQL tal cual:
+    preparar una sentencia que se usa una sola vez solo añade trabajo.
+    """
+    statement = STATEMENTS[name]
+    conn = cur.connection
+    if (not PREPARED_STATEMENTS or getattr(conn, 'pool_key', None) is None
+            or name in conn.unprepared):
+        return cur.execute(statement.query, params)
+    execute = f"EXECUTE {name}"
+    if statement.params:
+        execute += f" ({', '.join(['%s'] * statement.params)})"
+    # El span lleva el SQL original para que las trazas sigan nombrando la tabla
+    with tracer.db_span(statement.query):
+        if name not in conn.prepared:
+            # PREPARE va aparte para saber si falló él o la ejecución; si
+            # falla, en esta conexión la sentencia se ejecuta sin preparar
+            try:
+                psycopg2.extensions.cursor.execute(cur, statement.prepare_sql)
+            except psycopg2.Error:
+                conn.unprepared.add(name)
+                raise
+            conn.prepared.add(name)
+        try:
+            return psycopg2.extensions.cursor.execute(cur, execute, params)
+        except psycopg2.Error as e:
+            # Si la sesión perdió la sentencia, se vuelve a preparar en el siguiente uso
+            if e.pgcode == psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME:
+                conn.prepared.discard(name)
+            raise
+
+
+_directory_cache = OrderedDict()
+_directory_lock = threading.Lock()
+
+
+def lookup_user(username):
+    """
+    Devuelve (user_id, shard) del directorio de la base principal, o None.
+    Las entradas no cambian, así que los aciertos se cachean en el proceso.
+    """
+    with _directory_lock:
+        if username in _directory_cache:
+            _directory_cache.move_to_end(username)
+            return _directory_cache[username]
     conn = get_connection()
     cur = conn.cursor()
+    try:
+        execute_statement(cur, 'user_directory', (username,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    if row is None:
+        return None
+    with _directory_lock:
+        _directory_cache[username] = row
+        while len(_directory_cache) > DIRECTORY_CACHE_SIZE:
+            _directory_cache.popitem(last=False)
+    return row
+
+
+# SQLSTATE que se resuelven repitiendo la transacción completa
+RETRYABLE_SQLSTATES = {
+    psycopg2.errorcodes.SERIALIZATION_FAILURE: 'serialization_failures',  # 40001
+    psycopg2.errorcodes.DEADLOCK_DETECTED: 'deadlocks',  # 40P01
+}
+
+# Reintentos que le quedan a la petición en curso ([n]), o None fuera de una petición
+_retry_budget = contextvars.ContextVar('tx_retry_budget', default=None)
+
+
+class TransactionConflict(Exception):
+    """Una unidad transaccional agotó sus intentos o el presupuesto de la petición."""
+
+    def __init__(self, name, pgcode, attempts):
+        super().__init__(f"Transaction {name} gave up after {attempts} attempts (SQLSTATE {pgcode})")
+        self.name = name
+        self.pgcode = pgcode
+        self.attempts = attempts
+
+
+class TransactionMetrics:
+    """Contadores por unidad transaccional de este worker."""
+
+    COUNTERS = ('attempts', 'commits', 'rolled_back', 'retries', 'serialization_failures',
+                'deadlocks', 'exhausted', 'budget_exhausted')
+
+    def __init__(self):
+        self._units = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, counter, backoff_ms=0.0):
+        with self._lock:
+            unit = self._units.get(name)
+            if unit is None:
+                unit = self._units[name] = dict.fromkeys(self.COUNTERS, 0)
+                unit['backoff_ms'] = 0.0
+            unit[counter] += 1
+            unit['backoff_ms'] += backoff_ms
+
+    def stats(self):
+        with self._lock:
+            units = {name: dict(unit, backoff_ms=round(unit['backoff_ms'], 3))
+                     for name, unit in self._units.items()}
+        return {
+            'pid': os.getpid(),
+            'isolation_level': TX_ISOLATION_LEVEL,
+            'max_attempts': TX_MAX_ATTEMPTS,
+            'retry_budget': TX_RETRY_BUDGET,
+            'units': units,
+        }
+
+
+# Crear una instancia global de las métricas de transacciones
+transaction_metrics = TransactionMetrics()
+
+
+def reset_retry_budget(retries=TX_RETRY_BUDGET):
+    """Empieza el presupuesto de reintentos de la petición en curso."""
+    _retry_budget.set([retries])
+
+
+def retry_transaction(name, attempt, max_attempts=TX_MAX_ATTEMPTS):
+    """
+    Ejecuta attempt(), un intento completo que abre, trabaja y confirma o
+    deshace, y lo repite si falla por un conflicto de serialización (40001) o
+    un interbloqueo (40P01), con espera exponencial con jitter. Cada reintento
+    consume el presupuesto de la petición en curso. Los demás errores se
+    propagan sin reintentar. Lanza TransactionConflict si se agotan los
+    intentos o el presupuesto.
+    """
+    for number in range(1, max_attempts + 1):
+        transaction_metrics.count(name, 'attempts')
+        try:
+            with tracer.span(f"tx {name}", attempt=number):
+                result = attempt()
+        except psycopg2.Error as e:
+            reason = RETRYABLE_SQLSTATES.get(e.pgcode)
+            if reason is None:
+                transaction_metrics.count(name, 'rolled_back')
+                raise
+            transaction_metrics.count(name, reason)
+            if number == max_attempts:
+                transaction_metrics.count(name, 'exhausted')
+                raise TransactionConflict(name, e.pgcode, number) from e
+            budget = _retry_budget.get()
+            if budget is not None:
+                if budget[0] <= 0:
+                    transaction_metrics.count(name, 'budget_exhausted')
+                    raise TransactionConflict(name, e.pgcode, number) from e
+                budget[0] -= 1
+            # Jitter completo: espera uniforme hasta el tope exponencial del intento
+            delay_ms = random.uniform(0, min(TX_BACKOFF_MAX_MS, TX_BACKOFF_BASE_MS * 2 ** (number - 1)))
+            transaction_metrics.count(name, 'retries', backoff_ms=delay_ms)
+            time.sleep(delay_ms / 1000)
+        except Exception:
+            transaction_metrics.count(name, 'rolled_back')
+            raise
+        else:
+            transaction_metrics.count(name, 'commits')
+            return result
+
+
+def run_transaction(name, connect, work, isolation=TX_ISOLATION_LEVEL):
+    """
+    Ejecuta work(cur) en una transacción sobre connect() con el nivel de
+    aislamiento indicado y la confirma, con los reintentos de
+    retry_transaction. work debe poder repetirse: nada de efectos fuera de la
+    transacción. Devuelve lo que devuelva work.
+    """
+    def attempt():
+        conn = connect()
+        conn.set_session(isolation_level=isolation)
+        cur = conn.cursor()
+        try:
+            result = work(cur)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    return retry_transaction(name, attempt)
+
+
+def transactional(name, connect, isolation=TX_ISOLATION_LEVEL):
+    """
+    Decorador de unidades transaccionales: f(cur, key, ...) se llama como
+    f(key, ...) y se ejecuta con run_transaction sobre connect(key).
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(key, *args, **kwargs):
+            return run_transaction(name, lambda: connect(key),
+                                   lambda cur: f(cur, key, *args, **kwargs), isolation)
+        return wrapper
+    return decorator
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """
+    Callback de espera de psycopg2 para workers gevent: en lugar de bloquear el
+    proceso mientras Postgres responde, cede el control a otros greenlets.
+    """
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+def enable_cooperative_wait():
+    """Activa la espera cooperativa de psycopg2 (solo con el worker gevent)."""
+    psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+
+
+def init_db():
+    """Crea el esquema en la base principal y en cada shard, y el directorio de usuarios."""
+    if _PRIMARY_PARAMS not in _SHARD_PARAMS:
+        _init_schema(None)
+    for shard in range(SHARD_COUNT):
+        _init_schema(shard)
+    _init_directory()
+
+
+def _init_schema(shard):
+    conn = get_connection() if shard is None else get_shard_connection(shard)
+    cur = conn.cursor()
 
     try:
         # Comenzar una transacción
@@ -53,6 +527,21 @@ def init_db():
         );
         """)
 
+        # Modo "hot": número de sub-saldos de la cuenta (0 = una sola fila)
+        cur.execute("""
+        ALTER TABLE bank.accounts ADD COLUMN IF NOT EXISTS shard_count SMALLINT NOT NULL DEFAULT 0;
+        """)
+
+        # Crear la tabla de sub-saldos de cuentas hot
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.account_slots (
+            account_id INTEGER NOT NULL REFERENCES bank.accounts(id),
+            slot SMALLINT NOT NULL,
+            balance NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, slot)
+        );
+        """)
+
         # Crear la tabla de tarjetas de crédito
         cur.execute("""
         CREATE TABLE IF NOT EXISTS bank.credit_cards (
@@ -86,6 +575,18 @@ def init_db():
         );
         """)
 
+        # Crear tabla de tokens revocados (denylist por jti)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.revoked_tokens (
+            id BIGSERIAL PRIMARY KEY,
+            jti CHAR(32) UNIQUE NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL,
+            revoked_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at
+            ON bank.revoked_tokens(expires_at);
+        """)
+
         # Crear tabla de merchants
         cur.execute("""
         CREATE TABLE IF NOT EXISTS bank.merchants (
@@ -123,6 +624,27 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """)
+        # Pagador de la transacción: las tarjetas de un solo uso no pasan por encrypted_cards
+        cur.execute("""
+        ALTER TABLE bank.credit_transactions ADD COLUMN IF NOT EXISTS user_id INTEGER;
+        """)
+
+        # Tarjetas de un solo uso, por transacción y con caducidad (sin WAL)
+        cur.execute("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS bank.ephemeral_cards (
+            transaction_id INTEGER PRIMARY KEY,
+            card_number_hash TEXT NOT NULL,
+            card_type TEXT NOT NULL,
+            last_four CHAR(4) NOT NULL,
+            expiry_date DATE NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_ephemeral_cards_expires_at
+            ON bank.ephemeral_cards(expires_at);
+        CREATE INDEX IF NOT EXISTS idx_encrypted_cards_card_number_hash
+            ON bank.encrypted_cards(card_number_hash);
+        """)
+
         cur.execute("""
            CREATE TABLE IF NOT EXISTS bank.credit_transaction_logs (
                id SERIAL PRIMARY KEY,
@@ -146,34 +668,141 @@ def init_db():
                ON bank.credit_transaction_logs(created_at);
            """)
 
-        # Insertar datos de ejemplo si no existen usuarios
-        cur.execute("SELECT COUNT(*) FROM bank.users;")
-        count = cur.fetchone()[0]
-        if count == 0:
-            # Insertar usuarios de ejemplo
-            sample_users = [
-                ('user1', 'pass1', 'cliente', 'Usuario Uno', 'user1@example.com'),
-                ('user2', 'pass2', 'cliente', 'Usuario Dos', 'user2@example.com'),
-                ('user3', 'pass3', 'cajero', 'Usuario Tres', 'user3@example.com')
-            ]
-            for username, password, role, full_name, email in sample_users:
-                cur.execute("""
-                    INSERT INTO bank.users (username, password, role, full_name, email)
-                    VALUES (%s, %s, %s, %s, %s) RETURNING id;
-                """, (username, password, role, full_name, email))
-                user_id = cur.fetchone()[0]
-                # Crear una cuenta con saldo inicial 1000
-                cur.execute("""
-                    INSERT INTO bank.accounts (balance, user_id)
-                    VALUES (%s, %s);
-                """, (1000, user_id))
-                # Crear una tarjeta de crédito con límite 5000 y deuda 0
-                cur.execute("""
-                    INSERT INTO bank.credit_cards (limit_credit, balance, user_id)
-                    VALUES (%s, %s, %s);
-                """, (5000, 0, user_id))
+        # Rollups horarios por establecimiento y su marca de agua incremental
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.credit_rollup_hourly (
+            merchant_id INTEGER NOT NULL,
+            hour TIMESTAMP NOT NULL,
+            initiated_count BIGINT NOT NULL DEFAULT 0,
+            completed_count BIGINT NOT NULL DEFAULT 0,
+            failed_count BIGINT NOT NULL DEFAULT 0,
+            initiated_amount NUMERIC NOT NULL DEFAULT 0,
+            completed_amount NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (merchant_id, hour)
+        );
+        CREATE INDEX IF NOT EXISTS idx_credit_rollup_hourly_hour
+            ON bank.credit_rollup_hourly(hour);
+        CREATE TABLE IF NOT EXISTS bank.rollup_watermarks (
+            name VARCHAR(50) PRIMARY KEY,
+            last_id BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ
+        );
+        INSERT INTO bank.rollup_watermarks (name) VALUES ('credit_hourly')
+        ON CONFLICT (name) DO NOTHING;
+        """)
+
+        # Crédito retenido por autorizaciones pendientes de OTP
+        cur.execute("""
+        ALTER TABLE bank.credit_cards ADD COLUMN IF NOT EXISTS held NUMERIC NOT NULL DEFAULT 0;
+        """)
 
-            # Insertar merchants de ejemplo
+        # Crear tabla de retenciones de autorización
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.credit_holds (
+            id SERIAL PRIMARY KEY,
+            credit_card_id INTEGER NOT NULL REFERENCES bank.credit_cards(id),
+            transaction_id INTEGER UNIQUE REFERENCES bank.credit_transactions(id),
+            amount NUMERIC NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'HELD',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_credit_holds_expires_at
+            ON bank.credit_holds(expires_at) WHERE status = 'HELD';
+        """)
+
+        # Abonos a la deuda de las tarjetas, para los extractos
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.credit_card_payments (
+            id SERIAL PRIMARY KEY,
+            credit_card_id INTEGER NOT NULL REFERENCES bank.credit_cards(id),
+            user_id INTEGER NOT NULL,
+            amount NUMERIC NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_credit_card_payments_card
+            ON bank.credit_card_payments(credit_card_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_credit_holds_credit_card_id
+            ON bank.credit_holds(credit_card_id) WHERE status = 'CAPTURED';
+        """)
+
+        # Extractos mensuales y checkpoints de los trabajos por lotes
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.credit_card_statements (
+            credit_card_id INTEGER NOT NULL REFERENCES bank.credit_cards(id),
+            period DATE NOT NULL,
+            user_id INTEGER NOT NULL,
+            opening_balance NUMERIC NOT NULL,
+            purchases_count INTEGER NOT NULL,
+            purchases_total NUMERIC NOT NULL,
+            payments_count INTEGER NOT NULL,
+            payments_total NUMERIC NOT NULL,
+            closing_balance NUMERIC NOT NULL,
+            generated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (credit_card_id, period)
+        );
+        CREATE TABLE IF NOT EXISTS bank.batch_checkpoints (
+            job VARCHAR(50) NOT NULL,
+            run_key VARCHAR(50) NOT NULL,
+            first_id BIGINT NOT NULL,
+            last_id BIGINT NOT NULL,
+            rows_written INTEGER NOT NULL,
+            completed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (job, run_key, first_id)
+        );
+        """)
+
+        # Liquidación a comercios: saldo por comercio, lotes y marca de liquidada en
+        # cada transacción. El índice parcial solo contiene las completadas sin liquidar.
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.merchant_settlement_accounts (
+            merchant_id INTEGER PRIMARY KEY REFERENCES bank.merchants(id),
+            balance NUMERIC NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS bank.settlement_batches (
+            id BIGSERIAL PRIMARY KEY,
+            merchant_id INTEGER NOT NULL REFERENCES bank.merchants(id),
+            transactions_count INTEGER NOT NULL,
+            amount NUMERIC NOT NULL,
+            first_transaction_id INTEGER NOT NULL,
+            last_transaction_id INTEGER NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_settlement_batches_merchant
+            ON bank.settlement_batches(merchant_id, created_at);
+        ALTER TABLE bank.credit_transactions ADD COLUMN IF NOT EXISTS settlement_batch_id BIGINT;
+        CREATE INDEX IF NOT EXISTS idx_credit_transactions_unsettled
+            ON bank.credit_transactions(id)
+            WHERE status = 'COMPLETED' AND settlement_batch_id IS NULL;
+        """)
+
+        # Crear tabla de claves de idempotencia (clave y request resumidos en 16 bytes)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.idempotency_keys (
+            key_hash BYTEA PRIMARY KEY,
+            request_hash BYTEA NOT NULL,
+            status SMALLINT NOT NULL DEFAULT 0,
+            http_code SMALLINT,
+            response JSONB,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at
+            ON bank.idempotency_keys(expires_at);
+        """)
+
+        # Ids de cuenta intercalados entre shards para enrutar por número de cuenta
+        if SHARD_COUNT > 1 and shard is not None:
+            cur.execute("SELECT NOT EXISTS (SELECT 1 FROM bank.accounts);")
+            if cur.fetchone()[0]:
+                cur.execute(f"""
+                    ALTER SEQUENCE bank.accounts_id_seq
+                    INCREMENT BY {SHARD_COUNT} RESTART WITH {shard + 1};
+                """)
+
+        # Insertar merchants de ejemplo (datos de referencia en cada base)
+        cur.execute("SELECT COUNT(*) FROM bank.merchants;")
+        if cur.fetchone()[0] == 0:
             cur.execute("""
                 INSERT INTO bank.merchants (name) VALUES
                 ('Tienda A'),
@@ -190,4 +819,109 @@ def init_db():
         raise
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def _init_directory():
+    """
+    Directorio username -> (user_id, shard) y log del coordinador 2PC, ambos en
+    la base principal. Los user_id salen de una secuencia global para que el
+    hash que decide el shard sea estable. Si el directorio está vacío se rellena
+    con los usuarios que ya existan en los shards o con los usuarios de ejemplo.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bank.user_directory (
+            username VARCHAR(50) PRIMARY KEY,
+            user_id INTEGER UNIQUE NOT NULL,
+            shard SMALLINT NOT NULL
+        );
+        CREATE SEQUENCE IF NOT EXISTS bank.global_user_id_seq;
+        CREATE TABLE IF NOT EXISTS bank.transfer_coordinator (
+            gid VARCHAR(64) PRIMARY KEY,
+            sender_id INTEGER NOT NULL,
+            target_id INTEGER NOT NULL,
+            amount NUMERIC NOT NULL,
+            sender_shard SMALLINT NOT NULL,
+            target_shard SMALLINT NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'PREPARING',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            resolved_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS idx_transfer_coordinator_unresolved
+            ON bank.transfer_coordinator(created_at) WHERE resolved_at IS NULL;
+        """)
+        conn.commit()
+
+        cur.execute("SELECT EXISTS (SELECT 1 FROM bank.user_directory);")
+        if cur.fetchone()[0]:
+            return
+
+        # Usuarios ya existentes (por ejemplo, una instalación de una sola base)
+        for shard in range(SHARD_COUNT):
+            shard_conn = get_shard_connection(shard)
+            shard_cur = shard_conn.cursor()
+            try:
+                shard_cur.execute("SELECT username, id FROM bank.users;")
+                users = shard_cur.fetchall()
+            finally:
+                shard_cur.close()
+                shard_conn.close()
+            for username, user_id in users:
+                cur.execute("""
+                    INSERT INTO bank.user_directory (username, user_id, shard)
+                    VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;
+                """, (username, user_id, shard))
+
+        cur.execute("SELECT max(user_id) FROM bank.user_directory;")
+        max_id = cur.fetchone()[0]
+        if max_id is not None:
+            cur.execute("SELECT setval('bank.global_user_id_seq', %s);", (max_id,))
+            conn.commit()
+            return
+
+        # Insertar usuarios de ejemplo, cada uno en el shard de su user_id
+        sample_users = [
+            ('user1', 'pass1', 'cliente', 'Usuario Uno', 'user1@example.com'),
+            ('user2', 'pass2', 'cliente', 'Usuario Dos', 'user2@example.com'),
+            ('user3', 'pass3', 'cajero', 'Usuario Tres', 'user3@example.com')
+        ]
+        for username, password, role, full_name, email in sample_users:
+            cur.execute("SELECT nextval('bank.global_user_id_seq');")
+            user_id = cur.fetchone()[0]
+            shard = shard_for_user(user_id)
+            shard_conn = get_shard_connection(shard)
+            shard_cur = shard_conn.cursor()
+            try:
+                shard_cur.execute("""
+                    INSERT INTO bank.users (id, username, password, role, full_name, email)
+                    VALUES (%s, %s, %s, %s, %s, %s);
+                """, (user_id, username, hash_password(password), role, full_name, email))
+                # Crear una cuenta con saldo inicial 1000
+                shard_cur.execute("""
+                    INSERT INTO bank.accounts (balance, user_id)
+                    VALUES (%s, %s);
+                """, (1000, user_id))
+                # Crear una tarjeta de crédito con límite 5000 y deuda 0
+                shard_cur.execute("""
+                    INSERT INTO bank.credit_cards (limit_credit, balance, user_id)
+                    VALUES (%s, %s, %s);
+                """, (5000, 0, user_id))
+                shard_conn.commit()
+            finally:
+                shard_cur.close()
+                shard_conn.close()
+            cur.execute("""
+                INSERT INTO bank.user_directory (username, user_id, shard)
+                VALUES (%s, %s, %s);
+            """, (username, user_id, shard))
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error initializing user directory: {str(e)}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,207 @@
+# app/events.py
+
+import os
+import queue
+import select
+import threading
+import time
+from app.db import get_shard_connection, SHARD_COUNT
+from app.json_provider import loads
+
+CREDIT_EVENTS_CHANNEL = 'credit_tx_status'
+# Eventos pendientes por cliente; si se llena, el cliente se desconecta
+SSE_CLIENT_QUEUE_SIZE = int(os.environ.get('SSE_CLIENT_QUEUE_SIZE', '256'))
+# Streams abiertos a la vez por worker
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', '500'))
+# Comentario de keepalive cuando no hay eventos, y reconexión sugerida al cliente
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', '3000'))
+# Espera máxima a que el listener escuche antes de leer el estado inicial
+SSE_LISTEN_TIMEOUT_SECONDS = float(os.environ.get('SSE_LISTEN_TIMEOUT_SECONDS', '5'))
+
+
+def publish_status(cur, transaction_ids):
+    """
+    Publica el estado actual de las transacciones con pg_notify. Como NOTIFY
+    es transaccional, el evento se entrega al confirmar la transacción de cur
+    y se descarta si se deshace (o se reintenta).
+    """
+    cur.execute("""
+        SELECT pg_notify(%s, json_build_object(
+            'transaction_id', id, 'merchant_id', merchant_id, 'status', status,
+            'amount', amount, 'at', now())::text)
+        FROM bank.credit_transactions WHERE id = ANY(%s)
+    """, (CREDIT_EVENTS_CHANNEL, list(transaction_ids)))
+
+
+class Subscription:
+    """
+    Un cliente SSE: su filtro y su cola acotada de eventos (payloads JSON).
+    Los ids de transacción son por shard, así que el filtro por transacción
+    es el par (shard, transaction_id).
+    """
+
+    __slots__ = ('merchant_id', 'transaction_id', 'queue', 'overflowed')
+
+    def __init__(self, merchant_id=None, transaction_id=None, size=SSE_CLIENT_QUEUE_SIZE):
+        self.merchant_id = merchant_id
+        self.transaction_id = transaction_id
+        self.queue = queue.Queue(size)
+        self.overflowed = False
+
+
+class CreditEventBroker:
+    """
+    Reparte los cambios de estado de transacciones de crédito a los clientes
+    SSE de este worker. Un único hilo por worker escucha el canal en cada
+    shard (una conexión LISTEN por shard, no por cliente) y entrega cada
+    evento solo a las suscripciones de su comercio o de su transacción en ese
+    shard (los ids de transacción se repiten entre shards). Un
+    cliente lento que llena su cola se marca como desbordado y se desconecta
+    en lugar de frenar al resto.
+    """
+
+    def __init__(self, max_clients=SSE_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._by_merchant = {}
+        self._by_transaction = {}
+        self._clients = 0
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        self._ready = threading.Event()
+        self.stats_counters = {'events': 0, 'delivered': 0, 'overflows': 0, 'rejected': 0}
+
+    # ---------------- Escucha ----------------
+
+    def _ensure_listener(self):
+        """Arranca el hilo de escucha en este proceso (después del fork de gunicorn)."""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            self._ready = threading.Event()
+            thread = threading.Thread(target=self._listen_forever, name='credit-events-listener', daemon=True)
+            thread.start()
+
+    def _listen_forever(self):
+        ready = self._ready
+        while True:
+            conns = []
+            try:
+                for shard in range(SHARD_COUNT):
+                    conn = get_shard_connection(shard)
+                    # Una conexión LISTEN no debe volver al pool al cerrarse
+                    conn.detach()
+                    conns.append(conn)
+                    conn.autocommit = True
+                    with conn.cursor() as cur:
+                        cur.execute(f"LISTEN {CREDIT_EVENTS_CHANNEL}")
+                ready.set()
+                while True:
+                    readable, _, _ = select.select(conns, [], [], 5.0)
+                    for conn in readable:
+                        shard = conns.index(conn)
+                        conn.poll()
+                        while conn.notifies:
+                            self.dispatch(conn.notifies.pop(0).payload, shard)
+            except Exception as e:
+                ready.clear()
+                print(f"Error en el listener de eventos de crédito: {e}")
+                time.sleep(1)
+            finally:
+                for conn in conns:
+                    conn.close()
+
+    def dispatch(self, payload, shard):
+        """
+        Entrega un evento (JSON de publish_status) recibido del shard dado a
+        las suscripciones que lo filtran.
+        """
+        event = loads(payload)
+        with self._lock:
+            self.stats_counters['events'] += 1
+            targets = (self._by_merchant.get(event['merchant_id'], set())
+                       | self._by_transaction.get((shard, event['transaction_id']), set()))
+            for sub in targets:
+                if sub.overflowed:
+                    continue
+                try:
+                    sub.queue.put_nowait(payload)
+                    self.stats_counters['delivered'] += 1
+                except queue.Full:
+                    sub.overflowed = True
+                    self.stats_counters['overflows'] += 1
+                    self._remove(sub)
+
+    # ---------------- Suscripciones ----------------
+
+    def subscribe(self, merchant_id=None, transaction_id=None):
+        """
+        Registra un cliente; transaction_id es el par (shard, id). Devuelve su
+        Subscription o None si el worker está lleno.
+        """
+        self._ensure_listener()
+        sub = Subscription(merchant_id, transaction_id)
+        with self._lock:
+            if self._clients >= self.max_clients:
+                self.stats_counters['rejected'] += 1
+                return None
+            self._clients += 1
+            if merchant_id is not None:
+                self._by_merchant.setdefault(merchant_id, set()).add(sub)
+            if transaction_id is not None:
+                self._by_transaction.setdefault(transaction_id, set()).add(sub)
+        return sub
+
+    def _remove(self, sub):
+        for index, key in ((self._by_merchant, sub.merchant_id), (self._by_transaction, sub.transaction_id)):
+            subs = index.get(key)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del index[key]
+
+    def wait_listening(self, timeout=SSE_LISTEN_TIMEOUT_SECONDS):
+        """
+        Espera a que el listener escuche en todos los shards. Hasta entonces
+        un cambio de estado no llegaría a las suscripciones ya registradas.
+        """
+        return self._ready.wait(timeout)
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._clients -= 1
+            self._remove(sub)
+
+    def stream(self, sub, initial=()):
+        """
+        Genera el stream SSE de una suscripción: primero los eventos iniciales,
+        después cada evento publicado y un keepalive si no llega ninguno.
+        """
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            for payload in initial:
+                yield f"event: status\ndata: {payload}\n\n"
+            while not sub.overflowed:
+                try:
+                    payload = sub.queue.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: status\ndata: {payload}\n\n"
+            # Se perdieron eventos: el cliente debe reconectar y releer el estado
+            yield "event: overflow\ndata: {}\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters, pid=os.getpid(), clients=self._clients,
+                        listening=self._ready.is_set())
+
+
+# Crear una instancia global del broker de eventos
+credit_event_broker = CreditEventBroker()
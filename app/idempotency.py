@@ -0,0 +1,288 @@
+# app/idempotency.py
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, request
+from flask_restx import abort
+from app.db import get_connection
+
+# Configuración (variables de entorno con valores por defecto)
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '60'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Documentación Swagger de la cabecera para los endpoints que la aceptan
+idempotency_header_doc = {
+    IDEMPOTENCY_HEADER: {
+        'in': 'header',
+        'type': 'string',
+        'description': 'Clave única del cliente para reintentos seguros'
+    }
+}
+
+
+class IdempotencyStore:
+    """
+    Almacén de claves de idempotencia: tabla compacta bank.idempotency_keys
+    más una caché LRU en proceso para responder reintentos sin ir a la base.
+    """
+
+    def __init__(self, get_connection_func, cache_size=IDEMPOTENCY_CACHE_SIZE):
+        self.get_connection = get_connection_func
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_hash(user_id, endpoint, key):
+        """Resume (usuario, endpoint, clave) en 16 bytes para la clave primaria."""
+        raw = f"{user_id}:{endpoint}:{key}".encode()
+        return hashlib.sha256(raw).digest()[:16]
+
+    @staticmethod
+    def request_hash(body: bytes):
+        return hashlib.sha256(body).digest()[:16]
+
+    # ---------------- Caché LRU en proceso ----------------
+
+    def _cache_get(self, key_hash):
+        with self._lock:
+            entry = self._cache.get(key_hash)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._cache[key_hash]
+                return None
+            self._cache.move_to_end(key_hash)
+            return entry[1:]
+
+    def _cache_put(self, key_hash, request_hash, http_code, body):
+        with self._lock:
+            self._cache[key_hash] = (time.time() + IDEMPOTENCY_TTL_SECONDS, request_hash, http_code, body)
+            self._cache.move_to_end(key_hash)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---------------- Tabla bank.idempotency_keys ----------------
+
+    def _claim(self, key_hash, request_hash):
+        """
+        Intenta reservar la clave. Devuelve True si esta petición debe ejecutarse.
+        Una reserva caducada (worker caído o respuesta expirada) se puede retomar.
+        """
+        conn = self.get_connection()
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO bank.idempotency_keys (key_hash, request_hash, status, expires_at)
+                VALUES (%s, %s, 0, now() + make_interval(secs => %s))
+                ON CONFLICT (key_hash) DO UPDATE
+                    SET request_hash = EXCLUDED.request_hash,
+                        status = 0,
+                        http_code = NULL,
+                        response = NULL,
+                        expires_at = EXCLUDED.expires_at
+                    WHERE bank.idempotency_keys.expires_at < now()
+                RETURNING key_hash
+            """, (key_hash, request_hash, IDEMPOTENCY_LEASE_SECONDS))
+            return cur.fetchone() is not None
+        finally:
+            cur.close()
+            conn.close()
+
+    def _fetch(self, key_hash):
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT request_hash, status, http_code, response
+                FROM bank.idempotency_keys
+                WHERE key_hash = %s AND expires_at >= now()
+            """, (key_hash,))
+            return cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _complete(self, key_hash, http_code, body):
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE bank.idempotency_keys
+                SET status = 1, http_code = %s, response = %s::jsonb,
+                    expires_at = now() + make_interval(secs => %s)
+                WHERE key_hash = %s
+            """, (http_code, json.dumps(body), IDEMPOTENCY_TTL_SECONDS, key_hash))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _release(self, key_hash):
+        """Libera la reserva para que un reintento pueda volver a ejecutarse."""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM bank.idempotency_keys WHERE key_hash = %s AND status = 0", (key_hash,))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _wait_for_result(self, key_hash):
+        """Espera a que la primera ejecución (en otro proceso) guarde su respuesta."""
+        deadline = time.time() + IDEMPOTENCY_WAIT_SECONDS
+        delay = 0.05
+        while time.time() < deadline:
+            row = self._fetch(key_hash)
+            if row is None:
+                return None
+            if row[1] == 1:
+                return bytes(row[0]), row[2], row[3]
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        abort(409, "A request with this Idempotency-Key is still in progress")
+
+    # ---------------- Ejecución ----------------
+
+    def execute(self, user_id, endpoint, key, body, func):
+        """Ejecuta func una sola vez por clave y repite su respuesta en los reintentos."""
+        key_hash = self.key_hash(user_id, endpoint, key)
+        request_hash = self.request_hash(body)
+
+        while True:
+            cached = self._cache_get(key_hash)
+            if cached is not None:
+                return self._replay(request_hash, *cached)
+
+            # Duplicados concurrentes en este mismo proceso esperan a la primera ejecución
+            with self._lock:
+                event = self._inflight.get(key_hash)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key_hash] = threading.Event()
+            if not owner:
+                event.wait(IDEMPOTENCY_WAIT_SECONDS)
+                if self._cache_get(key_hash) is None and not event.is_set():
+                    abort(409, "A request with this Idempotency-Key is still in progress")
+                continue
+
+            try:
+                if not self._claim(key_hash, request_hash):
+                    stored = self._wait_for_result(key_hash)
+                    if stored is None:
+                        # La reserva fue liberada: reintentar la reclamación
+                        continue
+                    self._cache_put(key_hash, *stored)
+                    return self._replay(request_hash, *stored)
+
+                try:
+                    result = func()
+                except BaseException:
+                    self._release(key_hash)
+                    raise
+
+                response_body, http_code = self._split_result(result)
+                if http_code >= 500:
+                    self._release(key_hash)
+                    return result
+                self._complete(key_hash, http_code, response_body)
+                self._cache_put(key_hash, request_hash, http_code, response_body)
+                return result
+            finally:
+                with self._lock:
+                    self._inflight.pop(key_hash, None)
+                event.set()
+
+    @staticmethod
+    def _split_result(result):
+        if isinstance(result, tuple):
+            return result[0], (result[1] if len(result) > 1 else 200)
+        return result, 200
+
+    @staticmethod
+    def _replay(request_hash, stored_request_hash, http_code, body):
+        if stored_request_hash != request_hash:
+            abort(422, "Idempotency-Key was already used with a different payload")
+        return body, http_code, {'Idempotent-Replayed': 'true'}
+
+    def sweep_expired(self, batch_size=5000):
+        """Elimina en bloques las claves caducadas. Devuelve el total eliminado."""
+        total = 0
+        conn = self.get_connection()
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            while True:
+                cur.execute("""
+                    DELETE FROM bank.idempotency_keys
+                    WHERE key_hash IN (
+                        SELECT key_hash FROM bank.idempotency_keys
+                        WHERE expires_at < now()
+                        LIMIT %s
+                    )
+                """, (batch_size,))
+                total += cur.rowcount
+                if cur.rowcount < batch_size:
+                    break
+        finally:
+            cur.close()
+            conn.close()
+        now = time.time()
+        with self._lock:
+            for key_hash in [k for k, v in self._cache.items() if v[0] < now]:
+                del self._cache[key_hash]
+        return total
+
+
+def idempotent(f):
+    """
+    Decorator para endpoints que mueven dinero. Si la petición trae la cabecera
+    Idempotency-Key, los reintentos devuelven la respuesta original sin volver
+    a tocar las cuentas. Debe aplicarse después de jwt_required.
+    """
+
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            abort(400, "Idempotency-Key is too long")
+        return idempotency_store.execute(
+            g.user['id'],
+            request.path,
+            key,
+            request.get_data(),
+            lambda: f(*args, **kwargs)
+        )
+
+    return decorated
+
+
+# Crear una instancia global del almacén
+idempotency_store = IdempotencyStore(get_connection)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Mantenimiento de claves de idempotencia')
+    parser.add_argument('command', choices=['sweep'])
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == 'sweep':
+        deleted = idempotency_store.sweep_expired(args.batch_size)
+        print(f"Claves de idempotencia eliminadas: {deleted}")
@@ -0,0 +1,63 @@
+# app/json_provider.py
+
+import datetime
+import json
+from decimal import Decimal
+from enum import Enum
+from flask import make_response
+
+# orjson es opcional: si no está instalado se usa json de la librería estándar
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+
+def _default(obj):
+    """Tipos que ninguno de los dos serializadores maneja de forma nativa."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (bytes, memoryview)):
+        return bytes(obj).hex()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj) -> bytes:
+        """Serializa a JSON (bytes UTF-8). Decimal, datetime y Enum sin conversión previa."""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj) -> bytes:
+        """Serializa a JSON (bytes UTF-8). Decimal, datetime y Enum sin conversión previa."""
+        return _encoder.encode(obj).encode()
+
+    def loads(data):
+        return json.loads(data)
+
+
+def dumps_str(obj) -> str:
+    return dumps(obj).decode()
+
+
+def output_json(data, code, headers=None):
+    """Representación application/json de Flask-RESTX usando el serializador rápido."""
+    response = make_response(dumps(data), code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+    return response
+
+
+def init_app(api):
+    """Registra el serializador como representación JSON de la API."""
+    api.representations['application/json'] = output_json
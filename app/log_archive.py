@@ -0,0 +1,362 @@
+# app/log_archive.py
+
+import bisect
+import datetime
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from decimal import Decimal
+from app.db import get_connection
+
+LOG_ARCHIVE_DIR = os.environ.get('LOG_ARCHIVE_DIR', 'archive')
+ARCHIVE_BATCH_ROWS = int(os.environ.get('ARCHIVE_BATCH_ROWS', '100000'))
+ARCHIVE_DELETE_BATCH = int(os.environ.get('ARCHIVE_DELETE_BATCH', '5000'))
+COMPRESSION_LEVEL = 6
+
+MAGIC = b'CBSEG001'
+HEADER_LEN = struct.Struct('<I')
+NULL_INT = -2 ** 63
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Tablas archivables: columnas (nombre, tipo) en orden y columna de usuario
+ARCHIVE_TABLES = {
+    'credit': {
+        'table': 'bank.credit_transaction_logs',
+        'columns': [('id', 'int'), ('log_type', 'str'), ('transaction_id', 'int'), ('user_id', 'int'),
+                    ('merchant_id', 'int'), ('amount', 'decimal'), ('status', 'str'), ('extra_data', 'json'),
+                    ('ip_address', 'str'), ('created_at', 'time')],
+        'user_column': 'user_id',
+    },
+    'access': {
+        'table': 'bank.logs',
+        'columns': [('id', 'int'), ('timestamp', 'time'), ('log_type', 'str'), ('remote_ip', 'str'),
+                    ('username', 'str'), ('action', 'str'), ('http_code', 'int'), ('created_at', 'time')],
+        'user_column': 'username',
+    },
+}
+
+
+# ---------------- Codificación de columnas ----------------
+
+def _to_micros(value):
+    # División entera de timedelta: total_seconds() pasa por float y pierde microsegundos
+    return NULL_INT if value is None else (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _from_micros(value):
+    return None if value == NULL_INT else EPOCH + datetime.timedelta(microseconds=value)
+
+
+def _encode(kind, values):
+    if kind == 'int':
+        raw = array('q', (NULL_INT if v is None else v for v in values)).tobytes()
+    elif kind == 'time':
+        raw = array('q', (_to_micros(v) for v in values)).tobytes()
+    elif kind == 'decimal':
+        raw = json.dumps([None if v is None else str(v) for v in values]).encode()
+    else:
+        raw = json.dumps(values).encode()
+    return zlib.compress(raw, COMPRESSION_LEVEL)
+
+
+def _decode(kind, blob):
+    raw = zlib.decompress(blob)
+    if kind in ('int', 'time'):
+        values = array('q')
+        values.frombytes(raw)
+        return values
+    return json.loads(raw)
+
+
+def _value(kind, values, index):
+    value = values[index]
+    if kind == 'int':
+        return None if value == NULL_INT else value
+    if kind == 'time':
+        return _from_micros(value)
+    return value
+
+
+# ---------------- Segmentos ----------------
+
+def write_segment(path, spec, rows):
+    """
+    Escribe un segmento columnar inmutable: MAGIC, longitud y cabecera JSON con
+    el índice (min/max de tiempo, usuario e id) y luego cada columna comprimida.
+    Las filas deben venir ordenadas por created_at.
+    """
+    names = [name for name, _ in spec['columns']]
+    columns = list(zip(*rows))
+    blobs = [_encode(kind, list(values)) for (_, kind), values in zip(spec['columns'], columns)]
+
+    times = columns[names.index('created_at')]
+    users = [u for u in columns[names.index(spec['user_column'])] if u is not None]
+    ids = columns[names.index('id')]
+    header = {
+        'table': spec['table'],
+        'rows': len(rows),
+        'min_time': _to_micros(min(times)),
+        'max_time': _to_micros(max(times)),
+        'min_user': min(users) if users else None,
+        'max_user': max(users) if users else None,
+        'min_id': min(ids),
+        'max_id': max(ids),
+        'columns': [],
+    }
+    offset = 0
+    for (name, kind), blob in zip(spec['columns'], blobs):
+        header['columns'].append({'name': name, 'type': kind, 'offset': offset, 'length': len(blob)})
+        offset += len(blob)
+
+    header_bytes = json.dumps(header).encode()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as segment:
+        segment.write(MAGIC)
+        segment.write(HEADER_LEN.pack(len(header_bytes)))
+        segment.write(header_bytes)
+        for blob in blobs:
+            segment.write(blob)
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.replace(tmp_path, path)
+    dir_fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return header
+
+
+class Segment:
+    """Segmento abierto con mmap: solo se descomprimen las columnas que se leen."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as segment:
+            self._map = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a log segment: {path}")
+        (length,) = HEADER_LEN.unpack_from(self._map, len(MAGIC))
+        start = len(MAGIC) + HEADER_LEN.size
+        self.header = json.loads(self._map[start:start + length])
+        self._data_start = start + length
+        self._columns = {c['name']: c for c in self.header['columns']}
+        self._cache = {}
+
+    def close(self):
+        self._map.close()
+
+    def column(self, name):
+        if name not in self._cache:
+            meta = self._columns[name]
+            begin = self._data_start + meta['offset']
+            self._cache[name] = _decode(meta['type'], self._map[begin:begin + meta['length']])
+        return self._cache[name]
+
+    def may_contain(self, user=None, start=None, end=None):
+        """Poda por el índice de la cabecera sin descomprimir nada."""
+        h = self.header
+        if start is not None and h['max_time'] < start:
+            return False
+        if end is not None and h['min_time'] > end:
+            return False
+        if user is not None and (h['min_user'] is None or not h['min_user'] <= user <= h['max_user']):
+            return False
+        return True
+
+    def rows(self, indexes):
+        kinds = {c['name']: c['type'] for c in self.header['columns']}
+        columns = {name: self.column(name) for name in kinds}
+        for i in indexes:
+            yield {name: _value(kinds[name], columns[name], i) for name in kinds}
+
+
+# ---------------- Archivador ----------------
+
+class LogArchiver:
+    """Mueve filas antiguas de los logs a segmentos comprimidos en disco."""
+
+    def __init__(self, get_connection_func, directory=LOG_ARCHIVE_DIR):
+        self.get_connection = get_connection_func
+        self.directory = directory
+
+    def _table_dir(self, table):
+        path = os.path.join(self.directory, table)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _delete_ids(self, spec, ids):
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            for i in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+                cur.execute(f"DELETE FROM {spec['table']} WHERE id = ANY(%s)",
+                            (list(ids[i:i + ARCHIVE_DELETE_BATCH]),))
+                conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _finish_pending(self, table):
+        """Completa los borrados de segmentos escritos en una ejecución interrumpida."""
+        spec = ARCHIVE_TABLES[table]
+        directory = self._table_dir(table)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.seg.pending'):
+                path = os.path.join(directory, name)
+                segment = Segment(path)
+                try:
+                    ids = [v for v in segment.column('id')]
+                finally:
+                    segment.close()
+                self._delete_ids(spec, ids)
+                os.replace(path, path[:-len('.pending')])
+
+    def archive(self, table, before, batch_rows=ARCHIVE_BATCH_ROWS):
+        """
+        Archiva las filas con created_at < before en segmentos de hasta
+        batch_rows filas y las borra de Postgres en lotes. Devuelve el total.
+        """
+        spec = ARCHIVE_TABLES[table]
+        directory = self._table_dir(table)
+        self._finish_pending(table)
+        column_list = ', '.join(name for name, _ in spec['columns'])
+        total = 0
+        while True:
+            conn = self.get_connection()
+            cur = conn.cursor()
+            try:
+                cur.execute(f"""
+                    SELECT {column_list} FROM {spec['table']}
+                    WHERE created_at < %s
+                    ORDER BY created_at, id
+                    LIMIT %s
+                """, (before, batch_rows))
+                rows = cur.fetchall()
+            finally:
+                cur.close()
+                conn.close()
+            if not rows:
+                return total
+
+            # El segmento queda como .pending hasta que sus filas se han borrado
+            first_id = min(row[0] for row in rows)
+            last_id = max(row[0] for row in rows)
+            path = os.path.join(directory, f"{table}-{first_id:012d}-{last_id:012d}.seg.pending")
+            write_segment(path, spec, rows)
+            self._delete_ids(spec, [row[0] for row in rows])
+            os.replace(path, path[:-len('.pending')])
+            total += len(rows)
+            print(f"Segmento {os.path.basename(path[:-len('.pending')])}: {len(rows)} filas")
+            if len(rows) < batch_rows:
+                return total
+
+    # ---------------- Lectura ----------------
+
+    def segments(self, table, include_pending=False):
+        """
+        Segmentos confirmados de table. Los .pending aún pueden tener sus filas
+        en Postgres, así que las consultas no los leen para no duplicarlas.
+        """
+        directory = self._table_dir(table)
+        names = [n for n in os.listdir(directory)
+                 if n.endswith('.seg') or (include_pending and n.endswith('.seg.pending'))]
+        return [os.path.join(directory, n) for n in sorted(names)]
+
+    def query(self, table='credit', user=None, transaction_id=None,
+              start_date=None, end_date=None, limit=100):
+        """
+        Responde los mismos filtros que get_transaction_logs sobre el archivo,
+        ordenando por created_at descendente. Solo se descomprimen las columnas
+        de los segmentos que el índice no descarta.
+        """
+        spec = ARCHIVE_TABLES[table]
+        start = _to_micros(start_date) if start_date is not None else None
+        end = _to_micros(end_date) if end_date is not None else None
+
+        opened = [Segment(path) for path in self.segments(table)]
+        opened.sort(key=lambda s: s.header['max_time'], reverse=True)
+        matches = []
+        try:
+            for segment in opened:
+                # Con suficientes resultados, los segmentos más antiguos ya no entran
+                if len(matches) >= limit and segment.header['max_time'] < matches[limit - 1][0]:
+                    break
+                if not segment.may_contain(user, start, end):
+                    continue
+                times = segment.column('created_at')
+                lo = bisect.bisect_left(times, start) if start is not None else 0
+                hi = bisect.bisect_right(times, end) if end is not None else len(times)
+                candidates = range(lo, hi)
+                if user is not None:
+                    users = segment.column(spec['user_column'])
+                    candidates = [i for i in candidates if users[i] == user]
+                if transaction_id is not None and 'transaction_id' in segment._columns:
+                    transactions = segment.column('transaction_id')
+                    candidates = [i for i in candidates if transactions[i] == transaction_id]
+                for i, row in zip(candidates, segment.rows(candidates)):
+                    matches.append((times[i], row['id'], row))
+                matches.sort(key=lambda m: (m[0], m[1]), reverse=True)
+                del matches[limit:]
+        finally:
+            for segment in opened:
+                segment.close()
+
+        result = []
+        for _, _, row in matches:
+            if 'amount' in row:
+                row['amount'] = float(Decimal(row['amount'])) if row['amount'] else None
+            row['created_at'] = row['created_at'].isoformat()
+            if 'timestamp' in row and row['timestamp'] is not None:
+                row['timestamp'] = row['timestamp'].isoformat()
+            result.append(row)
+        return result
+
+
+# Crear una instancia global del archivador
+log_archiver = LogArchiver(get_connection)
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.json_provider import dumps_str
+
+    def parse_date(value):
+        return datetime.datetime.fromisoformat(value)
+
+    parser = argparse.ArgumentParser(description='Archivo frío de logs en segmentos comprimidos')
+    sub = parser.add_subparsers(dest='command', required=True)
+    archive = sub.add_parser('archive', help='Mueve filas antiguas a segmentos')
+    archive.add_argument('--table', choices=ARCHIVE_TABLES, default='credit')
+    archive.add_argument('--before', type=parse_date, required=True)
+    archive.add_argument('--batch-rows', type=int, default=ARCHIVE_BATCH_ROWS)
+    query = sub.add_parser('query', help='Consulta el archivo')
+    query.add_argument('--table', choices=ARCHIVE_TABLES, default='credit')
+    query.add_argument('--user-id', type=int, help='user_id (credit)')
+    query.add_argument('--username', help='username (access)')
+    query.add_argument('--transaction-id', type=int)
+    query.add_argument('--start', type=parse_date)
+    query.add_argument('--end', type=parse_date)
+    query.add_argument('--limit', type=int, default=100)
+    listing = sub.add_parser('list', help='Muestra el índice de los segmentos')
+    listing.add_argument('--table', choices=ARCHIVE_TABLES, default='credit')
+    args = parser.parse_args()
+
+    if args.command == 'archive':
+        print(f"Filas archivadas: {log_archiver.archive(args.table, args.before, args.batch_rows)}")
+    elif args.command == 'query':
+        user = args.user_id if args.table == 'credit' else args.username
+        for row in log_archiver.query(args.table, user, args.transaction_id, args.start, args.end, args.limit):
+            print(dumps_str(row))
+    else:
+        for path in log_archiver.segments(args.table, include_pending=True):
+            segment = Segment(path)
+            h = segment.header
+            print(f"{os.path.basename(path)}  filas={h['rows']}  "
+                  f"tiempo=[{_from_micros(h['min_time'])} .. {_from_micros(h['max_time'])}]  "
+                  f"usuario=[{h['min_user']} .. {h['max_user']}]  "
+                  f"bytes={os.path.getsize(path)}")
+            segment.close()
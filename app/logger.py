@@ -1,7 +1,12 @@
 from enum import Enum
 import datetime
+import os
 from contextlib import contextmanager
-from app.db import get_connection
+from app.db import get_connection, execute_statement
+from app.tracing import tracer
+
+# Destino de los logs de acceso: 'db' (bank.logs) o 'mmap' (segmentos binarios por worker)
+LOG_SINK = os.environ.get('LOG_SINK', 'db')
 
 class LogType(Enum):
     INFO = "INFO"
@@ -10,10 +15,11 @@ class LogType(Enum):
     DEBUG = "DEBUG"
     CRITICAL = "CRITICAL"
 
-class Logger:
+class DatabaseLogSink:
+    """Inserta cada log en bank.logs."""
+
     def __init__(self, get_connection_func):
         self.get_connection = get_connection_func
-        print("Iniciando sistema de logs en base de datos...")
 
     @contextmanager
     def get_db_connection(self):
@@ -29,20 +35,14 @@ class Logger:
             if conn:
                 conn.close()
 
-    def log(self, log_type, remote_ip, username, action, http_code, additional_info=None):
+    def write(self, timestamp, log_type, remote_ip, username, action, http_code, additional_info=None):
         print("⚠️ Intentando escribir log...")
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        try:  # Ahora está correctamente indentado dentro del método log
+        try:
             with self.get_db_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        INSERT INTO bank.logs 
-                        (timestamp, log_type, remote_ip, username, action, http_code)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (
-                        timestamp,
-                        log_type.value,
+                    execute_statement(cur, 'access_log_insert', (
+                        timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                        log_type,
                         remote_ip,
                         username,
                         action,
@@ -52,5 +52,27 @@ class Logger:
         except Exception as e:
             print(f"Error al guardar log en base de datos: {e}")
 
+def create_sink(name=LOG_SINK):
+    if name == 'db':
+        print("Iniciando sistema de logs en base de datos...")
+        return DatabaseLogSink(get_connection)
+    if name == 'mmap':
+        from app.loggers.mmap_sink import MmapLogSink
+        print("Iniciando sistema de logs en segmentos mapeados en memoria...")
+        return MmapLogSink()
+    raise ValueError(f"Unsupported LOG_SINK: {name}")
+
+class Logger:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def log(self, log_type, remote_ip, username, action, http_code, additional_info=None):
+        try:
+            with tracer.span('access_log'):
+                self.sink.write(datetime.datetime.now(), log_type.value, remote_ip, username,
+                                action, http_code, additional_info)
+        except Exception as e:
+            print(f"Error al guardar log: {e}")
+
 # Crear una instancia global del logger
-logger = Logger(get_connection)
\ No newline at end of file
+logger = Logger(create_sink())
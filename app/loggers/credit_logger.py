@@ -2,17 +2,17 @@
 
 from datetime import datetime
 from enum import Enum
-import json
-from decimal import Decimal
-from app.db import get_connection
+from app.db import get_connection, execute_statement
+from app.json_provider import dumps, dumps_str
+from app.tracing import tracer
 from flask import request
 
+# Campos que nunca se registran
+SENSITIVE_FIELDS = frozenset(['card_number', 'cvv', 'encrypted_data'])
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+# Columnas de bank.credit_transaction_logs en el orden de las consultas
+LOG_COLUMNS = ('id', 'log_type', 'transaction_id', 'user_id', 'merchant_id',
+               'amount', 'status', 'extra_data', 'ip_address', 'created_at')
 
 
 class CreditLogType(Enum):
@@ -26,6 +26,7 @@ class CreditLogType(Enum):
 
 
 class CreditTransactionLogger:
+    @tracer.traced('credit_logger.log_transaction')
     def log_transaction(self,
                         log_type: CreditLogType,
                         transaction_id: int,
@@ -42,13 +43,13 @@ class CreditTransactionLogger:
             # Preparar los datos para el log
             extra_data_safe = None
             if extra_data:
-                # Filtrar datos sensibles
-                safe_data = {
-                    k: float(v) if isinstance(v, Decimal) else v
-                    for k, v in extra_data.items()
-                    if k not in ['card_number', 'cvv', 'encrypted_data']
-                }
-                extra_data_safe = json.dumps(safe_data, cls=DecimalEncoder)
+                # Filtrar datos sensibles; Decimal y datetime los maneja el serializador
+                if SENSITIVE_FIELDS.isdisjoint(extra_data):
+                    extra_data_safe = dumps_str(extra_data)
+                else:
+                    extra_data_safe = dumps_str({
+                        k: v for k, v in extra_data.items() if k not in SENSITIVE_FIELDS
+                    })
 
             # Obtener la IP del cliente
             ip_address = request.remote_addr if request else None
@@ -59,12 +60,7 @@ class CreditTransactionLogger:
 
             try:
                 # Insertar el log en la base de datos
-                cur.execute("""
-                    INSERT INTO bank.credit_transaction_logs 
-                    (log_type, transaction_id, user_id, merchant_id, amount, status, extra_data, ip_address)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s)
-                    RETURNING id
-                """, (
+                execute_statement(cur, 'credit_log_insert', (
                     log_type.value,
                     transaction_id,
                     user_id,
@@ -91,19 +87,11 @@ class CreditTransactionLogger:
         except Exception as e:
             print(f"Error logging transaction: {str(e)}")
 
-    def get_transaction_logs(self,
-                             user_id: int = None,
-                             transaction_id: int = None,
-                             start_date: datetime = None,
-                             end_date: datetime = None,
-                             limit: int = 100) -> list:
-        """
-        Recupera logs de transacciones con varios filtros opcionales.
-        """
+    def _fetch_transaction_logs(self, user_id, transaction_id, start_date, end_date, limit) -> list:
+        """Ejecuta la consulta de logs con los filtros dados y devuelve las filas."""
+        conn = get_connection()
+        cur = conn.cursor()
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-
             query = """
                 SELECT 
                     id, 
@@ -141,7 +129,22 @@ class CreditTransactionLogger:
             params.append(limit)
 
             cur.execute(query, params)
-            logs = cur.fetchall()
+            return cur.fetchall()
+        finally:
+            cur.close()
+            conn.close()
+
+    def get_transaction_logs(self,
+                             user_id: int = None,
+                             transaction_id: int = None,
+                             start_date: datetime = None,
+                             end_date: datetime = None,
+                             limit: int = 100) -> list:
+        """
+        Recupera logs de transacciones con varios filtros opcionales.
+        """
+        try:
+            logs = self._fetch_transaction_logs(user_id, transaction_id, start_date, end_date, limit)
 
             # Convertir a lista de diccionarios
             result = []
@@ -164,9 +167,20 @@ class CreditTransactionLogger:
         except Exception as e:
             print(f"Error retrieving logs: {str(e)}")
             return []
-        finally:
-            cur.close()
-            conn.close()
+
+    def export_transaction_logs(self,
+                                user_id: int = None,
+                                transaction_id: int = None,
+                                start_date: datetime = None,
+                                end_date: datetime = None,
+                                limit: int = 100) -> bytes:
+        """
+        Igual que get_transaction_logs pero devuelve el JSON ya serializado:
+        las filas pasan directamente al serializador, que convierte Decimal y
+        datetime sin copias intermedias.
+        """
+        logs = self._fetch_transaction_logs(user_id, transaction_id, start_date, end_date, limit)
+        return dumps([dict(zip(LOG_COLUMNS, log)) for log in logs])
 
 
 # Crear una instancia global del logger
@@ -0,0 +1,255 @@
+# app/loggers/mmap_sink.py
+
+import datetime
+import ipaddress
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+LOG_MMAP_DIR = os.environ.get('LOG_MMAP_DIR', 'logs/access')
+LOG_SEGMENT_BYTES = int(os.environ.get('LOG_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+# 0 deja el volcado a disco al sistema operativo (sobrevive a la caída del proceso)
+LOG_MMAP_FLUSH_EVERY = int(os.environ.get('LOG_MMAP_FLUSH_EVERY', '0'))
+
+FILE_MAGIC = b'CBLOG001'
+FILE_HEADER = struct.Struct('<8sII')  # magic, tamaño de registro, pid
+# crc32, timestamp (µs), tipo, reservado, código HTTP, IP (16 bytes), usuario, acción
+RECORD = struct.Struct('<IqBBH16s32s84s')
+LOG_TYPES = ('INFO', 'WARNING', 'ERROR', 'DEBUG', 'CRITICAL')
+SEGMENT_NAME = re.compile(r'^access-(\d+)-(\d+)\.log$')
+
+
+def _pack_ip(remote_ip):
+    try:
+        return ipaddress.ip_address(remote_ip or '').packed.rjust(16, b'\0')
+    except ValueError:
+        return b'\0' * 16
+
+
+def _unpack_ip(raw):
+    if raw[:12] == b'\0' * 12:
+        return str(ipaddress.IPv4Address(raw[12:])) if raw[12:] != b'\0' * 4 else None
+    return str(ipaddress.IPv6Address(raw))
+
+
+def _text(value, size):
+    # Se trunca al ancho del campo; un carácter multibyte cortado se descarta al leer
+    return (value or '').encode('utf-8')[:size]
+
+
+def encode_record(timestamp, log_type, remote_ip, username, action, http_code):
+    body = RECORD.pack(
+        0,
+        int(timestamp.timestamp() * 1_000_000),
+        LOG_TYPES.index(log_type) + 1 if log_type in LOG_TYPES else 0,
+        0,
+        int(http_code or 0),
+        _pack_ip(remote_ip),
+        _text(username, 32),
+        _text(action, 84),
+    )
+    return struct.pack('<I', zlib.crc32(body[4:])) + body[4:]
+
+
+def decode_record(raw):
+    """Devuelve el registro como dict, o None si el slot está vacío o roto."""
+    crc, micros, kind, _, http_code, ip, username, action = RECORD.unpack(raw)
+    if micros == 0 or crc != zlib.crc32(raw[4:]):
+        return None
+    return {
+        'timestamp': datetime.datetime.fromtimestamp(micros / 1_000_000),
+        'log_type': LOG_TYPES[kind - 1] if 0 < kind <= len(LOG_TYPES) else 'UNKNOWN',
+        'remote_ip': _unpack_ip(ip),
+        'username': username.rstrip(b'\0').decode('utf-8', 'ignore'),
+        'action': action.rstrip(b'\0').decode('utf-8', 'ignore'),
+        'http_code': str(http_code),
+    }
+
+
+def recover_tail(buffer, capacity):
+    """
+    Posición del primer slot vacío o con CRC inválido. Un registro a medio
+    escribir en una caída se descarta y su slot se pone a cero para reutilizarlo.
+    """
+    for index in range(capacity):
+        offset = FILE_HEADER.size + index * RECORD.size
+        if decode_record(buffer[offset:offset + RECORD.size]) is None:
+            if any(buffer[offset:offset + RECORD.size]):
+                buffer[offset:offset + RECORD.size] = b'\0' * RECORD.size
+            return index
+    return capacity
+
+
+class MmapLogSink:
+    """
+    Sink de logs de acceso en ficheros binarios mapeados en memoria.
+
+    Cada worker escribe en sus propios segmentos (access-<pid>-<seq>.log) de
+    tamaño fijo, preasignados y con registros de RECORD.size bytes protegidos
+    por CRC. Escribir un registro es copiar bytes en el mapa; al llenarse un
+    segmento se abre el siguiente. El mapa se abre en el primer log de cada
+    proceso, así que es seguro con workers creados por fork.
+    """
+
+    def __init__(self, directory=LOG_MMAP_DIR, segment_bytes=LOG_SEGMENT_BYTES,
+                 flush_every=LOG_MMAP_FLUSH_EVERY):
+        self.directory = directory
+        self.capacity = max(1, (segment_bytes - FILE_HEADER.size) // RECORD.size)
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pid = None
+        self._map = None
+        self._fd = None
+        self._sequence = 0
+        self._position = 0
+
+    def _segment_path(self, sequence):
+        return os.path.join(self.directory, f"access-{self._pid}-{sequence:06d}.log")
+
+    def _open(self, sequence):
+        self._close()
+        path = self._segment_path(sequence)
+        size = FILE_HEADER.size + self.capacity * RECORD.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o640)
+        existing = os.fstat(self._fd).st_size
+        if existing < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, max(existing, size))
+        if self._map[:len(FILE_MAGIC)] == FILE_MAGIC:
+            # El pid se ha reutilizado o el proceso se reinició: continuar tras el último registro válido
+            capacity = (len(self._map) - FILE_HEADER.size) // RECORD.size
+            self._position = recover_tail(self._map, capacity)
+        else:
+            self._map[:FILE_HEADER.size] = FILE_HEADER.pack(FILE_MAGIC, RECORD.size, self._pid)
+            self._position = 0
+        self._sequence = sequence
+
+    def _close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+    def _ensure_open(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Tras un fork el mapa heredado pertenece al proceso padre
+            if self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._map = None
+            self._pid = pid
+            os.makedirs(self.directory, exist_ok=True)
+            sequences = [int(m.group(2)) for m in map(SEGMENT_NAME.match, os.listdir(self.directory))
+                         if m and int(m.group(1)) == pid]
+            self._open(max(sequences, default=0))
+
+    def write(self, timestamp, log_type, remote_ip, username, action, http_code, additional_info=None):
+        record = encode_record(timestamp, log_type, remote_ip, username, action, http_code)
+        with self._lock:
+            self._ensure_open()
+            if self._position >= (len(self._map) - FILE_HEADER.size) // RECORD.size:
+                self._open(self._sequence + 1)
+            offset = FILE_HEADER.size + self._position * RECORD.size
+            self._map[offset:offset + RECORD.size] = record
+            self._position += 1
+            if self.flush_every and self._position % self.flush_every == 0:
+                self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def read_segment(path, start=0):
+    """
+    Itera los registros válidos de un segmento, desde el índice start, hasta el
+    primer slot vacío o roto.
+    """
+    with open(path, 'rb') as segment:
+        if os.fstat(segment.fileno()).st_size < FILE_HEADER.size:
+            return
+        buffer = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, record_size, _ = FILE_HEADER.unpack_from(buffer)
+        if magic != FILE_MAGIC or record_size != RECORD.size:
+            raise ValueError(f"Not an access log segment: {path}")
+        first = FILE_HEADER.size + start * RECORD.size
+        for offset in range(first, len(buffer) - RECORD.size + 1, RECORD.size):
+            record = decode_record(buffer[offset:offset + RECORD.size])
+            if record is None:
+                break
+            yield record
+    finally:
+        buffer.close()
+
+
+def list_segments(directory, pid=None):
+    segments = []
+    for name in os.listdir(directory):
+        match = SEGMENT_NAME.match(name)
+        if match and (pid is None or int(match.group(1)) == pid):
+            segments.append((int(match.group(1)), int(match.group(2)), os.path.join(directory, name)))
+    return [path for _, _, path in sorted(segments)]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from app.json_provider import dumps_str
+
+    parser = argparse.ArgumentParser(description='Lectura de los segmentos binarios de logs de acceso')
+    parser.add_argument('command', choices=['decode', 'tail'])
+    parser.add_argument('--dir', default=LOG_MMAP_DIR)
+    parser.add_argument('--pid', type=int, help='Solo los segmentos de este worker')
+    parser.add_argument('--type', choices=LOG_TYPES)
+    parser.add_argument('--user')
+    parser.add_argument('--action', help='Subcadena de la acción')
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat)
+    parser.add_argument('--json', action='store_true', help='Una línea JSON por registro')
+    parser.add_argument('-n', '--lines', type=int, default=20, help='Registros iniciales de tail')
+    parser.add_argument('--interval', type=float, default=1.0, help='Segundos entre lecturas de tail')
+    args = parser.parse_args()
+
+    def matches(record):
+        return ((args.type is None or record['log_type'] == args.type)
+                and (args.user is None or record['username'] == args.user)
+                and (args.action is None or args.action in record['action'])
+                and (args.since is None or record['timestamp'] >= args.since))
+
+    def show(record):
+        if args.json:
+            print(dumps_str(record), flush=True)
+        else:
+            print(f"{record['timestamp'].isoformat(sep=' ')} {record['log_type']:<8} {record['http_code']} "
+                  f"{record['remote_ip'] or '-'} {record['username'] or '-'} {record['action']}", flush=True)
+
+    if args.command == 'decode':
+        for path in list_segments(args.dir, args.pid):
+            for record in read_segment(path):
+                if matches(record):
+                    show(record)
+    else:
+        # Último registro leído de cada segmento; los segmentos solo crecen
+        seen = {}
+        first = []
+        for path in list_segments(args.dir, args.pid):
+            records = list(read_segment(path))
+            seen[path] = len(records)
+            first.extend(r for r in records if matches(r))
+        first.sort(key=lambda r: r['timestamp'])
+        for record in first[-args.lines:]:
+            show(record)
+        while True:
+            time.sleep(args.interval)
+            fresh = []
+            for path in list_segments(args.dir, args.pid):
+                records = list(read_segment(path, seen.get(path, 0)))
+                fresh.extend(r for r in records if matches(r))
+                seen[path] = seen.get(path, 0) + len(records)
+            for record in sorted(fresh, key=lambda r: r['timestamp']):
+                show(record)
@@ -1,12 +1,27 @@
 import secrets
 from app.auth import generate_jwt_token
-from app.auth import jwt_required
-from flask import Flask, request, g
+from app.auth import jwt_required, decode_jwt_token
+from app.revocation import token_denylist
+from app.passwords import password_hasher, PasswordQueueFull
+from flask import Flask, Response, request, g, stream_with_context
 from flask_restx import Api, Resource, fields # type: ignore
 from functools import wraps
-from app.db import get_connection, init_db
+from datetime import datetime, timedelta, timezone
+from app.db import get_connection, get_shard_connection, get_user_connection, init_db
+from app.db import lookup_user, shard_for_account, shard_for_user, execute_statement, connection_pool
+from app.db import transactional, reset_retry_budget, transaction_metrics, TransactionConflict
 import logging
 from app.services.credit_service import credit_service
+from app.services.account_service import account_service
+from app.services.rollup_service import credit_rollup_service
+from app.services.transfer_service import transfer_service
+from app.idempotency import idempotent, idempotency_header_doc
+from app.admission import admission_controller
+from app.loggers.credit_logger import credit_logger
+from app import json_provider
+from app.tracing import tracer
+from app.validation import precompile_models, PRECOMPILED_VALIDATORS
+from app.events import credit_event_broker
 
 # COLOCA EL CÓDIGO DE INTEGRACIÓN AQUÍ ↓
 from app.logger import logger, LogType
@@ -21,7 +36,8 @@ def log_request(f):
         logger.log(LogType.INFO, remote_ip, username, action, "200")
 
         try:
-            response = f(*args, **kwargs)
+            with tracer.span('handler', endpoint=request.endpoint):
+                response = f(*args, **kwargs)
             return response
         except Exception as e:
             logger.log(LogType.ERROR, remote_ip, username, action, "500", {"error": str(e)})
@@ -52,9 +68,25 @@ api = Api(
     security='Bearer'
 )
 
+# Serialize every JSON response with the fast provider (Decimal/datetime aware)
+json_provider.init_app(api)
+
+# Per-request trace context (head-sampled, exported to TRACE_DIR)
+tracer.init_app(app)
+
+# Each request gets a fresh budget of transaction retries
+@app.before_request
+def start_retry_budget():
+    reset_retry_budget()
+
 # Create namespaces for authentication and bank operations
 auth_ns = api.namespace('auth', description='Operaciones de autenticación')
-bank_ns = api.namespace('bank', description='Operaciones bancarias')
+bank_ns = api.namespace('bank', description='Operaciones bancarias',
+                        decorators=[admission_controller.admit])
+ops_ns = api.namespace('ops', description='Estado y métricas operativas')
+analytics_ns = api.namespace('analytics', description='Analítica sobre rollups precalculados')
+# Long-lived streams stay out of bank_ns so they do not hold admission slots
+events_ns = api.namespace('events', description='Streams de eventos (server-sent events)')
 
 # Define the expected payload models for Swagger
 login_model = auth_ns.model('Login', {
@@ -95,6 +127,10 @@ pay_credit_balance_model = bank_ns.model('PayCreditBalance', {
     'amount': fields.Float(required=True, description='Monto a abonar a la deuda de la tarjeta', example=50)
 })
 
+# Compile the payload models once into fast validators with the same 400 errors
+if PRECOMPILED_VALIDATORS:
+    precompile_models(api)
+
 # ---------------- Authentication Endpoints ----------------
 
 @auth_ns.route('/login')
@@ -109,11 +145,32 @@ class Login(Resource):
         username = data.get("username")
         password = data.get("password")
         
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, username, password, role, full_name, email FROM bank.users WHERE username = %s", (username,))
-        user = cur.fetchone()
-        if user and user[2] == password:
+        # The directory on the primary database tells which shard holds the user
+        entry = lookup_user(username)
+        user = None
+        if entry:
+            conn = get_shard_connection(entry[1])
+            cur = conn.cursor()
+            execute_statement(cur, 'login_user', (entry[0],))
+            user = cur.fetchone()
+            # Release the connection before hashing; verification runs in the process pool
+            cur.close()
+            conn.close()
+        try:
+            valid, new_hash = password_hasher.verify(password, user[2] if user else None)
+        except PasswordQueueFull:
+            # Also raised (PasswordTimeout) when the pool does not answer in time
+            api.abort(503, "Login service busy, retry later")
+        if valid:
+            if new_hash:
+                # Transparent migration of plaintext or outdated hashes
+                conn = get_shard_connection(entry[1])
+                cur = conn.cursor()
+                cur.execute("UPDATE bank.users SET password = %s WHERE id = %s AND password = %s",
+                            (new_hash, user[0], user[2]))
+                conn.commit()
+                cur.close()
+                conn.close()
 
             # Generate a new token for the user
             user_data={
@@ -125,12 +182,8 @@ class Login(Resource):
             }
 
             token = generate_jwt_token(user_data)
-            cur.close()
-            conn.close()
             return {"message": "Login successful", "token": token, "user":user_data}, 200
         else:
-            cur.close()
-            conn.close()
             api.abort(401, "Invalid credentials")
 
 @auth_ns.route('/logout')
@@ -143,17 +196,11 @@ class Logout(Resource):
         if not auth_header.startswith("Bearer "):
             api.abort(401, "Authorization header missing or invalid")
         token = auth_header.split(" ")[1]
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM bank.tokens WHERE token = %s", (token,))
-        if cur.rowcount == 0:
-            conn.commit()
-            cur.close()
-            conn.close()
+        payload = decode_jwt_token(token)
+        if not payload.get('jti'):
             api.abort(401, "Invalid token")
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Revoke the token's jti until it would have expired anyway
+        token_denylist.revoke(payload['jti'], datetime.fromtimestamp(payload['exp'], tz=timezone.utc))
         return {"message": "Logout successful"}, 200
 
 # ---------------- Token-Required Decorator ----------------
@@ -190,6 +237,61 @@ def token_required(f):
         return f(*args, **kwargs)
     return decorated
 
+# ---------------- Transactional Units ----------------
+# Each unit runs in its own transaction at TX_ISOLATION_LEVEL and is retried as
+# a whole on serialization failures and deadlocks, so it must not have effects
+# outside the database transaction.
+
+# Account numbers are interleaved across shards
+@transactional('deposit', lambda account_number: get_shard_connection(shard_for_account(account_number)))
+def deposit_funds(cur, account_number, amount):
+    # Hot accounts take the credit on one of their sub-balance slots
+    new_balance = account_service.credit(cur, account_number, amount)
+    if new_balance is None:
+        raise LookupError("Account not found")
+    return new_balance
+
+@transactional('withdraw', get_user_connection)
+def withdraw_funds(cur, user_id, amount):
+    account_service.lock_for_debit(cur, user_id)
+    execute_statement(cur, 'account_balance', (user_id,))
+    row = cur.fetchone()
+    if not row:
+        raise LookupError("Account not found")
+    if float(row[0]) < amount:
+        raise ValueError("Insufficient funds")
+    execute_statement(cur, 'account_debit', (amount, user_id))
+    return float(cur.fetchone()[0])
+
+@transactional('pay_credit_balance', get_user_connection)
+def pay_credit_debt(cur, user_id, amount):
+    # Lock the account and check its funds
+    account_service.lock_for_debit(cur, user_id)
+    execute_statement(cur, 'account_balance', (user_id,))
+    row = cur.fetchone()
+    if not row:
+        raise LookupError("Account not found")
+    if float(row[0]) < amount:
+        raise ValueError("Insufficient funds in account")
+    # Get current credit card debt
+    execute_statement(cur, 'credit_card_balance', (user_id,))
+    row = cur.fetchone()
+    if not row:
+        raise LookupError("Credit card not found")
+    payment = min(amount, float(row[0]))
+    execute_statement(cur, 'account_debit', (payment, user_id))
+    execute_statement(cur, 'credit_card_payment', (payment, user_id))
+    if payment > 0:
+        # Record the payment for the monthly statements
+        cur.execute("""
+            INSERT INTO bank.credit_card_payments (credit_card_id, user_id, amount)
+            SELECT id, user_id, %s FROM bank.credit_cards WHERE user_id = %s ORDER BY id LIMIT 1
+        """, (payment, user_id))
+    execute_statement(cur, 'account_balance', (user_id,))
+    new_account_balance = float(cur.fetchone()[0])
+    execute_statement(cur, 'credit_card_balance', (user_id,))
+    return new_account_balance, float(cur.fetchone()[0])
+
 # ---------------- Banking Operation Endpoints ----------------
 
 @bank_ns.route('/deposit')
@@ -197,8 +299,9 @@ class Deposit(Resource):
     logging.debug("Entering....")
     @log_request
     @bank_ns.expect(deposit_model, validate=True)
-    @bank_ns.doc('deposit')
+    @bank_ns.doc('deposit', params=idempotency_header_doc)
     @jwt_required
+    @idempotent
     def post(self):
         """
         Realiza un depósito en la cuenta especificada.
@@ -211,23 +314,12 @@ class Deposit(Resource):
         if amount <= 0:
             api.abort(400, "Amount must be greater than zero")
         
-        conn = get_connection()
-        cur = conn.cursor()
-        # Update the specified account using its account number (primary key)
-        cur.execute(
-            "UPDATE bank.accounts SET balance = balance + %s WHERE id = %s RETURNING balance",
-            (amount, account_number)
-        )
-        result = cur.fetchone()
-        if not result:
-            conn.rollback()
-            cur.close()
-            conn.close()
-            api.abort(404, "Account not found")
-        new_balance = float(result[0])
-        conn.commit()
-        cur.close()
-        conn.close()
+        try:
+            new_balance = deposit_funds(account_number, amount)
+        except LookupError as e:
+            api.abort(404, str(e))
+        except TransactionConflict:
+            api.abort(503, "Too much contention, retry later")
         return {"message": "Deposit successful", "new_balance": new_balance}, 200
 
 @bank_ns.route('/withdraw')
@@ -242,33 +334,23 @@ class Withdraw(Resource):
         amount = data.get("amount", 0)
         if amount <= 0:
             api.abort(400, "Amount must be greater than zero")
-        user_id = g.user['id']
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT balance FROM bank.accounts WHERE user_id = %s", (user_id,))
-        row = cur.fetchone()
-        if not row:
-            cur.close()
-            conn.close()
-            api.abort(404, "Account not found")
-        current_balance = float(row[0])
-        if current_balance < amount:
-            cur.close()
-            conn.close()
-            api.abort(400, "Insufficient funds")
-        cur.execute("UPDATE bank.accounts SET balance = balance - %s WHERE user_id = %s RETURNING balance", (amount, user_id))
-        new_balance = float(cur.fetchone()[0])
-        conn.commit()
-        cur.close()
-        conn.close()
+        try:
+            new_balance = withdraw_funds(g.user['id'], amount)
+        except LookupError as e:
+            api.abort(404, str(e))
+        except ValueError as e:
+            api.abort(400, str(e))
+        except TransactionConflict:
+            api.abort(503, "Too much contention, retry later")
         return {"message": "Withdrawal successful", "new_balance": new_balance}, 200
 
 @bank_ns.route('/transfer')
 class Transfer(Resource):
     @log_request
     @bank_ns.expect(transfer_model, validate=True)
-    @bank_ns.doc('transfer')
+    @bank_ns.doc('transfer', params=idempotency_header_doc)
     @jwt_required
+    @idempotent
     def post(self):
         """Transfiere fondos desde la cuenta del usuario autenticado a otra cuenta."""
         data = api.payload
@@ -278,41 +360,20 @@ class Transfer(Resource):
             api.abort(400, "Invalid data")
         if target_username == g.user['username']:
             api.abort(400, "Cannot transfer to the same account")
-        conn = get_connection()
-        cur = conn.cursor()
-        # Check sender's balance
-        cur.execute("SELECT balance FROM bank.accounts WHERE user_id = %s", (g.user['id'],))
-        row = cur.fetchone()
-        if not row:
-            cur.close()
-            conn.close()
-            api.abort(404, "Sender account not found")
-        sender_balance = float(row[0])
-        if sender_balance < amount:
-            cur.close()
-            conn.close()
-            api.abort(400, "Insufficient funds")
-        # Find target user
-        cur.execute("SELECT id FROM bank.users WHERE username = %s", (target_username,))
-        target_user = cur.fetchone()
-        if not target_user:
-            cur.close()
-            conn.close()
+        # Resolve the target through the directory; it may live on another shard
+        target = lookup_user(target_username)
+        if not target:
             api.abort(404, "Target user not found")
-        target_user_id = target_user[0]
         try:
-            cur.execute("UPDATE bank.accounts SET balance = balance - %s WHERE user_id = %s", (amount, g.user['id']))
-            cur.execute("UPDATE bank.accounts SET balance = balance + %s WHERE user_id = %s", (amount, target_user_id))
-            cur.execute("SELECT balance FROM bank.accounts WHERE user_id = %s", (g.user['id'],))
-            new_balance = float(cur.fetchone()[0])
-            conn.commit()
+            new_balance = transfer_service.transfer(g.user['id'], target[0], target[1], amount)
+        except LookupError as e:
+            api.abort(404, str(e))
+        except ValueError as e:
+            api.abort(400, str(e))
+        except TransactionConflict:
+            api.abort(503, "Too much contention, retry later")
         except Exception as e:
-            conn.rollback()
-            cur.close()
-            conn.close()
             api.abort(500, f"Error during transfer: {str(e)}")
-        cur.close()
-        conn.close()
         return {"message": "Transfer successful", "new_balance": new_balance}, 200
 
 
@@ -320,8 +381,9 @@ class Transfer(Resource):
 class CreditPayment(Resource):
     @log_request
     @bank_ns.expect(credit_payment_model, validate=True)
-    @bank_ns.doc('credit_payment')
+    @bank_ns.doc('credit_payment', params=idempotency_header_doc)
     @jwt_required
+    @idempotent
     def post(self):
         """
         Realiza un pago seguro con tarjeta de crédito:
@@ -379,8 +441,29 @@ class VerifyOTP(Resource):
 
         except ValueError as e:
             return {"message": str(e)}, 400
+        except TransactionConflict:
+            return {"message": "Too much contention, retry later"}, 503
         except Exception as e:
             return {"message": "An error occurred verifying the OTP"}, 500
+@bank_ns.route('/credit-logs')
+class CreditLogs(Resource):
+    @log_request
+    @bank_ns.doc('credit_logs', params={
+        'transaction_id': 'Filtrar por transacción',
+        'limit': 'Número máximo de registros (máx. 1000)'
+    })
+    @jwt_required
+    def get(self):
+        """Exporta los logs de transacciones de crédito del usuario autenticado."""
+        transaction_id = request.args.get('transaction_id', type=int)
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+        body = credit_logger.export_transaction_logs(
+            user_id=g.user['id'],
+            transaction_id=transaction_id,
+            limit=limit
+        )
+        return Response(body, status=200, mimetype='application/json')
+
 @bank_ns.route('/pay-credit-balance')
 class PayCreditBalance(Resource):
     @log_request
@@ -397,51 +480,174 @@ class PayCreditBalance(Resource):
         amount = data.get("amount", 0)
         if amount <= 0:
             api.abort(400, "Amount must be greater than zero")
-        user_id = g.user['id']
-        conn = get_connection()
-        cur = conn.cursor()
-        # Check account funds
-        cur.execute("SELECT balance FROM bank.accounts WHERE user_id = %s", (user_id,))
-        row = cur.fetchone()
-        if not row:
-            cur.close()
-            conn.close()
-            api.abort(404, "Account not found")
-        account_balance = float(row[0])
-        if account_balance < amount:
-            cur.close()
-            conn.close()
-            api.abort(400, "Insufficient funds in account")
-        # Get current credit card debt
-        cur.execute("SELECT balance FROM bank.credit_cards WHERE user_id = %s", (user_id,))
-        row = cur.fetchone()
-        if not row:
-            cur.close()
-            conn.close()
-            api.abort(404, "Credit card not found")
-        credit_debt = float(row[0])
-        payment = min(amount, credit_debt)
         try:
-            cur.execute("UPDATE bank.accounts SET balance = balance - %s WHERE user_id = %s", (payment, user_id))
-            cur.execute("UPDATE bank.credit_cards SET balance = balance - %s WHERE user_id = %s", (payment, user_id))
-            cur.execute("SELECT balance FROM bank.accounts WHERE user_id = %s", (user_id,))
-            new_account_balance = float(cur.fetchone()[0])
-            cur.execute("SELECT balance FROM bank.credit_cards WHERE user_id = %s", (user_id,))
-            new_credit_debt = float(cur.fetchone()[0])
-            conn.commit()
+            new_account_balance, new_credit_debt = pay_credit_debt(g.user['id'], amount)
+        except LookupError as e:
+            api.abort(404, str(e))
+        except ValueError as e:
+            api.abort(400, str(e))
+        except TransactionConflict:
+            api.abort(503, "Too much contention, retry later")
         except Exception as e:
-            conn.rollback()
-            cur.close()
-            conn.close()
             api.abort(500, f"Error processing credit balance payment: {str(e)}")
-        cur.close()
-        conn.close()
         return {
             "message": "Credit card debt payment successful",
             "account_balance": new_account_balance,
             "credit_card_debt": new_credit_debt
         }, 200
 
+# ---------------- Analytics Endpoints ----------------
+
+# Roles con acceso a la analítica agregada por establecimiento
+ANALYTICS_ROLES = ('cajero',)
+
+@analytics_ns.route('/merchant-hourly')
+class MerchantHourly(Resource):
+    @log_request
+    @analytics_ns.doc('merchant_hourly', params={
+        'start': 'Inicio del intervalo (ISO 8601); por defecto hace 24 horas',
+        'end': 'Fin del intervalo (ISO 8601); por defecto ahora',
+        'merchant_id': 'Filtrar por establecimiento',
+        'limit': 'Número máximo de filas (máx. 10000)'
+    })
+    @jwt_required
+    def get(self):
+        """Volumen, éxitos, fallos e importe medio por establecimiento y hora (solo rollups)."""
+        if g.user['role'] not in ANALYTICS_ROLES:
+            api.abort(403, "Insufficient permissions")
+        try:
+            end = datetime.fromisoformat(request.args['end']) if 'end' in request.args else datetime.now()
+            start = (datetime.fromisoformat(request.args['start'])
+                     if 'start' in request.args else end - timedelta(hours=24))
+        except ValueError:
+            api.abort(400, "Invalid date format")
+        merchant_id = request.args.get('merchant_id', type=int)
+        limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
+        return credit_rollup_service.merchant_hourly(start, end, merchant_id, limit), 200
+
+# ---------------- Event Streams ----------------
+
+# Roles que pueden seguir todos los pagos de un establecimiento. Los usuarios
+# no están asociados a un establecimiento, así que, igual que la analítica por
+# establecimiento, un cajero puede seguir cualquiera: es intencionadamente global
+MERCHANT_EVENT_ROLES = ('cajero',)
+
+@events_ns.route('/credit-transactions')
+class CreditTransactionEvents(Resource):
+    @log_request
+    @events_ns.doc('credit_transaction_events', params={
+        'merchant_id': 'Eventos de todas las transacciones del establecimiento',
+        'transaction_id': 'Eventos de una transacción propia'
+    })
+    @jwt_required
+    def get(self):
+        """Stream SSE de cambios de estado de transacciones de crédito (PENDING, COMPLETED, EXPIRED)."""
+        merchant_id = request.args.get('merchant_id', type=int)
+        transaction_id = request.args.get('transaction_id', type=int)
+        if merchant_id is None and transaction_id is None:
+            api.abort(400, "merchant_id or transaction_id is required")
+        if merchant_id is not None and g.user['role'] not in MERCHANT_EVENT_ROLES:
+            api.abort(403, "Insufficient permissions")
+
+        # Transaction ids are per shard: follow the one on the user's shard
+        shard = shard_for_user(g.user['id'])
+        sub = credit_event_broker.subscribe(
+            merchant_id, (shard, transaction_id) if transaction_id is not None else None)
+        if sub is None:
+            api.abort(503, "Too many event streams, retry later")
+        # Until stream() takes over, any exit (abort, DB error) must release the slot
+        try:
+            initial = []
+            if transaction_id is not None:
+                # Subscribed and listening first, so a change right after this read is not lost
+                if not credit_event_broker.wait_listening():
+                    api.abort(503, "Event listener not ready, retry later")
+                conn = get_shard_connection(shard)
+                cur = conn.cursor()
+                try:
+                    cur.execute("""
+                        SELECT json_build_object('transaction_id', id, 'merchant_id', merchant_id,
+                                                 'status', status, 'amount', amount, 'at', now())::text
+                        FROM bank.credit_transactions WHERE id = %s AND user_id = %s
+                    """, (transaction_id, g.user['id']))
+                    row = cur.fetchone()
+                finally:
+                    cur.close()
+                    conn.close()
+                if row is None:
+                    api.abort(404, "Transaction not found")
+                initial.append(row[0])
+        except BaseException:
+            credit_event_broker.unsubscribe(sub)
+            raise
+        return Response(stream_with_context(credit_event_broker.stream(sub, initial)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ---------------- Operational Endpoints ----------------
+
+@ops_ns.route('/health')
+class Health(Resource):
+    @ops_ns.doc('health', security=None)
+    def get(self):
+        """Comprobación de vida del worker; no consulta la base de datos."""
+        return {"status": "ok"}, 200
+
+@ops_ns.route('/ready')
+class Ready(Resource):
+    @ops_ns.doc('ready', security=None)
+    def get(self):
+        """Comprobación de disponibilidad: el worker llega a la base de datos."""
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+        return {"status": "ready"}, 200
+
+@ops_ns.route('/admission')
+class AdmissionStats(Resource):
+    @ops_ns.doc('admission_stats')
+    @jwt_required
+    def get(self):
+        """Contadores de peticiones admitidas y descartadas en este worker."""
+        return admission_controller.stats(), 200
+
+@ops_ns.route('/traces/summary')
+class TraceSummary(Resource):
+    @ops_ns.doc('trace_summary')
+    @jwt_required
+    def get(self):
+        """Latencia por etapa de las peticiones trazadas en este worker."""
+        return tracer.summary(), 200
+
+@ops_ns.route('/transactions')
+class TransactionStats(Resource):
+    @ops_ns.doc('transaction_stats')
+    @jwt_required
+    def get(self):
+        """Intentos, reintentos y abortos de las unidades transaccionales en este worker."""
+        return transaction_metrics.stats(), 200
+
+@ops_ns.route('/events')
+class EventStats(Resource):
+    @ops_ns.doc('event_stats')
+    @jwt_required
+    def get(self):
+        """Clientes SSE, eventos recibidos, entregados y desbordamientos en este worker."""
+        return credit_event_broker.stats(), 200
+
+@ops_ns.route('/db-pool')
+class DbPoolStats(Resource):
+    @ops_ns.doc('db_pool_stats')
+    @jwt_required
+    def get(self):
+        """Conexiones libres por base de datos en el pool de este worker."""
+        return connection_pool.stats(), 200
+
 @app.before_first_request
 def initialize_db():
     init_db()
@@ -0,0 +1,135 @@
+# app/passwords.py
+
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+# Coste de scrypt (N debe ser potencia de 2). Memoria por hash = 128 * N * r bytes.
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', str(2 ** 14)))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+# Procesos del pool por worker de gunicorn y verificaciones admitidas a la vez
+PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', '2'))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT', '32'))
+PASSWORD_TIMEOUT_SECONDS = float(os.environ.get('PASSWORD_TIMEOUT_SECONDS', '10'))
+# 'spawn' evita hacer fork de un worker con hilos o con gevent ya parcheado
+PASSWORD_POOL_START_METHOD = os.environ.get('PASSWORD_POOL_START_METHOD', 'spawn')
+
+SCHEME = 'scrypt'
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class PasswordQueueFull(Exception):
+    """No hay hueco en la cola de verificación de contraseñas."""
+
+
+class PasswordTimeout(PasswordQueueFull):
+    """La verificación no terminó a tiempo: el pool está saturado."""
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password, n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P, salt=None):
+    """Calcula el hash scrypt en formato scrypt$N$r$p$salt$hash."""
+    salt = salt or secrets.token_bytes(SALT_BYTES)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                         maxmem=256 * n * r + 1024 * 1024, dklen=KEY_BYTES)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(key)}"
+
+
+def verify_and_rehash(password, stored, n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P):
+    """
+    Verifica la contraseña contra el valor almacenado. Devuelve (ok, nuevo_hash):
+    nuevo_hash no es None cuando el valor almacenado debe actualizarse, ya sea
+    porque estaba en texto plano o porque usa otros parámetros de coste.
+    Se ejecuta en el pool de procesos.
+    """
+    if not stored.startswith(SCHEME + '$'):
+        ok = hmac.compare_digest(stored.encode(), password.encode())
+        return ok, (hash_password(password, n, r, p) if ok else None)
+
+    try:
+        _, sn, sr, sp, salt, key = stored.split('$')
+        sn, sr, sp = int(sn), int(sr), int(sp)
+        salt, key = base64.b64decode(salt), base64.b64decode(key)
+    except ValueError:
+        return False, None
+    candidate = hashlib.scrypt(password.encode(), salt=salt, n=sn, r=sr, p=sp,
+                               maxmem=256 * sn * sr + 1024 * 1024, dklen=len(key))
+    ok = hmac.compare_digest(candidate, key)
+    if ok and (sn, sr, sp) != (n, r, p):
+        return ok, hash_password(password, n, r, p)
+    return ok, None
+
+
+class PasswordHasher:
+    """
+    Verificación de contraseñas fuera del hilo del worker, en un pool de
+    procesos acotado. Si la cola está llena se rechaza en lugar de esperar.
+    """
+
+    def __init__(self, workers=PASSWORD_POOL_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT,
+                 n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P):
+        self.workers = workers
+        self.n, self.r, self.p = n, r, p
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        # Hash de relleno para igualar el tiempo de respuesta de usuarios inexistentes
+        self._dummy_hash = None
+
+    def _executor(self):
+        """Crea el pool en el proceso actual (después del fork de gunicorn)."""
+        pid = os.getpid()
+        if self._pool_pid != pid:
+            with self._lock:
+                if self._pool_pid != pid:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(PASSWORD_POOL_START_METHOD)
+                    )
+                    self._pool_pid = pid
+        return self._pool
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordQueueFull("Password verification queue is full")
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # El hueco se libera cuando la tarea termina en el pool, no cuando se
+        # deja de esperarla: si no, un timeout dejaría encolar sin límite
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=PASSWORD_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            # Si aún no había empezado, se retira de la cola del pool
+            future.cancel()
+            raise PasswordTimeout("Password verification timed out")
+
+    def hash(self, password):
+        return self._submit(hash_password, password, self.n, self.r, self.p)
+
+    def verify(self, password, stored):
+        """Devuelve (ok, nuevo_hash). Con stored=None compara contra un hash de relleno."""
+        if stored is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = self._submit(hash_password, secrets.token_hex(16), self.n, self.r, self.p)
+            self._submit(verify_and_rehash, password, self._dummy_hash, self.n, self.r, self.p)
+            return False, None
+        return self._submit(verify_and_rehash, password, stored, self.n, self.r, self.p)
+
+
+# Crear una instancia global del verificador
+password_hasher = PasswordHasher()
@@ -0,0 +1,219 @@
+# app/revocation.py
+
+import hashlib
+import math
+import os
+import select
+import threading
+import time
+from app.db import get_connection
+
+REVOCATION_CHANNEL = 'token_revoked'
+REVOCATION_FILTER_CAPACITY = int(os.environ.get('REVOCATION_FILTER_CAPACITY', '100000'))
+REVOCATION_FILTER_FP_RATE = float(os.environ.get('REVOCATION_FILTER_FP_RATE', '0.001'))
+# Cada cuánto se reconstruye el filtro para descartar jtis ya caducados
+REVOCATION_REBUILD_SECONDS = int(os.environ.get('REVOCATION_REBUILD_SECONDS', '3600'))
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray con doble hashing (blake2b)."""
+
+    def __init__(self, capacity, fp_rate):
+        self.capacity = max(1, capacity)
+        self.size = max(8, int(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class TokenDenylist:
+    """
+    Lista de jtis revocados. Cada worker mantiene un filtro de Bloom en memoria
+    que se actualiza de forma incremental con LISTEN/NOTIFY; solo un posible
+    positivo del filtro consulta bank.revoked_tokens.
+    """
+
+    def __init__(self, get_connection_func):
+        self.get_connection = get_connection_func
+        self._filter = BloomFilter(REVOCATION_FILTER_CAPACITY, REVOCATION_FILTER_FP_RATE)
+        self._confirmed = set()
+        self._ready = False
+        self._rebuild_needed = False
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        self.stats = {'checks': 0, 'filter_positives': 0, 'db_lookups': 0, 'revoked_hits': 0}
+        self._stats_lock = threading.Lock()
+
+    # ---------------- Escucha de revocaciones ----------------
+
+    def _ensure_listener(self):
+        """Arranca el hilo de escucha en este proceso (después del fork de gunicorn)."""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            self._ready = False
+            thread = threading.Thread(target=self._listen_forever, name='token-revocation-listener', daemon=True)
+            thread.start()
+
+    def _load(self, cur):
+        """Reconstruye el filtro con todos los jtis revocados y no caducados."""
+        cur.execute("SELECT count(*) FROM bank.revoked_tokens WHERE expires_at > now()")
+        active = cur.fetchone()[0]
+        bloom = BloomFilter(max(REVOCATION_FILTER_CAPACITY, active * 2), REVOCATION_FILTER_FP_RATE)
+        cur.execute("SELECT jti FROM bank.revoked_tokens WHERE expires_at > now()")
+        for (jti,) in cur:
+            bloom.add(jti)
+        with self._lock:
+            self._filter = bloom
+            self._confirmed.clear()
+
+    def _listen_forever(self):
+        while True:
+            conn = None
+            try:
+                conn = self.get_connection()
+                # Una conexión LISTEN no debe volver al pool al cerrarse
+                conn.detach()
+                conn.autocommit = True
+                cur = conn.cursor()
+                # Escuchar antes de cargar para no perder revocaciones intermedias
+                cur.execute(f"LISTEN {REVOCATION_CHANNEL}")
+                self._load(cur)
+                self._ready = True
+                rebuild_at = time.monotonic() + REVOCATION_REBUILD_SECONDS
+                while True:
+                    timeout = min(5.0, max(0.0, rebuild_at - time.monotonic()))
+                    if select.select([conn], [], [], timeout) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            self.add_local(conn.notifies.pop(0).payload)
+                    if self._rebuild_needed or time.monotonic() >= rebuild_at:
+                        self._rebuild_needed = False
+                        self._load(cur)
+                        rebuild_at = time.monotonic() + REVOCATION_REBUILD_SECONDS
+            except Exception as e:
+                self._ready = False
+                print(f"Error en el listener de revocación de tokens: {e}")
+                time.sleep(1)
+            finally:
+                if conn:
+                    conn.close()
+
+    # ---------------- API ----------------
+
+    def add_local(self, jti):
+        with self._lock:
+            self._filter.add(jti)
+            if self._filter.count > self._filter.capacity:
+                # El filtro se satura: el listener lo reconstruye más grande
+                self._rebuild_needed = True
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _lookup(self, jti):
+        self._count('db_lookups')
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT 1 FROM bank.revoked_tokens WHERE jti = %s", (jti,))
+            return cur.fetchone() is not None
+        finally:
+            cur.close()
+            conn.close()
+
+    def is_revoked(self, jti):
+        """Comprueba si un jti está revocado; solo va a la base ante un posible positivo."""
+        self._ensure_listener()
+        self._count('checks')
+        if jti in self._confirmed:
+            self._count('revoked_hits')
+            return True
+        if self._ready and jti not in self._filter:
+            return False
+        self._count('filter_positives')
+        revoked = self._lookup(jti)
+        if revoked:
+            self._count('revoked_hits')
+            with self._lock:
+                self._confirmed.add(jti)
+        return revoked
+
+    def revoke(self, jti, expires_at):
+        """Registra la revocación y la difunde al resto de workers con NOTIFY."""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO bank.revoked_tokens (jti, expires_at)
+                VALUES (%s, %s)
+                ON CONFLICT (jti) DO NOTHING
+            """, (jti, expires_at))
+            cur.execute("SELECT pg_notify(%s, %s)", (REVOCATION_CHANNEL, jti))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+        self.add_local(jti)
+        with self._lock:
+            self._confirmed.add(jti)
+
+    def sweep_expired(self, batch_size=5000):
+        """Elimina en bloques las revocaciones de tokens ya caducados."""
+        total = 0
+        conn = self.get_connection()
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            while True:
+                cur.execute("""
+                    DELETE FROM bank.revoked_tokens
+                    WHERE id IN (
+                        SELECT id FROM bank.revoked_tokens
+                        WHERE expires_at < now()
+                        LIMIT %s
+                    )
+                """, (batch_size,))
+                total += cur.rowcount
+                if cur.rowcount < batch_size:
+                    break
+        finally:
+            cur.close()
+            conn.close()
+        return total
+
+
+# Crear una instancia global de la lista de revocación
+token_denylist = TokenDenylist(get_connection)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Mantenimiento de tokens revocados')
+    parser.add_argument('command', choices=['sweep'])
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == 'sweep':
+        deleted = token_denylist.sweep_expired(args.batch_size)
+        print(f"Revocaciones caducadas eliminadas: {deleted}")
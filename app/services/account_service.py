@@ -0,0 +1,208 @@
+import os
+import random
+import time
+from typing import Optional
+from app.db import get_shard_connection, shard_for_account, SHARD_COUNT
+
+# Estrategia para elegir el slot de una cuenta "hot": 'random' o 'worker'
+HOT_SLOT_STRATEGY = os.environ.get('HOT_SLOT_STRATEGY', 'random')
+MAX_HOT_SLOTS = 64
+
+# Columnas por las que se puede identificar una cuenta
+_ACCOUNT_COLUMNS = {'id', 'user_id'}
+
+
+class AccountService:
+    """
+    Movimientos de saldo sobre bank.accounts con soporte de cuentas "hot".
+
+    Una cuenta hot (shard_count > 0) recibe los créditos en N sub-saldos de
+    bank.account_slots, de modo que los depósitos concurrentes no se serializan
+    sobre el bloqueo de la fila de la cuenta. El saldo total es
+    accounts.balance + SUM(account_slots.balance). Los débitos bloquean la fila
+    de la cuenta y pliegan los slots antes de comprobar fondos.
+    """
+
+    def _column(self, column: str) -> str:
+        if column not in _ACCOUNT_COLUMNS:
+            raise ValueError(f"Invalid account column: {column}")
+        return column
+
+    def pick_slot(self) -> int:
+        """Elige un slot; el servidor lo reduce módulo shard_count."""
+        if HOT_SLOT_STRATEGY == 'worker':
+            return os.getpid()
+        return random.randrange(1 << 30)
+
+    def credit(self, cur, key: int, amount: float, column: str = 'id') -> Optional[float]:
+        """
+        Acredita amount en una sola sentencia. En cuentas hot actualiza un slot
+        sin tocar la fila de la cuenta, y lo crea si falta su fila. Devuelve el
+        saldo total resultante o None si la cuenta no existe.
+        """
+        column = self._column(column)
+        cur.execute(f"""
+            WITH acc AS (
+                SELECT id, balance, shard_count FROM bank.accounts WHERE {column} = %(key)s
+            ), hot AS (
+                INSERT INTO bank.account_slots AS s (account_id, slot, balance)
+                SELECT id, %(slot)s %% shard_count, %(amount)s FROM acc
+                WHERE shard_count > 0
+                ON CONFLICT (account_id, slot) DO UPDATE SET balance = s.balance + EXCLUDED.balance
+                RETURNING s.account_id
+            ), cold AS (
+                UPDATE bank.accounts a SET balance = a.balance + %(amount)s
+                FROM acc
+                WHERE acc.shard_count = 0 AND a.id = acc.id
+                RETURNING a.balance
+            )
+            SELECT COALESCE(
+                (SELECT balance FROM cold),
+                (SELECT acc.balance + %(amount)s + COALESCE(
+                     (SELECT SUM(balance) FROM bank.account_slots WHERE account_id = acc.id), 0)
+                 FROM acc JOIN hot ON hot.account_id = acc.id)
+            )
+        """, {'key': key, 'amount': amount, 'slot': self.pick_slot()})
+        row = cur.fetchone()
+        return float(row[0]) if row and row[0] is not None else None
+
+    def lock_for_debit(self, cur, key: int, column: str = 'user_id') -> None:
+        """
+        Bloquea la fila de la cuenta y, si es hot, pliega sus slots en el saldo
+        base. Tras esta llamada la comprobación de fondos y el débito sobre
+        bank.accounts.balance son atómicos dentro de la transacción.
+        """
+        column = self._column(column)
+        cur.execute(f"""
+            WITH acc AS (
+                SELECT id, shard_count FROM bank.accounts WHERE {column} = %s FOR UPDATE
+            ), old AS (
+                SELECT s.account_id, s.slot, s.balance
+                FROM bank.account_slots s JOIN acc ON s.account_id = acc.id
+                WHERE acc.shard_count > 0 AND s.balance <> 0
+                FOR UPDATE OF s
+            ), moved AS (
+                UPDATE bank.account_slots s SET balance = 0
+                FROM old
+                WHERE s.account_id = old.account_id AND s.slot = old.slot
+                RETURNING old.account_id, old.balance
+            )
+            UPDATE bank.accounts a SET balance = a.balance + m.total
+            FROM (SELECT account_id, SUM(balance) AS total FROM moved GROUP BY account_id) m
+            WHERE a.id = m.account_id
+        """, (key,))
+
+    def get_total_balance(self, cur, key: int, column: str = 'user_id') -> Optional[float]:
+        """Saldo total de la cuenta: saldo base más la suma de los slots."""
+        column = self._column(column)
+        cur.execute(f"""
+            SELECT a.balance + COALESCE(
+                (SELECT SUM(balance) FROM bank.account_slots WHERE account_id = a.id), 0)
+            FROM bank.accounts a WHERE a.{column} = %s
+        """, (key,))
+        row = cur.fetchone()
+        return float(row[0]) if row else None
+
+    def enable_hot_mode(self, account_id: int, slots: int) -> None:
+        """Activa el modo hot de una cuenta con `slots` sub-saldos."""
+        if not 1 <= slots <= MAX_HOT_SLOTS:
+            raise ValueError(f"Slots must be between 1 and {MAX_HOT_SLOTS}")
+        conn = get_shard_connection(shard_for_account(account_id))
+        cur = conn.cursor()
+        try:
+            # Plegar primero los slots existentes para poder cambiar su número
+            self.lock_for_debit(cur, account_id, column='id')
+            cur.execute("DELETE FROM bank.account_slots WHERE account_id = %s", (account_id,))
+            cur.execute("""
+                INSERT INTO bank.account_slots (account_id, slot, balance)
+                SELECT %s, generate_series(0, %s - 1), 0
+            """, (account_id, slots))
+            cur.execute("UPDATE bank.accounts SET shard_count = %s WHERE id = %s", (slots, account_id))
+            if cur.rowcount == 0:
+                raise ValueError("Account not found")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def disable_hot_mode(self, account_id: int) -> None:
+        """Pliega los slots y vuelve la cuenta al modo de una sola fila."""
+        conn = get_shard_connection(shard_for_account(account_id))
+        cur = conn.cursor()
+        try:
+            self.lock_for_debit(cur, account_id, column='id')
+            cur.execute("UPDATE bank.accounts SET shard_count = 0 WHERE id = %s", (account_id,))
+            cur.execute("DELETE FROM bank.account_slots WHERE account_id = %s", (account_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def compact(self) -> int:
+        """
+        Pliega los slots de todas las cuentas hot en su saldo base, una
+        transacción corta por cuenta y shard. Devuelve el número de cuentas plegadas.
+        """
+        return sum(self._compact_shard(shard) for shard in range(SHARD_COUNT))
+
+    def _compact_shard(self, shard: int) -> int:
+        conn = get_shard_connection(shard)
+        cur = conn.cursor()
+        folded = 0
+        try:
+            cur.execute("""
+                SELECT DISTINCT account_id FROM bank.account_slots WHERE balance <> 0
+            """)
+            account_ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            for account_id in account_ids:
+                try:
+                    self.lock_for_debit(cur, account_id, column='id')
+                    conn.commit()
+                    folded += 1
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Error compacting account {account_id}: {str(e)}")
+            return folded
+        finally:
+            cur.close()
+            conn.close()
+
+
+# Crear una instancia global del servicio
+account_service = AccountService()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Gestión de cuentas hot con sub-saldos')
+    sub = parser.add_subparsers(dest='command', required=True)
+    enable = sub.add_parser('enable', help='Activa el modo hot de una cuenta')
+    enable.add_argument('--account', type=int, required=True)
+    enable.add_argument('--slots', type=int, default=16)
+    disable = sub.add_parser('disable', help='Desactiva el modo hot de una cuenta')
+    disable.add_argument('--account', type=int, required=True)
+    compact = sub.add_parser('compact', help='Pliega los slots en el saldo base')
+    compact.add_argument('--interval', type=float, default=0,
+                         help='Segundos entre pasadas; 0 ejecuta una sola vez')
+    args = parser.parse_args()
+
+    if args.command == 'enable':
+        account_service.enable_hot_mode(args.account, args.slots)
+        print(f"Cuenta {args.account} en modo hot con {args.slots} slots")
+    elif args.command == 'disable':
+        account_service.disable_hot_mode(args.account)
+        print(f"Cuenta {args.account} en modo de una sola fila")
+    else:
+        while True:
+            print(f"Cuentas compactadas: {account_service.compact()}")
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
@@ -4,14 +4,19 @@ import secrets
 import hashlib
 from typing import Dict, Tuple
 import os
-from app.db import get_connection
+from app.db import get_user_connection, run_transaction, execute_statement
+from app.events import publish_status
 from app.loggers.credit_logger import credit_logger, CreditLogType
+from app.services.hold_service import credit_hold_service, CREDIT_HOLD_TTL_SECONDS
+from app.services.velocity import velocity_engine
+from app.tracing import tracer
 
 
 class CreditCardService:
     def __init__(self):
         pass
 
+    @tracer.traced('credit.luhn')
     def validate_card_number(self, card_number: str) -> bool:
         """Implementa el algoritmo de Luhn para validar números de tarjeta."""
         if not re.match(r'^\d{16}$', card_number):
@@ -45,14 +50,16 @@ class CreditCardService:
         """Genera un código OTP de 6 dígitos."""
         return ''.join(secrets.choice('0123456789') for _ in range(6))
 
+    @tracer.traced('credit.otp_send')
     def send_otp_email(self, email: str, otp: str) -> bool:
         """Simula el envío del código OTP por email."""
         print(f"[SIMULATED] Sending OTP {otp} to {email}")
         return True
 
+    @tracer.traced('credit.validate_stored_card')
     def validate_stored_card(self, user_id: int, card_id: int, cvv: str) -> bool:
         """Valida que la tarjeta almacenada pertenezca al usuario y esté activa."""
-        conn = get_connection()
+        conn = get_user_connection(user_id)
         cur = conn.cursor()
 
         try:
@@ -78,24 +85,40 @@ class CreditCardService:
             cur.close()
             conn.close()
 
+    @tracer.traced('credit.save_card')
     def save_card(self, user_id: int, card_number: str, expiry_month: int, expiry_year: int) -> int:
-        """Guarda una nueva tarjeta y retorna su ID."""
-        conn = get_connection()
+        """
+        Guarda una nueva tarjeta y retorna su ID. Si el usuario ya tiene guardada
+        la misma tarjeta se reutiliza, actualizando su caducidad.
+        """
+        conn = get_user_connection(user_id)
         cur = conn.cursor()
 
         try:
             cur.execute("""
-                INSERT INTO bank.encrypted_cards 
-                (user_id, card_number_hash, card_type, last_four, expiry_date)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                user_id,
-                hashlib.sha256(card_number.encode()).hexdigest(),
-                self.get_card_type(card_number),
-                card_number[-4:],
-                f"{expiry_year}-{expiry_month:02d}-01"
-            ))
+                WITH existing AS (
+                    UPDATE bank.encrypted_cards SET expiry_date = %(expiry)s
+                    WHERE id = (
+                        SELECT id FROM bank.encrypted_cards
+                        WHERE card_number_hash = %(hash)s AND user_id = %(user_id)s AND is_active
+                        ORDER BY id LIMIT 1
+                    )
+                    RETURNING id
+                ), inserted AS (
+                    INSERT INTO bank.encrypted_cards 
+                    (user_id, card_number_hash, card_type, last_four, expiry_date)
+                    SELECT %(user_id)s, %(hash)s, %(card_type)s, %(last_four)s, %(expiry)s
+                    WHERE NOT EXISTS (SELECT 1 FROM existing)
+                    RETURNING id
+                )
+                SELECT id FROM existing UNION ALL SELECT id FROM inserted
+            """, {
+                'user_id': user_id,
+                'hash': hashlib.sha256(card_number.encode()).hexdigest(),
+                'card_type': self.get_card_type(card_number),
+                'last_four': card_number[-4:],
+                'expiry': f"{expiry_year}-{expiry_month:02d}-01"
+            })
 
             card_id = cur.fetchone()[0]
             conn.commit()
@@ -105,18 +128,25 @@ class CreditCardService:
             cur.close()
             conn.close()
 
+    @tracer.traced('credit.process_payment')
     def process_payment(self, user_id: int, user_email: str, data: Dict) -> Tuple[int, str]:
         """Procesa el pago con tarjeta de crédito (nueva o almacenada)."""
-        conn = get_connection()
+        conn = get_user_connection(user_id)
         conn.autocommit = False
         cur = conn.cursor()
 
         try:
+            # Reglas de velocidad en memoria, antes de cualquier consulta
+            if velocity_engine is not None:
+                if 'card_id' in data:
+                    card_key = f"id:{data['card_id']}"
+                else:
+                    card_key = hashlib.sha256(data.get('card_number', '').encode()).hexdigest()
+                with tracer.span('credit.velocity'):
+                    velocity_engine.check(user_id, card_key, data['merchant_id'])
+
             # Verificar el establecimiento
-            cur.execute("""
-                SELECT id, name FROM bank.merchants 
-                WHERE id = %s AND status = true
-            """, (data['merchant_id'],))
+            execute_statement(cur, 'active_merchant', (data['merchant_id'],))
             merchant = cur.fetchone()
             if not merchant:
                 raise ValueError("Invalid or inactive merchant")
@@ -152,36 +182,48 @@ class CreditCardService:
                         {'card_type': self.get_card_type(data['card_number'])}
                     )
                 else:
-                    # Guardar la tarjeta temporalmente para la transacción
-                    cur.execute("""
-                        INSERT INTO bank.encrypted_cards 
-                        (user_id, card_number_hash, card_type, last_four, expiry_date, is_active)
-                        VALUES (%s, %s, %s, %s, %s, false)
-                        RETURNING id
-                    """, (
-                        user_id,
-                        hashlib.sha256(data['card_number'].encode()).hexdigest(),
-                        self.get_card_type(data['card_number']),
-                        data['card_number'][-4:],
-                        f"{data['expiry_year']}-{data['expiry_month']:02d}-01"
-                    ))
-                    card_id = cur.fetchone()[0]
-
-            # Generar y enviar OTP
+                    # La tarjeta de un solo uso va a bank.ephemeral_cards con la transacción
+                    card_id = None
+
+            # Generar OTP
             otp = self.generate_otp()
-            if not self.send_otp_email(user_email, otp):
-                raise ValueError("Failed to send OTP")
 
             # Crear la transacción
             cur.execute("""
                 INSERT INTO bank.credit_transactions 
-                (merchant_id, card_id, amount, status, otp_code)
-                VALUES (%s, %s, %s, 'PENDING', %s)
+                (merchant_id, card_id, user_id, amount, status, otp_code)
+                VALUES (%s, %s, %s, %s, 'PENDING', %s)
                 RETURNING id
-            """, (data['merchant_id'], card_id, data['amount'], otp))
+            """, (data['merchant_id'], card_id, user_id, data['amount'], otp))
 
             transaction_id = cur.fetchone()[0]
 
+            if card_id is None:
+                # Caduca con la retención; release_expired purga las abandonadas
+                cur.execute("""
+                    INSERT INTO bank.ephemeral_cards
+                    (transaction_id, card_number_hash, card_type, last_four, expiry_date, expires_at)
+                    VALUES (%s, %s, %s, %s, %s, now() + make_interval(secs => %s))
+                """, (
+                    transaction_id,
+                    hashlib.sha256(data['card_number'].encode()).hexdigest(),
+                    self.get_card_type(data['card_number']),
+                    data['card_number'][-4:],
+                    f"{data['expiry_year']}-{data['expiry_month']:02d}-01",
+                    CREDIT_HOLD_TTL_SECONDS
+                ))
+
+            # Reservar el importe contra el crédito disponible de la tarjeta
+            if not credit_hold_service.reserve(cur, user_id, transaction_id, data['amount']):
+                raise ValueError("Insufficient available credit")
+
+            # Enviar OTP solo cuando la autorización está reservada
+            if not self.send_otp_email(user_email, otp):
+                raise ValueError("Failed to send OTP")
+
+            # Aviso a los suscriptores del comercio; se entrega con el commit
+            publish_status(cur, [transaction_id])
+
             # Log payment initiated
             credit_logger.log_transaction(
                 CreditLogType.PAYMENT_INITIATED,
@@ -205,22 +247,16 @@ class CreditCardService:
             cur.close()
             conn.close()
 
+    @tracer.traced('credit.verify_otp')
     def verify_otp(self, user_id: int, transaction_id: int, otp_code: str) -> Tuple[float, str]:
-        """Verifica el código OTP y completa la transacción."""
-        conn = get_connection()
-        conn.autocommit = False
-        cur = conn.cursor()
-
-        try:
+        """
+        Verifica el código OTP y completa la transacción. La verificación es una
+        unidad transaccional que se repite ante conflictos; los logs se escriben
+        fuera de ella, una sola vez.
+        """
+        def complete(cur):
             # Get transaction data including card ownership verification
-            cur.execute("""
-                SELECT t.id, t.amount, t.otp_code, m.name as merchant_name, 
-                       m.id as merchant_id, ec.user_id
-                FROM bank.credit_transactions t
-                JOIN bank.merchants m ON t.merchant_id = m.id
-                JOIN bank.encrypted_cards ec ON t.card_id = ec.id
-                WHERE t.id = %s AND t.status = 'PENDING'
-            """, (transaction_id,))
+            execute_statement(cur, 'pending_credit_transaction', (transaction_id,))
 
             transaction = cur.fetchone()
             if not transaction:
@@ -233,6 +269,10 @@ class CreditCardService:
             if transaction[2] != otp_code:
                 raise ValueError("Invalid OTP code")
 
+            # Convertir la retención en deuda de la tarjeta
+            if not credit_hold_service.capture(cur, transaction[0]):
+                raise ValueError("Authorization hold expired")
+
             # Completar la transacción
             cur.execute("""
                 UPDATE bank.credit_transactions 
@@ -240,37 +280,31 @@ class CreditCardService:
                 WHERE id = %s
             """, (transaction[0],))
 
-            # Eliminar tarjetas temporales si existen
+            # Eliminar la tarjeta temporal si existe
             cur.execute("""
-                DELETE FROM bank.encrypted_cards
-                WHERE id IN (
-                    SELECT card_id 
-                    FROM bank.credit_transactions 
-                    WHERE id = %s
-                ) AND is_active = false
+                DELETE FROM bank.ephemeral_cards WHERE transaction_id = %s
             """, (transaction[0],))
 
-            # Log successful verification
-            credit_logger.log_transaction(
-                CreditLogType.PAYMENT_COMPLETED,
-                transaction[0], user_id, transaction[4],
-                transaction[1], 'COMPLETED'
-            )
-
-            conn.commit()
-            return float(transaction[1]), transaction[3]
+            publish_status(cur, [transaction[0]])
+            return transaction
 
+        try:
+            transaction = run_transaction('verify_otp', lambda: get_user_connection(user_id), complete)
         except Exception as e:
-            conn.rollback()
             credit_logger.log_transaction(
                 CreditLogType.PAYMENT_FAILED,
                 transaction_id, user_id, 0, 0, 'FAILED',
                 {'error': str(e)}
             )
             raise
-        finally:
-            cur.close()
-            conn.close()
+
+        # Log successful verification
+        credit_logger.log_transaction(
+            CreditLogType.PAYMENT_COMPLETED,
+            transaction[0], user_id, transaction[4],
+            transaction[1], 'COMPLETED'
+        )
+        return float(transaction[1]), transaction[3]
 
 
 # Crear una instancia global del servicio
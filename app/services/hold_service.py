@@ -0,0 +1,151 @@
+import os
+import time
+from app.db import get_shard_connection, SHARD_COUNT
+from app.events import publish_status
+from app.tracing import tracer
+
+# Tiempo que una autorización reserva crédito a la espera del OTP
+CREDIT_HOLD_TTL_SECONDS = int(os.environ.get('CREDIT_HOLD_TTL_SECONDS', '900'))
+
+
+class CreditHoldService:
+    """
+    Retenciones de autorización contra bank.credit_cards.limit_credit.
+
+    El crédito disponible es limit_credit - balance - held. Una retención se
+    reserva con una única sentencia condicional al iniciar el pago, se convierte
+    en deuda (balance) al verificar el OTP y se libera en bloque al caducar.
+    """
+
+    @tracer.traced('hold.reserve')
+    def reserve(self, cur, user_id: int, transaction_id: int, amount: float) -> bool:
+        """
+        Reserva amount sobre la tarjeta de crédito del usuario. Devuelve False si
+        no hay crédito disponible. La condición se evalúa con la fila bloqueada,
+        así que pagos concurrentes no pueden superar el límite.
+        """
+        cur.execute("""
+            WITH card AS (
+                UPDATE bank.credit_cards
+                SET held = held + %(amount)s
+                WHERE id = (
+                    SELECT id FROM bank.credit_cards
+                    WHERE user_id = %(user_id)s
+                    ORDER BY id LIMIT 1
+                )
+                  AND limit_credit - balance - held >= %(amount)s
+                RETURNING id
+            )
+            INSERT INTO bank.credit_holds (credit_card_id, transaction_id, amount, expires_at)
+            SELECT id, %(transaction_id)s, %(amount)s, now() + make_interval(secs => %(ttl)s)
+            FROM card
+            RETURNING id
+        """, {
+            'amount': amount,
+            'user_id': user_id,
+            'transaction_id': transaction_id,
+            'ttl': CREDIT_HOLD_TTL_SECONDS
+        })
+        return cur.fetchone() is not None
+
+    @tracer.traced('hold.capture')
+    def capture(self, cur, transaction_id: int) -> bool:
+        """Convierte la retención vigente de la transacción en deuda de la tarjeta."""
+        cur.execute("""
+            WITH hold AS (
+                UPDATE bank.credit_holds
+                SET status = 'CAPTURED'
+                WHERE transaction_id = %s AND status = 'HELD' AND expires_at > now()
+                RETURNING credit_card_id, amount
+            )
+            UPDATE bank.credit_cards c
+            SET held = c.held - hold.amount,
+                balance = c.balance + hold.amount
+            FROM hold
+            WHERE c.id = hold.credit_card_id
+            RETURNING c.id
+        """, (transaction_id,))
+        return cur.fetchone() is not None
+
+    def release_expired(self, batch_size: int = 1000) -> int:
+        """
+        Libera en bloques las retenciones caducadas, devuelve su importe al
+        crédito disponible y marca como EXPIRED las transacciones pendientes.
+        También purga las tarjetas de un solo uso caducadas. Recorre todos los shards.
+        """
+        return sum(self._release_expired_shard(shard, batch_size) for shard in range(SHARD_COUNT))
+
+    def _release_expired_shard(self, shard: int, batch_size: int) -> int:
+        total = 0
+        conn = get_shard_connection(shard)
+        cur = conn.cursor()
+        try:
+            while True:
+                cur.execute("""
+                    WITH expired AS (
+                        SELECT id FROM bank.credit_holds
+                        WHERE status = 'HELD' AND expires_at <= now()
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    ), released AS (
+                        UPDATE bank.credit_holds h
+                        SET status = 'RELEASED'
+                        FROM expired
+                        WHERE h.id = expired.id
+                        RETURNING h.credit_card_id, h.transaction_id, h.amount
+                    ), cards AS (
+                        UPDATE bank.credit_cards c
+                        SET held = c.held - r.total
+                        FROM (
+                            SELECT credit_card_id, SUM(amount) AS total
+                            FROM released GROUP BY credit_card_id
+                        ) r
+                        WHERE c.id = r.credit_card_id
+                    ), transactions AS (
+                        UPDATE bank.credit_transactions t
+                        SET status = 'EXPIRED'
+                        FROM released r
+                        WHERE t.id = r.transaction_id AND t.status = 'PENDING'
+                        RETURNING t.id
+                    )
+                    SELECT (SELECT count(*) FROM released), ARRAY(SELECT id FROM transactions)
+                """, (batch_size,))
+                released, expired_ids = cur.fetchone()
+                if expired_ids:
+                    publish_status(cur, expired_ids)
+                conn.commit()
+                total += released
+                if released < batch_size:
+                    break
+            # Tarjetas de un solo uso de pagos abandonados
+            cur.execute("DELETE FROM bank.ephemeral_cards WHERE expires_at <= now()")
+            conn.commit()
+            return total
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+
+# Crear una instancia global del servicio
+credit_hold_service = CreditHoldService()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Liberación de retenciones de crédito caducadas')
+    parser.add_argument('command', choices=['release'])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=0,
+                        help='Segundos entre pasadas; 0 ejecuta una sola vez')
+    args = parser.parse_args()
+
+    while True:
+        print(f"Retenciones liberadas: {credit_hold_service.release_expired(args.batch_size)}")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
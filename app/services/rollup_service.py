@@ -0,0 +1,236 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.db import get_connection
+
+ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', '5000'))
+# Los logs más recientes que este margen se dejan para la siguiente pasada:
+# un id bajo de una transacción aún sin confirmar no debe quedar por detrás de la marca
+ROLLUP_SAFETY_SECONDS = float(os.environ.get('ROLLUP_SAFETY_SECONDS', '5'))
+ROLLUP_BACKFILL_WORKERS = int(os.environ.get('ROLLUP_BACKFILL_WORKERS', '4'))
+ROLLUP_BACKFILL_CHUNK = int(os.environ.get('ROLLUP_BACKFILL_CHUNK', '100000'))
+
+WATERMARK_NAME = 'credit_hourly'
+
+# Agregado de un conjunto de logs (CTE "source") sumado sobre el rollup existente
+_UPSERT_ROLLUP = """
+    INSERT INTO bank.credit_rollup_hourly AS r
+        (merchant_id, hour, initiated_count, completed_count, failed_count,
+         initiated_amount, completed_amount)
+    SELECT COALESCE(merchant_id, 0), date_trunc('hour', created_at),
+           count(*) FILTER (WHERE log_type = 'PAYMENT_INITIATED'),
+           count(*) FILTER (WHERE log_type = 'PAYMENT_COMPLETED'),
+           count(*) FILTER (WHERE log_type = 'PAYMENT_FAILED'),
+           COALESCE(sum(amount) FILTER (WHERE log_type = 'PAYMENT_INITIATED'), 0),
+           COALESCE(sum(amount) FILTER (WHERE log_type = 'PAYMENT_COMPLETED'), 0)
+    FROM source
+    WHERE log_type IN ('PAYMENT_INITIATED', 'PAYMENT_COMPLETED', 'PAYMENT_FAILED')
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (merchant_id, hour) DO UPDATE SET
+        initiated_count = r.initiated_count + EXCLUDED.initiated_count,
+        completed_count = r.completed_count + EXCLUDED.completed_count,
+        failed_count = r.failed_count + EXCLUDED.failed_count,
+        initiated_amount = r.initiated_amount + EXCLUDED.initiated_amount,
+        completed_amount = r.completed_amount + EXCLUDED.completed_amount
+"""
+
+
+class CreditRollupService:
+    """
+    Rollups por establecimiento y hora de bank.credit_transaction_logs.
+
+    bank.credit_rollup_hourly se mantiene de forma incremental desde la marca
+    de agua (último id procesado) de bank.rollup_watermarks, en lotes pequeños
+    que suman sus agregados a las filas existentes. Las consultas de analítica
+    solo leen los rollups, nunca la tabla de logs.
+    """
+
+    def refresh(self, batch_size: int = ROLLUP_BATCH_SIZE, max_batches: int = None) -> int:
+        """Procesa los logs nuevos en lotes de batch_size. Devuelve los logs leídos."""
+        total = 0
+        batches = 0
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            while max_batches is None or batches < max_batches:
+                # El bloqueo de la marca serializa las pasadas concurrentes
+                cur.execute("""
+                    SELECT last_id FROM bank.rollup_watermarks
+                    WHERE name = %s FOR UPDATE
+                """, (WATERMARK_NAME,))
+                last_id = cur.fetchone()[0]
+                # Los ids no siguen el orden de created_at: se leen los siguientes
+                # ids en orden y el lote se corta en el primero aún dentro del
+                # margen, para que la marca nunca salte un id sin procesar
+                cur.execute(f"""
+                    WITH candidates AS (
+                        SELECT id, merchant_id, log_type, amount, created_at,
+                               created_at < now()::timestamp - make_interval(secs => %(lag)s) AS stable
+                        FROM bank.credit_transaction_logs
+                        WHERE id > %(last_id)s
+                        ORDER BY id
+                        LIMIT %(batch)s
+                    ), cutoff AS (
+                        SELECT min(id) AS id FROM candidates WHERE NOT stable
+                    ), source AS (
+                        SELECT id, merchant_id, log_type, amount, created_at
+                        FROM candidates
+                        WHERE (SELECT id FROM cutoff) IS NULL OR id < (SELECT id FROM cutoff)
+                    ), upsert AS ({_UPSERT_ROLLUP})
+                    UPDATE bank.rollup_watermarks
+                    SET last_id = COALESCE((SELECT max(id) FROM source), last_id),
+                        updated_at = now()
+                    WHERE name = %(name)s
+                    RETURNING (SELECT count(*) FROM source)
+                """, {
+                    'last_id': last_id,
+                    'lag': ROLLUP_SAFETY_SECONDS,
+                    'batch': batch_size,
+                    'name': WATERMARK_NAME
+                })
+                processed = cur.fetchone()[0]
+                conn.commit()
+                total += processed
+                batches += 1
+                if processed < batch_size:
+                    break
+            return total
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def _rollup_range(self, first_id: int, last_id: int):
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                WITH source AS (
+                    SELECT merchant_id, log_type, amount, created_at
+                    FROM bank.credit_transaction_logs
+                    WHERE id BETWEEN %s AND %s
+                )
+                {_UPSERT_ROLLUP}
+            """, (first_id, last_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def backfill(self, workers: int = ROLLUP_BACKFILL_WORKERS, chunk: int = ROLLUP_BACKFILL_CHUNK) -> int:
+        """
+        Reconstruye los rollups desde cero. Vacía la tabla y fija la marca en el
+        último id estable en una transacción; después agrega los rangos de id
+        hasta esa marca en paralelo. Los refrescos incrementales pueden seguir
+        en marcha: solo procesan ids posteriores. Devuelve la marca fijada.
+        """
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT last_id FROM bank.rollup_watermarks
+                WHERE name = %s FOR UPDATE
+            """, (WATERMARK_NAME,))
+            # La marca queda justo antes del primer id aún dentro del margen,
+            # aunque haya ids mayores ya estables (mismo criterio que refresh)
+            cur.execute("""
+                SELECT COALESCE(min(id), 1),
+                       COALESCE(min(id) FILTER (
+                                    WHERE created_at >= now()::timestamp - make_interval(secs => %s)) - 1,
+                                max(id), 0)
+                FROM bank.credit_transaction_logs
+            """, (ROLLUP_SAFETY_SECONDS,))
+            first_id, high_id = cur.fetchone()
+            cur.execute("DELETE FROM bank.credit_rollup_hourly")
+            cur.execute("""
+                UPDATE bank.rollup_watermarks SET last_id = %s, updated_at = now()
+                WHERE name = %s
+            """, (high_id, WATERMARK_NAME))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+        ranges = [(start, min(start + chunk - 1, high_id)) for start in range(first_id, high_id + 1, chunk)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(lambda r: self._rollup_range(*r), ranges):
+                pass
+        return high_id
+
+    def merchant_hourly(self, start, end, merchant_id: int = None, limit: int = 1000) -> dict:
+        """Volumen, éxitos, fallos e importe medio por establecimiento y hora."""
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT merchant_id, hour, initiated_count, completed_count, failed_count,
+                       initiated_amount, completed_amount
+                FROM bank.credit_rollup_hourly
+                WHERE hour >= date_trunc('hour', %s::timestamp) AND hour < %s
+                  AND (%s::integer IS NULL OR merchant_id = %s)
+                ORDER BY hour, merchant_id
+                LIMIT %s
+            """, (start, end, merchant_id, merchant_id, limit))
+            rows = cur.fetchall()
+            cur.execute("""
+                SELECT last_id, updated_at FROM bank.rollup_watermarks WHERE name = %s
+            """, (WATERMARK_NAME,))
+            watermark = cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+
+        result = []
+        for row in rows:
+            result.append({
+                'merchant_id': row[0],
+                'hour': row[1].isoformat(),
+                'initiated_count': row[2],
+                'completed_count': row[3],
+                'failed_count': row[4],
+                'completed_amount': float(row[6]),
+                'avg_initiated_amount': float(row[5] / row[2]) if row[2] else None,
+                'avg_completed_amount': float(row[6] / row[3]) if row[3] else None,
+            })
+        return {
+            'rows': result,
+            'watermark_id': watermark[0] if watermark else 0,
+            'refreshed_at': watermark[1].isoformat() if watermark and watermark[1] else None,
+        }
+
+
+# Crear una instancia global del servicio
+credit_rollup_service = CreditRollupService()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rollups horarios de los logs de crédito')
+    sub = parser.add_subparsers(dest='command', required=True)
+    refresh = sub.add_parser('refresh', help='Procesa los logs nuevos desde la marca de agua')
+    refresh.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE)
+    refresh.add_argument('--interval', type=float, default=0,
+                         help='Segundos entre pasadas; 0 ejecuta una sola vez')
+    backfill = sub.add_parser('backfill', help='Reconstruye los rollups en paralelo')
+    backfill.add_argument('--workers', type=int, default=ROLLUP_BACKFILL_WORKERS)
+    backfill.add_argument('--chunk', type=int, default=ROLLUP_BACKFILL_CHUNK)
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        print(f"Rollups reconstruidos hasta el id {credit_rollup_service.backfill(args.workers, args.chunk)}")
+    else:
+        while True:
+            print(f"Logs procesados: {credit_rollup_service.refresh(args.batch_size)}")
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
@@ -0,0 +1,143 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.db import get_shard_connection, run_transaction, SHARD_COUNT
+
+SETTLEMENT_BATCH_SIZE = int(os.environ.get('SETTLEMENT_BATCH_SIZE', '5000'))
+
+# Un lote: toma transacciones completadas sin liquidar (índice parcial), crea un
+# lote por comercio, marca cada transacción con su lote y abona los importes.
+_SETTLE_BATCH = """
+    WITH picked AS (
+        SELECT id, merchant_id, amount FROM bank.credit_transactions
+        WHERE status = 'COMPLETED' AND settlement_batch_id IS NULL
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ), batches AS (
+        INSERT INTO bank.settlement_batches
+            (merchant_id, transactions_count, amount, first_transaction_id, last_transaction_id)
+        SELECT merchant_id, count(*), sum(amount), min(id), max(id)
+        FROM picked
+        GROUP BY merchant_id
+        RETURNING id, merchant_id, transactions_count, amount
+    ), marked AS (
+        UPDATE bank.credit_transactions t
+        SET settlement_batch_id = b.id
+        FROM picked p JOIN batches b ON b.merchant_id = p.merchant_id
+        WHERE t.id = p.id
+        RETURNING t.id
+    ), credited AS (
+        INSERT INTO bank.merchant_settlement_accounts AS a (merchant_id, balance)
+        SELECT merchant_id, amount FROM batches
+        ORDER BY merchant_id
+        ON CONFLICT (merchant_id) DO UPDATE
+        SET balance = a.balance + EXCLUDED.balance, updated_at = now()
+        RETURNING merchant_id
+    )
+    SELECT (SELECT count(*) FROM marked),
+           (SELECT count(*) FROM batches),
+           (SELECT COALESCE(sum(amount), 0) FROM batches),
+           (SELECT count(*) FROM credited)
+"""
+
+
+class SettlementService:
+    """
+    Liquidación incremental a comercios de las transacciones de crédito completadas.
+
+    Las transacciones se completan fuera del orden de sus ids, así que en lugar
+    de una marca de agua por id cada transacción guarda el lote que la liquidó
+    (settlement_batch_id) y las pendientes se encuentran por un índice parcial
+    que solo contiene las completadas sin liquidar: su tamaño es el atraso, no
+    el histórico. Cada lote es una transacción que agrega por comercio y abona
+    bank.merchant_settlement_accounts con sentencias por conjuntos. Cada shard
+    liquida sus propias transacciones; el saldo de un comercio es la suma de
+    sus cuentas en todos los shards.
+    """
+
+    def _settle_batch(self, shard: int, batch_size: int) -> tuple:
+        def settle(cur):
+            cur.execute(_SETTLE_BATCH, (batch_size,))
+            return cur.fetchone()
+
+        return run_transaction('settlement', lambda: get_shard_connection(shard), settle)
+
+    def settle_shard(self, shard: int, batch_size: int = SETTLEMENT_BATCH_SIZE, max_batches: int = None) -> dict:
+        """Liquida lotes en un shard hasta ponerse al día (o hasta max_batches)."""
+        result = {'shard': shard, 'transactions': 0, 'batches': 0, 'amount': 0, 'merchants': 0}
+        done = 0
+        while max_batches is None or done < max_batches:
+            transactions, batches, amount, merchants = self._settle_batch(shard, batch_size)
+            done += 1
+            result['transactions'] += transactions
+            result['batches'] += batches
+            result['amount'] += amount
+            result['merchants'] += merchants
+            if transactions < batch_size:
+                break
+        return result
+
+    def settle(self, batch_size: int = SETTLEMENT_BATCH_SIZE, max_batches: int = None) -> dict:
+        """
+        Liquida todos los shards en paralelo. Devuelve los totales y las
+        transacciones liquidadas por segundo.
+        """
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=SHARD_COUNT) as executor:
+            shards = list(executor.map(lambda shard: self.settle_shard(shard, batch_size, max_batches),
+                                       range(SHARD_COUNT)))
+        elapsed = time.perf_counter() - started
+        transactions = sum(s['transactions'] for s in shards)
+        return {
+            'transactions': transactions,
+            'batches': sum(s['batches'] for s in shards),
+            'amount': sum(s['amount'] for s in shards),
+            'seconds': round(elapsed, 2),
+            'transactions_per_second': round(transactions / elapsed, 1) if elapsed > 0 else None,
+            'shards': shards,
+        }
+
+    def backlog(self) -> int:
+        """Transacciones completadas pendientes de liquidar en todos los shards."""
+        total = 0
+        for shard in range(SHARD_COUNT):
+            conn = get_shard_connection(shard)
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT count(*) FROM bank.credit_transactions
+                    WHERE status = 'COMPLETED' AND settlement_batch_id IS NULL
+                """)
+                total += cur.fetchone()[0]
+            finally:
+                cur.close()
+                conn.close()
+        return total
+
+
+# Crear una instancia global del servicio
+settlement_service = SettlementService()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Liquidación a comercios de transacciones de crédito')
+    parser.add_argument('command', choices=['run', 'backlog'])
+    parser.add_argument('--batch-size', type=int, default=SETTLEMENT_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=0,
+                        help='Segundos entre pasadas; 0 ejecuta una sola vez')
+    args = parser.parse_args()
+
+    if args.command == 'backlog':
+        print(f"Transacciones pendientes de liquidar: {settlement_service.backlog()}")
+    else:
+        while True:
+            result = settlement_service.settle(args.batch_size)
+            print(f"Liquidadas {result['transactions']} transacciones en {result['batches']} lotes "
+                  f"por {result['amount']} ({result['seconds']} s, "
+                  f"{result['transactions_per_second']} transacciones/s)")
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
@@ -0,0 +1,87 @@
+import datetime
+from app.batch import BatchJob, run_job, BATCH_WORKERS, BATCH_CHUNK_SIZE
+
+
+class StatementJob(BatchJob):
+    """
+    Extractos mensuales de cada fila de bank.credit_cards.
+
+    Compras: transacciones COMPLETED con su retención capturada. Pagos:
+    bank.credit_card_payments. El saldo de cierre se obtiene desde el saldo
+    actual de la tarjeta deshaciendo los movimientos posteriores al periodo,
+    y el de apertura restando los del propio periodo.
+    """
+
+    name = 'statements'
+    table = 'bank.credit_cards'
+    read_sql = """
+        SELECT c.id, %(period)s::date, c.user_id,
+               closing.balance - COALESCE(p.total, 0) + COALESCE(y.total, 0),
+               COALESCE(p.count, 0), COALESCE(p.total, 0),
+               COALESCE(y.count, 0), COALESCE(y.total, 0),
+               closing.balance
+        FROM bank.credit_cards c
+        LEFT JOIN (
+            SELECT h.credit_card_id,
+                   count(*) FILTER (WHERE t.created_at < %(end)s) AS count,
+                   sum(h.amount) FILTER (WHERE t.created_at < %(end)s) AS total,
+                   sum(h.amount) FILTER (WHERE t.created_at >= %(end)s) AS later
+            FROM bank.credit_holds h
+            JOIN bank.credit_transactions t ON t.id = h.transaction_id
+            WHERE h.credit_card_id BETWEEN %(first_id)s AND %(last_id)s
+              AND h.status = 'CAPTURED' AND t.status = 'COMPLETED'
+              AND t.created_at >= %(start)s
+            GROUP BY h.credit_card_id
+        ) p ON p.credit_card_id = c.id
+        LEFT JOIN (
+            SELECT credit_card_id,
+                   count(*) FILTER (WHERE created_at < %(end)s) AS count,
+                   sum(amount) FILTER (WHERE created_at < %(end)s) AS total,
+                   sum(amount) FILTER (WHERE created_at >= %(end)s) AS later
+            FROM bank.credit_card_payments
+            WHERE credit_card_id BETWEEN %(first_id)s AND %(last_id)s
+              AND created_at >= %(start)s
+            GROUP BY credit_card_id
+        ) y ON y.credit_card_id = c.id
+        CROSS JOIN LATERAL (
+            SELECT c.balance - COALESCE(p.later, 0) + COALESCE(y.later, 0) AS balance
+        ) closing
+        WHERE c.id BETWEEN %(first_id)s AND %(last_id)s
+        ORDER BY c.id
+    """
+    write_sql = """
+        INSERT INTO bank.credit_card_statements
+        (credit_card_id, period, user_id, opening_balance, purchases_count, purchases_total,
+         payments_count, payments_total, closing_balance)
+        VALUES %s
+        ON CONFLICT (credit_card_id, period) DO UPDATE SET
+            opening_balance = EXCLUDED.opening_balance,
+            purchases_count = EXCLUDED.purchases_count,
+            purchases_total = EXCLUDED.purchases_total,
+            payments_count = EXCLUDED.payments_count,
+            payments_total = EXCLUDED.payments_total,
+            closing_balance = EXCLUDED.closing_balance,
+            generated_at = now()
+    """
+
+    def params(self, run_key):
+        start = datetime.datetime.strptime(run_key, '%Y-%m')
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+        return {'period': start.date(), 'start': start, 'end': end}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Extractos mensuales de tarjetas de crédito')
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--period', required=True, help='Mes del extracto, YYYY-MM')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--chunk', type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignora los checkpoints y recalcula todo el periodo')
+    args = parser.parse_args()
+
+    result = run_job(StatementJob(), args.period, args.workers, args.chunk, args.restart)
+    print(f"Extractos {args.period}: {result['rows']} filas en {result['chunks']} trozos "
+          f"({result['failed']} con error), {result['seconds']} s, {result['rows_per_second']} filas/s")
@@ -0,0 +1,224 @@
+import os
+import time
+import uuid
+import psycopg2
+from app.db import get_connection, get_shard_connection, shard_for_user, SHARD_COUNT
+from app.db import run_transaction, retry_transaction, TX_ISOLATION_LEVEL
+from app.services.account_service import account_service
+
+# Una transacción PREPARING más antigua que esto se da por abortada en la recuperación
+TWO_PC_TIMEOUT_SECONDS = int(os.environ.get('TWO_PC_TIMEOUT_SECONDS', '60'))
+# format_id de los xid de transferencias, para no tocar transacciones preparadas ajenas
+TRANSFER_XID_FORMAT = 0x4342
+
+
+class TransferService:
+    """
+    Transferencias entre cuentas, posiblemente en shards distintos.
+
+    En el mismo shard es una transacción local. Entre shards se usa commit en
+    dos fases: ambos shards preparan su parte (débito y crédito), el
+    coordinador registra la decisión en bank.transfer_coordinator de la base
+    principal y después se confirman las dos ramas. Si el proceso cae entre
+    medias, recover() resuelve las transacciones preparadas según ese registro.
+    """
+
+    def _debit(self, cur, sender_id: int, amount: float) -> float:
+        account_service.lock_for_debit(cur, sender_id)
+        cur.execute("SELECT balance FROM bank.accounts WHERE user_id = %s", (sender_id,))
+        row = cur.fetchone()
+        if not row:
+            raise LookupError("Sender account not found")
+        if float(row[0]) < amount:
+            raise ValueError("Insufficient funds")
+        cur.execute("UPDATE bank.accounts SET balance = balance - %s WHERE user_id = %s RETURNING balance",
+                    (amount, sender_id))
+        return float(cur.fetchone()[0])
+
+    def transfer(self, sender_id: int, target_id: int, target_shard: int, amount: float) -> float:
+        """
+        Mueve amount de la cuenta de sender_id a la de target_id. Devuelve el
+        nuevo saldo del emisor. LookupError si falta una cuenta, ValueError si
+        no hay fondos y TransactionConflict si los conflictos persisten tras
+        los reintentos.
+        """
+        sender_shard = shard_for_user(sender_id)
+        if sender_shard != target_shard:
+            # Cada intento usa un gid nuevo; los fallidos quedan ABORTED en el coordinador
+            return retry_transaction('transfer_2pc', lambda: self._transfer_two_phase(
+                sender_id, sender_shard, target_id, target_shard, amount))
+
+        def move(cur):
+            new_balance = self._debit(cur, sender_id, amount)
+            if account_service.credit(cur, target_id, amount, column='user_id') is None:
+                raise LookupError("Target account not found")
+            return new_balance
+
+        return run_transaction('transfer', lambda: get_shard_connection(sender_shard), move)
+
+    def _set_status(self, gid: str, status: str, from_status: str = 'PREPARING') -> bool:
+        """Cambia el estado en el log del coordinador solo si sigue en from_status."""
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE bank.transfer_coordinator SET status = %s
+                WHERE gid = %s AND status = %s
+            """, (status, gid, from_status))
+            changed = cur.rowcount == 1
+            conn.commit()
+            return changed
+        finally:
+            cur.close()
+            conn.close()
+
+    def _mark_resolved(self, gids) -> None:
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE bank.transfer_coordinator SET resolved_at = now()
+                WHERE gid = ANY(%s) AND resolved_at IS NULL
+            """, (list(gids),))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _abort(self, conn) -> None:
+        try:
+            conn.tpc_rollback()
+        except psycopg2.Error:
+            pass
+
+    def _transfer_two_phase(self, sender_id, sender_shard, target_id, target_shard, amount) -> float:
+        gid = f"xfer-{uuid.uuid4().hex}"
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO bank.transfer_coordinator
+                (gid, sender_id, target_id, amount, sender_shard, target_shard)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (gid, sender_id, target_id, amount, sender_shard, target_shard))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+        sender_conn = get_shard_connection(sender_shard)
+        target_conn = get_shard_connection(target_shard)
+        sender_conn.set_session(isolation_level=TX_ISOLATION_LEVEL)
+        target_conn.set_session(isolation_level=TX_ISOLATION_LEVEL)
+        try:
+            # Fase 1: cada shard hace y prepara su parte
+            try:
+                sender_conn.tpc_begin(sender_conn.xid(TRANSFER_XID_FORMAT, gid, 'sender'))
+                with sender_conn.cursor() as sender_cur:
+                    new_balance = self._debit(sender_cur, sender_id, amount)
+                target_conn.tpc_begin(target_conn.xid(TRANSFER_XID_FORMAT, gid, 'target'))
+                with target_conn.cursor() as target_cur:
+                    if account_service.credit(target_cur, target_id, amount, column='user_id') is None:
+                        raise LookupError("Target account not found")
+                sender_conn.tpc_prepare()
+                target_conn.tpc_prepare()
+            except Exception:
+                self._abort(sender_conn)
+                self._abort(target_conn)
+                if self._set_status(gid, 'ABORTED'):
+                    self._mark_resolved([gid])
+                raise
+
+            # Decisión: si la recuperación ya la abortó por tiempo, se deshace
+            if not self._set_status(gid, 'COMMITTED'):
+                self._abort(sender_conn)
+                self._abort(target_conn)
+                raise RuntimeError("Transfer aborted by recovery")
+
+            # Fase 2: a partir de aquí la transferencia está decidida; si una
+            # rama no llega a confirmarse la completa recover()
+            try:
+                sender_conn.tpc_commit()
+                target_conn.tpc_commit()
+                self._mark_resolved([gid])
+            except psycopg2.Error as e:
+                print(f"Transfer {gid} committed, pending recovery: {str(e)}")
+            return new_balance
+        finally:
+            sender_conn.close()
+            target_conn.close()
+
+    def recover(self, timeout: int = TWO_PC_TIMEOUT_SECONDS) -> dict:
+        """
+        Resuelve las transacciones en duda. Las que siguen PREPARING más allá de
+        timeout se abortan (aborto presunto); después cada rama preparada en los
+        shards se confirma o se deshace según la decisión registrada.
+        """
+        result = {'committed': 0, 'rolled_back': 0, 'pending': 0}
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                UPDATE bank.transfer_coordinator SET status = 'ABORTED'
+                WHERE status = 'PREPARING' AND created_at < now() - make_interval(secs => %s)
+            """, (timeout,))
+            conn.commit()
+
+            in_doubt = set()
+            for shard in range(SHARD_COUNT):
+                shard_conn = get_shard_connection(shard)
+                try:
+                    dbname = shard_conn.info.dbname
+                    for xid in shard_conn.tpc_recover():
+                        # pg_prepared_xacts lista todo el servidor: solo las de esta base
+                        if xid.format_id != TRANSFER_XID_FORMAT or xid.database != dbname:
+                            continue
+                        cur.execute("SELECT status FROM bank.transfer_coordinator WHERE gid = %s",
+                                    (xid.gtrid,))
+                        row = cur.fetchone()
+                        conn.commit()
+                        status = row[0] if row else 'ABORTED'
+                        if status == 'COMMITTED':
+                            shard_conn.tpc_commit(xid)
+                            result['committed'] += 1
+                        elif status == 'ABORTED':
+                            shard_conn.tpc_rollback(xid)
+                            result['rolled_back'] += 1
+                        else:
+                            in_doubt.add(xid.gtrid)
+                            result['pending'] += 1
+                finally:
+                    shard_conn.close()
+
+            # Las decididas sin ramas pendientes quedan resueltas
+            cur.execute("""
+                UPDATE bank.transfer_coordinator SET resolved_at = now()
+                WHERE resolved_at IS NULL AND status IN ('COMMITTED', 'ABORTED')
+                  AND NOT (gid = ANY(%s))
+            """, (list(in_doubt),))
+            conn.commit()
+            return result
+        finally:
+            cur.close()
+            conn.close()
+
+
+# Crear una instancia global del servicio
+transfer_service = TransferService()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Recuperación de transferencias 2PC en duda')
+    parser.add_argument('command', choices=['recover'])
+    parser.add_argument('--timeout', type=int, default=TWO_PC_TIMEOUT_SECONDS)
+    parser.add_argument('--interval', type=float, default=0,
+                        help='Segundos entre pasadas; 0 ejecuta una sola vez')
+    args = parser.parse_args()
+
+    while True:
+        print(f"Transacciones resueltas: {transfer_service.recover(args.timeout)}")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
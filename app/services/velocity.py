@@ -0,0 +1,190 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# Reglas si se activa el motor sin VELOCITY_RULES: máximo `limit` pagos por clave en `window` segundos
+DEFAULT_VELOCITY_RULES = [
+    {'name': 'user_per_minute', 'scope': 'user', 'limit': 5, 'window': 60, 'buckets': 12},
+    {'name': 'card_per_hour', 'scope': 'card', 'limit': 20, 'window': 3600, 'buckets': 30},
+    {'name': 'merchant_per_second', 'scope': 'merchant', 'limit': 50, 'window': 1, 'buckets': 10},
+]
+
+# Desactivado por defecto: las reglas cambian qué pagos se aceptan, hay que activarlas a propósito
+VELOCITY_ENABLED = os.environ.get('VELOCITY_ENABLED', 'false').lower() == 'true'
+# Reglas como JSON en la variable o en un fichero (tiene prioridad el fichero)
+VELOCITY_RULES = os.environ.get('VELOCITY_RULES')
+VELOCITY_RULES_FILE = os.environ.get('VELOCITY_RULES_FILE')
+VELOCITY_MAX_KEYS = int(os.environ.get('VELOCITY_MAX_KEYS', '100000'))
+# Contadores compartidos entre workers de gunicorn mediante memoria compartida
+VELOCITY_SHARED = os.environ.get('VELOCITY_SHARED', 'false').lower() == 'true'
+VELOCITY_SHM_PATH = os.environ.get('VELOCITY_SHM_PATH', '/dev/shm/corebank-velocity')
+VELOCITY_SHM_SLOTS = int(os.environ.get('VELOCITY_SHM_SLOTS', '16384'))
+
+MAX_BUCKETS = 32
+SCOPES = ('user', 'card', 'merchant')
+
+
+class VelocityRule:
+    def __init__(self, name, scope, limit, window, buckets=10):
+        if scope not in SCOPES:
+            raise ValueError(f"Invalid velocity scope: {scope}")
+        if not 1 <= buckets <= MAX_BUCKETS:
+            raise ValueError(f"Buckets must be between 1 and {MAX_BUCKETS}")
+        self.name = name
+        self.scope = scope
+        self.limit = int(limit)
+        self.window = float(window)
+        self.buckets = int(buckets)
+        self.bucket_width = self.window / self.buckets
+
+    def epoch(self, now):
+        return int(now // self.bucket_width)
+
+
+def load_rules():
+    """Carga las reglas desde VELOCITY_RULES_FILE, VELOCITY_RULES o las de por defecto."""
+    if VELOCITY_RULES_FILE:
+        with open(VELOCITY_RULES_FILE) as rules_file:
+            definitions = json.load(rules_file)
+    elif VELOCITY_RULES:
+        definitions = json.loads(VELOCITY_RULES)
+    else:
+        definitions = DEFAULT_VELOCITY_RULES
+    return [VelocityRule(**definition) for definition in definitions]
+
+
+def _ring_hit(epochs, counts, buckets, current):
+    """
+    Suma un evento al buffer circular (epochs/counts de `buckets` posiciones)
+    y devuelve el total de la ventana, incluido el evento.
+    """
+    index = current % buckets
+    if epochs[index] != current:
+        epochs[index] = current
+        counts[index] = 0
+    counts[index] += 1
+    oldest = current - buckets
+    return sum(counts[i] for i in range(buckets) if epochs[i] > oldest)
+
+
+class LocalCounterStore:
+    """Contadores en memoria del proceso, con desalojo LRU de las claves inactivas."""
+
+    def __init__(self, max_keys=VELOCITY_MAX_KEYS):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, rule, key, now):
+        counter_key = (rule.name, key)
+        current = rule.epoch(now)
+        with self._lock:
+            counter = self._counters.get(counter_key)
+            if counter is None:
+                counter = self._counters[counter_key] = ([-1] * rule.buckets, [0] * rule.buckets)
+                while len(self._counters) > self.max_keys:
+                    self._counters.popitem(last=False)
+            else:
+                self._counters.move_to_end(counter_key)
+            return _ring_hit(counter[0], counter[1], rule.buckets, current)
+
+
+class SharedCounterStore:
+    """
+    Contadores compartidos entre procesos sobre un fichero mapeado en memoria
+    (por defecto en /dev/shm). La tabla tiene un número fijo de slots agrupados
+    de GROUP_SIZE en GROUP_SIZE; cada clave se busca dentro de su grupo, que se
+    bloquea con un lock de rango de bytes (fcntl). Si el grupo está lleno se
+    reutiliza el slot usado hace más tiempo.
+    """
+
+    GROUP_SIZE = 8
+    # fingerprint, último uso, epochs y counts de MAX_BUCKETS posiciones
+    SLOT = struct.Struct(f'<Qd{MAX_BUCKETS}q{MAX_BUCKETS}I')
+
+    def __init__(self, path=VELOCITY_SHM_PATH, slots=VELOCITY_SHM_SLOTS):
+        self.groups = max(1, slots // self.GROUP_SIZE)
+        self.group_bytes = self.SLOT.size * self.GROUP_SIZE
+        size = self.groups * self.group_bytes
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # El lock de fcntl es por proceso: los hilos del mismo proceso se coordinan aquí
+        self._thread_lock = threading.Lock()
+
+    def hit(self, rule, key, now):
+        digest = hashlib.blake2b(f"{rule.name}:{key}".encode(), digest_size=16).digest()
+        fingerprint = int.from_bytes(digest[:8], 'little') | 1
+        group = int.from_bytes(digest[8:], 'little') % self.groups
+        start = group * self.group_bytes
+        current = rule.epoch(now)
+
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.group_bytes, start)
+            try:
+                slot_offset = None
+                victim_offset, victim_used = None, None
+                for i in range(self.GROUP_SIZE):
+                    offset = start + i * self.SLOT.size
+                    slot_fp, last_used = struct.unpack_from('<Qd', self._map, offset)
+                    if slot_fp == fingerprint:
+                        slot_offset = offset
+                        break
+                    if victim_used is None or last_used < victim_used:
+                        victim_offset, victim_used = offset, last_used
+
+                if slot_offset is None:
+                    # Clave nueva: ocupar un slot libre o el menos usado del grupo
+                    slot_offset = victim_offset
+                    values = [fingerprint, now] + [-1] * MAX_BUCKETS + [0] * MAX_BUCKETS
+                else:
+                    values = list(self.SLOT.unpack_from(self._map, slot_offset))
+                    values[1] = now
+
+                epochs = values[2:2 + MAX_BUCKETS]
+                counts = values[2 + MAX_BUCKETS:]
+                total = _ring_hit(epochs, counts, rule.buckets, current)
+                self.SLOT.pack_into(self._map, slot_offset, values[0], values[1], *epochs, *counts)
+                return total
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.group_bytes, start)
+
+
+class VelocityEngine:
+    """Aplica las reglas de velocidad a cada pago antes de tocar la base de datos."""
+
+    def __init__(self, rules, store):
+        self.rules = rules
+        self.store = store
+
+    def check(self, user_id, card_key, merchant_id, now=None):
+        """
+        Registra el intento en cada regla y lanza ValueError si alguna supera
+        su límite. Los intentos rechazados también cuentan.
+        """
+        now = time.time() if now is None else now
+        keys = {'user': user_id, 'card': card_key, 'merchant': merchant_id}
+        exceeded = None
+        for rule in self.rules:
+            if self.store.hit(rule, keys[rule.scope], now) > rule.limit and exceeded is None:
+                exceeded = rule
+        if exceeded is not None:
+            raise ValueError(f"Velocity limit exceeded: {exceeded.name}")
+
+
+def _create_engine():
+    if not VELOCITY_ENABLED:
+        return None
+    store = SharedCounterStore() if VELOCITY_SHARED else LocalCounterStore()
+    return VelocityEngine(load_rules(), store)
+
+
+# Crear una instancia global del motor
+velocity_engine = _create_engine()
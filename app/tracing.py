@@ -0,0 +1,311 @@
+# app/tracing.py
+
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from functools import wraps
+from app.json_provider import dumps
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() == 'true'
+# Fracción de peticiones trazadas; la decisión se toma al empezar la petición
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+# Respetar el flag de muestreo de un traceparent entrante. Solo detrás de un
+# proxy de confianza: si no, cualquier cliente forzaría trazas completas a disco
+TRACE_TRUST_PARENT = os.environ.get('TRACE_TRUST_PARENT', 'false').lower() == 'true'
+TRACE_DIR = os.environ.get('TRACE_DIR', 'logs/traces')
+# 'chrome' (trace-event JSON, abre en chrome://tracing o Perfetto) u 'otlp' (OTLP/JSON por líneas)
+TRACE_FORMAT = os.environ.get('TRACE_FORMAT', 'chrome')
+# Duraciones recientes que se guardan por etapa para los percentiles del resumen
+TRACE_SUMMARY_WINDOW = int(os.environ.get('TRACE_SUMMARY_WINDOW', '1024'))
+SERVICE_NAME = os.environ.get('SERVICE_NAME', 'corebank')
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+_SQL_VERB = re.compile(r'^\s*(\w+)')
+_SQL_TABLE = re.compile(r'\bbank\.(\w+)')
+
+# (traza, id del span actual) del contexto: hilo o greenlet
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class Trace:
+    __slots__ = ('trace_id', 'parent_id', 'spans')
+
+    def __init__(self, trace_id, parent_id=None):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        # (span_id, parent_id, nombre, inicio ns epoch, duración ns, atributos)
+        self.spans = []
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'trace', 'parent_id', 'span_id', 'name', 'attrs', 'start', 'started', 'token')
+
+    def __init__(self, tracer, trace, parent_id, name, attrs):
+        self.tracer = tracer
+        self.trace = trace
+        self.parent_id = parent_id
+        self.span_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.token = _current.set((self.trace, self.span_id))
+        self.start = time.time_ns()
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter_ns() - self.started
+        _current.reset(self.token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.trace.spans.append((self.span_id, self.parent_id, self.name, self.start, duration, self.attrs))
+        self.tracer._record(self.name, duration)
+        return False
+
+
+class Tracer:
+    """
+    Trazas por petición con muestreo en cabecera: la decisión de trazar se toma
+    al empezar la petición (o la hereda de un traceparent entrante de
+    confianza, con TRACE_TRUST_PARENT) y, si no se
+    traza, span() devuelve un objeto vacío sin coste apreciable. Las trazas
+    muestreadas se escriben en TRACE_DIR, un fichero por worker, y sus
+    duraciones alimentan el resumen por etapa.
+    """
+
+    def __init__(self, enabled=TRACING_ENABLED, sample_rate=TRACE_SAMPLE_RATE,
+                 directory=TRACE_DIR, export_format=TRACE_FORMAT, window=TRACE_SUMMARY_WINDOW,
+                 trust_parent=TRACE_TRUST_PARENT):
+        if export_format not in ('chrome', 'otlp'):
+            raise ValueError(f"Unsupported TRACE_FORMAT: {export_format}")
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.trust_parent = trust_parent
+        self.directory = directory
+        self.export_format = export_format
+        self.window = window
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._files = {}
+
+    # ---------------- Contexto ----------------
+
+    def start(self, name, traceparent=None, **attrs):
+        """Empieza la traza de una petición. Devuelve el span raíz o NOOP_SPAN."""
+        if not self.enabled:
+            return NOOP_SPAN
+        match = _TRACEPARENT.match(traceparent or '')
+        if match:
+            # Se conserva el id de traza; el flag solo decide si el origen es de confianza
+            trace = Trace(match.group(1), match.group(2))
+            if self.trust_parent:
+                sampled = int(match.group(3), 16) & 1 == 1
+            else:
+                sampled = random.random() < self.sample_rate
+        else:
+            sampled = random.random() < self.sample_rate
+            trace = Trace(os.urandom(16).hex())
+        if not sampled:
+            return NOOP_SPAN
+        root = _Span(self, trace, trace.parent_id, name, attrs)
+        return root.__enter__()
+
+    def finish(self, root, error=None):
+        """Cierra el span raíz y exporta la traza."""
+        if root is NOOP_SPAN:
+            return
+        root.__exit__(type(error) if error else None, error, None)
+        try:
+            self._export(root.trace)
+        except OSError as e:
+            print(f"Error al exportar traza: {e}")
+
+    def span(self, name, **attrs):
+        current = _current.get()
+        if current is None:
+            return NOOP_SPAN
+        return _Span(self, current[0], current[1], name, attrs)
+
+    def active(self):
+        return _current.get() is not None
+
+    def current_trace_id(self):
+        current = _current.get()
+        return current[0].trace_id if current else None
+
+    def traced(self, name):
+        """Decorador: ejecuta la función dentro de un span."""
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def db_span(self, query):
+        """Span de una sentencia SQL, nombrado por verbo y primera tabla."""
+        if _current.get() is None:
+            return NOOP_SPAN
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        verb = _SQL_VERB.match(text)
+        table = _SQL_TABLE.search(text)
+        name = f"db {verb.group(1).upper() if verb else 'SQL'}"
+        if table:
+            name += f" {table.group(1)}"
+        return self.span(name, statement=' '.join(text.split())[:200])
+
+    # ---------------- Resumen ----------------
+
+    def _record(self, name, duration):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = [0, 0, 0, deque(maxlen=self.window)]
+            stage[0] += 1
+            stage[1] += duration
+            stage[2] = max(stage[2], duration)
+            stage[3].append(duration)
+
+    def summary(self):
+        """Latencia por etapa (ms) de las trazas muestreadas en este worker."""
+        with self._lock:
+            stages = {name: (s[0], s[1], s[2], sorted(s[3])) for name, s in self._stages.items()}
+
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(p * len(values)))] / 1e6
+
+        result = {}
+        for name, (count, total, longest, recent) in sorted(stages.items(), key=lambda s: -s[1][1]):
+            result[name] = {
+                'count': count,
+                'total_ms': round(total / 1e6, 3),
+                'avg_ms': round(total / count / 1e6, 3),
+                'p50_ms': round(percentile(recent, 0.50), 3),
+                'p95_ms': round(percentile(recent, 0.95), 3),
+                'p99_ms': round(percentile(recent, 0.99), 3),
+                'max_ms': round(longest / 1e6, 3),
+            }
+        return {'pid': os.getpid(), 'sample_rate': self.sample_rate, 'stages': result}
+
+    # ---------------- Exportación ----------------
+
+    def _file(self, suffix, header=b''):
+        pid = os.getpid()
+        handle = self._files.get(pid)
+        if handle is None:
+            os.makedirs(self.directory, exist_ok=True)
+            handle = open(os.path.join(self.directory, f"trace-{pid}.{suffix}"), 'ab')
+            if handle.tell() == 0:
+                handle.write(header)
+            self._files = {pid: handle}
+        return handle
+
+    def _export(self, trace):
+        if self.export_format == 'chrome':
+            payload = self._chrome_events(trace)
+            suffix, header = 'json', b'[\n'
+        else:
+            payload = dumps(self._otlp_request(trace)) + b'\n'
+            suffix, header = 'otlp.jsonl', b''
+        with self._file_lock:
+            handle = self._file(suffix, header)
+            handle.write(payload)
+            handle.flush()
+
+    def _chrome_events(self, trace):
+        # Formato de array de trace-event: el ']' final es opcional, así el fichero solo crece
+        # Una fila por traza: con gevent varias peticiones comparten hilo
+        pid = os.getpid()
+        tid = int(trace.trace_id[:8], 16)
+        lines = []
+        for span_id, parent_id, name, start, duration, attrs in trace.spans:
+            lines.append(dumps({
+                'name': name,
+                'cat': name.split(' ', 1)[0],
+                'ph': 'X',
+                'ts': start / 1000,
+                'dur': duration / 1000,
+                'pid': pid,
+                'tid': tid,
+                'args': dict(attrs, trace_id=trace.trace_id, span_id=span_id, parent_id=parent_id),
+            }) + b',\n')
+        return b''.join(lines)
+
+    def _otlp_request(self, trace):
+        def attributes(attrs):
+            return [{'key': k, 'value': {'intValue': str(v)} if isinstance(v, int) and not isinstance(v, bool)
+                     else {'stringValue': str(v)}} for k, v in attrs.items()]
+
+        spans = []
+        for span_id, parent_id, name, start, duration, attrs in trace.spans:
+            span = {
+                'traceId': trace.trace_id,
+                'spanId': span_id,
+                'name': name,
+                'kind': 2 if parent_id == trace.parent_id else 1,
+                'startTimeUnixNano': str(start),
+                'endTimeUnixNano': str(start + duration),
+                'attributes': attributes(attrs),
+            }
+            if parent_id:
+                span['parentSpanId'] = parent_id
+            if 'error' in attrs:
+                span['status'] = {'code': 2}
+            spans.append(span)
+        return {'resourceSpans': [{
+            'resource': {'attributes': attributes({'service.name': SERVICE_NAME,
+                                                   'process.pid': os.getpid()})},
+            'scopeSpans': [{'scope': {'name': 'app.tracing'}, 'spans': spans}],
+        }]}
+
+    # ---------------- Flask ----------------
+
+    def init_app(self, app):
+        """Abre una traza por petición y la cierra en el teardown."""
+        from flask import g, request
+
+        @app.before_request
+        def _start_trace():
+            g.trace_root = self.start(f"{request.method} {request.path}",
+                                      request.headers.get('traceparent'),
+                                      method=request.method, path=request.path)
+
+        @app.after_request
+        def _trace_header(response):
+            root = g.get('trace_root', NOOP_SPAN)
+            if root is not NOOP_SPAN:
+                root.set(http_code=response.status_code)
+                response.headers['traceparent'] = f"00-{root.trace.trace_id}-{root.span_id}-01"
+            return response
+
+        @app.teardown_request
+        def _finish_trace(error=None):
+            self.finish(g.pop('trace_root', NOOP_SPAN), error)
+
+
+# Crear una instancia global del trazador
+tracer = Tracer()
@@ -0,0 +1,91 @@
+# app/validation.py
+
+import numbers
+import os
+from http import HTTPStatus
+from flask_restx import abort
+
+# Sustituir la validación jsonschema de los modelos por validadores compilados
+PRECOMPILED_VALIDATORS = os.environ.get('PRECOMPILED_VALIDATORS', 'true').lower() == 'true'
+
+# Tipos de Draft 4 con la misma semántica que el type checker de jsonschema:
+# bool no es integer ni number y 1.0 no es integer
+_TYPES = {
+    'string': lambda v: isinstance(v, str),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, numbers.Number) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'null': lambda v: v is None,
+}
+# Palabras clave de los esquemas que no validan nada
+_ANNOTATIONS = {'description', 'example', 'title', 'default', 'readOnly'}
+
+
+def compile_schema(schema, format_checker=None):
+    """
+    Compila el esquema de un modelo plano (object con properties de un solo
+    tipo y required) en check(data) -> [(clave, mensaje)], con las mismas
+    claves, mensajes y orden que Model.format_error sobre los errores de
+    Draft4Validator. Devuelve None si el esquema usa algo no soportado; ese
+    modelo sigue validándose con jsonschema.
+    """
+    if schema.get('type') != 'object' or set(schema) - _ANNOTATIONS - {'type', 'properties', 'required'}:
+        return None
+    # Sin format_checker, jsonschema tampoco comprueba 'format'
+    allowed = _ANNOTATIONS | {'type'} | ({'format'} if format_checker is None else set())
+    properties = []
+    for name, prop in schema.get('properties', {}).items():
+        if set(prop) - allowed or prop.get('type') not in _TYPES:
+            return None
+        properties.append((name, _TYPES[prop['type']], f" is not of type {prop['type']!r}"))
+    required = tuple(schema.get('required', ()))
+
+    def check_required(data, errors):
+        for name in required:
+            if name not in data:
+                errors.append((name, f"{name!r} is a required property"))
+
+    def check_properties(data, errors):
+        for name, accepts, message in properties:
+            if name in data and not accepts(data[name]):
+                errors.append((name, f"{data[name]!r}{message}"))
+
+    # jsonschema recorre las palabras clave en el orden del esquema
+    steps = tuple(check_required if keyword == 'required' else check_properties
+                  for keyword in schema if keyword in ('required', 'properties'))
+
+    def check(data):
+        if not isinstance(data, dict):
+            return [('', f"{data!r} is not of type 'object'")]
+        errors = []
+        for step in steps:
+            step(data, errors)
+        return errors
+
+    return check
+
+
+class CompiledValidator:
+    """Reemplazo de Model.validate: mismo 400 que Flask-RESTX, sin jsonschema."""
+
+    def __init__(self, check):
+        self.check = check
+
+    def __call__(self, data, resolver=None, format_checker=None):
+        errors = self.check(data)
+        if errors:
+            abort(HTTPStatus.BAD_REQUEST, message="Input payload validation failed", errors=dict(errors))
+
+
+def precompile_models(api):
+    """Compila una vez los modelos de api. Devuelve los nombres de los compilados."""
+    compiled = []
+    for name, model in api.models.items():
+        check = compile_schema(model.__schema__, api.format_checker)
+        if check is None:
+            continue
+        model.validate = CompiledValidator(check)
+        compiled.append(name)
+    return compiled
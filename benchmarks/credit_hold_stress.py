@@ -0,0 +1,134 @@
+"""
+Prueba de estrés de retenciones de crédito: muchos pagos concurrentes sobre
+la misma tarjeta no deben reservar más que el crédito disponible.
+
+Lanza --threads hilos que llaman a credit_service.process_payment para el
+mismo usuario y comprueba que el número de pagos aceptados coincide con
+floor(crédito disponible / importe) y que held nunca supera el límite. Al
+final caduca y libera las retenciones creadas. Uso (base de datos local):
+    python -m benchmarks.credit_hold_stress --user-id 1 --threads 32 --attempts 20 --amount 37.5
+"""
+
+import argparse
+import math
+import threading
+import time
+import app.services.credit_service as credit_module
+from app.db import get_connection, get_user_connection
+from app.services.credit_service import credit_service
+from app.services.hold_service import credit_hold_service
+
+# Número de tarjeta válido según Luhn para los pagos de prueba
+TEST_CARD = '4532015112830366'
+
+
+def card_state(user_id):
+    conn = get_user_connection(user_id)
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT limit_credit, balance, held FROM bank.credit_cards
+            WHERE user_id = %s ORDER BY id LIMIT 1
+        """, (user_id,))
+        return tuple(float(v) for v in cur.fetchone())
+    finally:
+        cur.close()
+        conn.close()
+
+
+def first_merchant():
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id FROM bank.merchants WHERE status = true ORDER BY id LIMIT 1")
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def release(user_id, transaction_ids):
+    conn = get_user_connection(user_id)
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE bank.credit_holds SET expires_at = now()
+            WHERE transaction_id = ANY(%s) AND status = 'HELD'
+        """, (transaction_ids,))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return credit_hold_service.release_expired()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--user-id', type=int, default=1)
+    parser.add_argument('--email', default='user1@example.com')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--attempts', type=int, default=20, help='pagos por hilo')
+    parser.add_argument('--amount', type=float, default=37.5)
+    args = parser.parse_args()
+
+    # Las reglas de velocidad rechazarían los pagos repetidos del mismo usuario
+    # y el número de aceptados ya no dependería solo del crédito disponible
+    credit_module.velocity_engine = None
+
+    limit_credit, balance, held = card_state(args.user_id)
+    available = limit_credit - balance - held
+    expected = min(args.threads * args.attempts, math.floor(available / args.amount))
+    merchant_id = first_merchant()
+    payload = {
+        'merchant_id': merchant_id,
+        'card_number': TEST_CARD,
+        'cvv': '123',
+        'expiry_month': 12,
+        'expiry_year': 2030,
+        'amount': args.amount,
+    }
+
+    accepted = []
+    rejected = [0] * args.threads
+    errors = [0] * args.threads
+    lock = threading.Lock()
+
+    def worker(index):
+        for _ in range(args.attempts):
+            try:
+                transaction_id, _ = credit_service.process_payment(args.user_id, args.email, dict(payload))
+                with lock:
+                    accepted.append(transaction_id)
+            except ValueError:
+                rejected[index] += 1
+            except Exception:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    after_limit, after_balance, after_held = card_state(args.user_id)
+    total = args.threads * args.attempts
+    print(f"Intentos: {total}  Aceptados: {len(accepted)}  Rechazados: {sum(rejected)}  Errores: {sum(errors)}")
+    print(f"Crédito disponible inicial: {available:.2f}  Esperados: {expected}")
+    print(f"held antes: {held:.2f}  después: {after_held:.2f}  límite: {after_limit:.2f}")
+    print(f"Pagos por segundo: {total / elapsed:.1f}")
+
+    consistent = (
+        len(accepted) == expected
+        and math.isclose(after_held - held, len(accepted) * args.amount, abs_tol=1e-6)
+        and after_balance + after_held <= after_limit + 1e-6
+    )
+    print("Resultado: OK" if consistent else "Resultado: INCONSISTENTE")
+
+    if accepted:
+        print(f"Retenciones liberadas: {release(args.user_id, accepted)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""
+Generador de datos sintéticos por factor de escala. Cada unidad de --scale
+añade 10.000 usuarios con su cuenta y su tarjeta de crédito, 50 comercios,
+~0,6 tarjetas guardadas por usuario y ~20 pagos con tarjeta por usuario, con
+sus retenciones, los logs de crédito y los logs de acceso correspondientes
+(unos 110 millones de filas con --scale 100).
+
+La distribución está sesgada: los comercios se eligen con una ley de Zipf
+(unos pocos concentran la mayoría de los pagos) y la actividad por usuario
+sigue una Pareto (el 20% de los usuarios hace ~80% de los pagos). Las horas
+del día siguen una curva diurna. Los números de tarjeta son válidos según
+Luhn; como en la aplicación solo se guarda su hash y los últimos dígitos.
+
+Los usuarios se reparten en trozos que procesa un pool de procesos. Cada
+trozo escribe con COPY en el shard de cada usuario y en la base principal
+(directorio y logs), con ids reservados de las secuencias. Conviene lanzarlo
+con la aplicación parada. Todos los usuarios generados (genN) tienen la
+contraseña --password. Uso:
+    python -m benchmarks.datagen --scale 10 --workers 8
+    python -m benchmarks.datagen --scale 1 --days 30 --seed 7
+"""
+
+import argparse
+import bisect
+import datetime
+import hashlib
+import io
+import multiprocessing
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from app.db import (get_connection, get_shard_connection, shard_for_user, SHARD_COUNT,
+                    _PRIMARY_PARAMS, _SHARD_PARAMS)
+from app.passwords import hash_password
+from app.services.hold_service import CREDIT_HOLD_TTL_SECONDS
+
+USERS_PER_SCALE = 10000
+MERCHANTS_PER_SCALE = 50
+TRANSACTIONS_PER_USER = 20
+# Bytes de texto acumulados por tabla antes de enviar un COPY
+COPY_BUFFER_BYTES = 8 * 1024 * 1024
+
+# Exponente de Zipf de los comercios y alfa de Pareto de la actividad (regla 80/20)
+MERCHANT_ZIPF_S = 1.1
+USER_PARETO_ALPHA = 1.16
+# Peso relativo de cada hora del día (0-23) en los pagos y los logs
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 9, 10, 12, 11, 9, 8, 8, 9, 10, 11, 9, 6, 4, 2]
+
+FIRST_NAMES = ['Ana', 'Luis', 'María', 'Carlos', 'Lucía', 'Javier', 'Elena', 'Pablo', 'Sofía', 'Diego']
+LAST_NAMES = ['García', 'Martínez', 'López', 'Sánchez', 'Pérez', 'Gómez', 'Díaz', 'Ruiz', 'Torres', 'Vega']
+# Acciones de los logs de acceso que no son pagos, con su peso
+OTHER_ACTIONS = [('POST /bank/deposit', 4), ('POST /bank/withdraw', 3), ('POST /bank/transfer', 3),
+                 ('GET /bank/credit-logs', 2), ('POST /bank/pay-credit-balance', 1), ('POST /auth/logout', 2)]
+FAILED_PAYMENT_ERRORS = ['Insufficient credit', 'Invalid card number', 'Card expired']
+
+
+class CopyWriter:
+    """Acumula filas en formato texto de COPY y las envía al superar COPY_BUFFER_BYTES."""
+
+    def __init__(self, cur, table, columns):
+        self.cur = cur
+        self.sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        self.lines = []
+        self.size = 0
+        self.rows = 0
+
+    def add(self, line):
+        self.lines.append(line)
+        self.size += len(line)
+        self.rows += 1
+        if self.size >= COPY_BUFFER_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.cur.copy_expert(self.sql, io.StringIO(''.join(self.lines)))
+            self.lines = []
+            self.size = 0
+
+
+def luhn_complete(partial):
+    """Añade a partial el dígito de control de Luhn."""
+    total = 0
+    for i, ch in enumerate(reversed(partial)):
+        digit = int(ch)
+        if i % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return partial + str((10 - total % 10) % 10)
+
+
+def card_number(rng):
+    """Número de 16 dígitos válido: VISA (4...) o MASTERCARD (51-55...)."""
+    if rng.random() < 0.6:
+        prefix, card_type = '4', 'VISA'
+    else:
+        prefix, card_type = '5' + str(rng.randint(1, 5)), 'MASTERCARD'
+    body = ''.join(rng.choice('0123456789') for _ in range(15 - len(prefix)))
+    return luhn_complete(prefix + body), card_type
+
+
+def _cumulative(weights):
+    cumulative, total = [], 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _pick(rng, cumulative):
+    return bisect.bisect(cumulative, rng.random() * cumulative[-1])
+
+
+def _reserve_ids(conn, sequence, table, column, count):
+    """
+    Reserva count ids consecutivos de sequence y devuelve el primero. Tiene en
+    cuenta las filas que ya existan en table con ids asignados a mano.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (sequence,))
+        cur.execute(f"""
+            SELECT setval(%(seq)s::regclass,
+                          GREATEST(COALESCE(pg_sequence_last_value(%(seq)s::regclass), 0),
+                                   (SELECT COALESCE(max({column}), 0) FROM {table}))
+                          + %(count)s) - %(count)s + 1
+        """, {'seq': sequence, 'count': count})
+        first = cur.fetchone()[0]
+        conn.commit()
+        return first
+    finally:
+        cur.close()
+
+
+def _databases():
+    """(nombre, función de conexión) de la base principal y de cada shard, sin repetir."""
+    databases = [] if _PRIMARY_PARAMS in _SHARD_PARAMS else [('primary', get_connection)]
+    databases += [(f"shard {shard}", lambda shard=shard: get_shard_connection(shard))
+                  for shard in range(SHARD_COUNT)]
+    return databases
+
+
+def create_merchants(count):
+    """Crea count comercios con los mismos ids en todas las bases. Devuelve el primer id."""
+    databases = _databases()
+    first = 1
+    for _, connect in databases:
+        conn = connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT COALESCE(max(id), 0) + 1 FROM bank.merchants")
+            first = max(first, cur.fetchone()[0])
+        finally:
+            cur.close()
+            conn.close()
+    for _, connect in databases:
+        conn = connect()
+        cur = conn.cursor()
+        try:
+            writer = CopyWriter(cur, 'bank.merchants', ('id', 'name'))
+            for merchant_id in range(first, first + count):
+                writer.add(f"{merchant_id}\tComercio {merchant_id}\n")
+            writer.flush()
+            cur.execute("SELECT setval(pg_get_serial_sequence('bank.merchants', 'id'), %s)",
+                        (first + count - 1,))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    return first
+
+
+class Part:
+    """Un trozo de usuarios consecutivos y los parámetros comunes de la generación."""
+
+    def __init__(self, index, first_user, users, merchants, first_merchant, password_hash,
+                 days, seed, end):
+        self.index = index
+        self.first_user = first_user
+        self.users = users
+        self.merchants = merchants
+        self.first_merchant = first_merchant
+        self.password_hash = password_hash
+        self.days = days
+        self.seed = seed
+        self.end = end
+
+
+def generate_part(part):
+    """Genera y carga un trozo de usuarios. Devuelve las filas escritas por tabla."""
+    rng = random.Random(part.seed * 1000003 + part.index)
+    # Los rangos de la ley de Zipf se asignan a comercios al azar, igual en todos los trozos
+    ranks = list(range(part.first_merchant, part.first_merchant + part.merchants))
+    random.Random(part.seed).shuffle(ranks)
+    merchant_cumulative = _cumulative(1 / (rank + 1) ** MERCHANT_ZIPF_S for rank in range(part.merchants))
+    hour_cumulative = _cumulative(HOUR_WEIGHTS)
+    action_cumulative = _cumulative(weight for _, weight in OTHER_ACTIONS)
+    pareto_mean = USER_PARETO_ALPHA / (USER_PARETO_ALPHA - 1)
+    start = part.end - datetime.timedelta(days=part.days)
+
+    def moment():
+        day = start + datetime.timedelta(days=rng.randrange(part.days))
+        return day.replace(hour=_pick(rng, hour_cumulative), minute=rng.randrange(60),
+                           second=rng.randrange(60))
+
+    by_shard = defaultdict(list)
+    for user_id in range(part.first_user, part.first_user + part.users):
+        by_shard[shard_for_user(user_id)].append(user_id)
+
+    written = Counter()
+    primary = get_connection()
+    primary_cur = primary.cursor()
+    directory = CopyWriter(primary_cur, 'bank.user_directory', ('username', 'user_id', 'shard'))
+    access_logs = CopyWriter(primary_cur, 'bank.logs',
+                             ('timestamp', 'log_type', 'remote_ip', 'username', 'action', 'http_code',
+                              'created_at'))
+    credit_logs = CopyWriter(primary_cur, 'bank.credit_transaction_logs',
+                             ('log_type', 'transaction_id', 'user_id', 'merchant_id', 'amount', 'status',
+                              'extra_data', 'ip_address', 'created_at'))
+    try:
+        for shard, user_ids in by_shard.items():
+            conn = get_shard_connection(shard)
+            cur = conn.cursor()
+            try:
+                # Plan de cada usuario: tarjetas guardadas y pagos (fecha, importe, estado)
+                plans = []
+                for user_id in user_ids:
+                    saved = 0 if rng.random() < 0.4 else (1 if rng.random() < 0.75 else 2)
+                    activity = rng.paretovariate(USER_PARETO_ALPHA) / pareto_mean
+                    payments = int(TRANSACTIONS_PER_USER * activity + rng.random())
+                    payments = min(payments, TRANSACTIONS_PER_USER * 100)
+                    plans.append((user_id, saved, sorted(
+                        (moment(), round(min(rng.lognormvariate(3.5, 1.0), 4000), 2),
+                         'COMPLETED' if rng.random() < 0.93 else 'EXPIRED')
+                        for _ in range(payments))))
+
+                first_credit_card = _reserve_ids(conn, 'bank.credit_cards_id_seq', 'bank.credit_cards',
+                                                 'id', len(user_ids))
+                first_encrypted = _reserve_ids(conn, 'bank.encrypted_cards_id_seq', 'bank.encrypted_cards',
+                                               'id', sum(plan[1] for plan in plans) or 1)
+                first_transaction = _reserve_ids(conn, 'bank.credit_transactions_id_seq',
+                                                 'bank.credit_transactions', 'id',
+                                                 sum(len(plan[2]) for plan in plans) or 1)
+
+                users = CopyWriter(cur, 'bank.users', ('id', 'username', 'password', 'role', 'full_name', 'email'))
+                accounts = CopyWriter(cur, 'bank.accounts', ('balance', 'user_id'))
+                credit_cards = CopyWriter(cur, 'bank.credit_cards', ('id', 'limit_credit', 'balance', 'user_id'))
+                encrypted_cards = CopyWriter(cur, 'bank.encrypted_cards',
+                                             ('id', 'user_id', 'card_number_hash', 'card_type', 'last_four',
+                                              'expiry_date', 'created_at'))
+                card_ids = {}
+                encrypted_id = first_encrypted
+                for offset, (user_id, saved, payments) in enumerate(plans):
+                    username = f"gen{user_id}"
+                    ip = f"10.{user_id >> 16 & 255}.{user_id >> 8 & 255}.{user_id & 255}"
+                    role = 'cajero' if rng.random() < 0.01 else 'cliente'
+                    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+                    users.add(f"{user_id}\t{username}\t{part.password_hash}\t{role}\t{name}\t{username}@example.com\n")
+                    directory.add(f"{username}\t{user_id}\t{shard}\n")
+                    # Una sola cuenta por usuario, como asumen todas las operaciones por user_id
+                    accounts.add(f"{rng.lognormvariate(7, 1.2):.2f}\t{user_id}\n")
+                    debt = sum(amount for _, amount, status in payments if status == 'COMPLETED')
+                    limit = max(1000, (int(debt * 1.3) // 500 + 1) * 500)
+                    credit_cards.add(f"{first_credit_card + offset}\t{limit}\t{debt:.2f}\t{user_id}\n")
+
+                    card_ids[user_id] = []
+                    for _ in range(saved):
+                        number, card_type = card_number(rng)
+                        saved_at = moment()
+                        expiry = datetime.date(part.end.year + rng.randint(1, 4), rng.randint(1, 12), 1)
+                        encrypted_cards.add(
+                            f"{encrypted_id}\t{user_id}\t{hashlib.sha256(number.encode()).hexdigest()}\t"
+                            f"{card_type}\t{number[-4:]}\t{expiry}\t{saved_at}\n")
+                        credit_logs.add(f"CARD_SAVED\t0\t{user_id}\t{ranks[0]}\t0\tCARD_SAVED\t"
+                                        f"{{\"card_type\": \"{card_type}\"}}\t{ip}\t{saved_at}\n")
+                        card_ids[user_id].append(encrypted_id)
+                        encrypted_id += 1
+
+                    at = moment()
+                    access_logs.add(f"{at}\tINFO\t{ip}\t{username}\tPOST /auth/login\t200\t{at}\n")
+                    for _ in range(len(payments) // 2 + 1):
+                        at = moment()
+                        action = OTHER_ACTIONS[_pick(rng, action_cumulative)][0]
+                        if rng.random() < 0.01:
+                            access_logs.add(f"{at}\tERROR\t{ip}\t{username}\t{action}\t500\t{at}\n")
+                        else:
+                            access_logs.add(f"{at}\tINFO\t{ip}\t{username}\t{action}\t200\t{at}\n")
+                for writer in (users, accounts, credit_cards, encrypted_cards):
+                    writer.flush()
+
+                transactions = CopyWriter(cur, 'bank.credit_transactions',
+                                          ('id', 'merchant_id', 'card_id', 'amount', 'status', 'otp_code',
+                                           'otp_verified', 'created_at', 'user_id'))
+                transaction_id = first_transaction
+                holds = []
+                for offset, (user_id, saved, payments) in enumerate(plans):
+                    username = f"gen{user_id}"
+                    ip = f"10.{user_id >> 16 & 255}.{user_id >> 8 & 255}.{user_id & 255}"
+                    for at, amount, status in payments:
+                        merchant_id = ranks[_pick(rng, merchant_cumulative)]
+                        card_id = (rng.choice(card_ids[user_id])
+                                   if card_ids[user_id] and rng.random() < 0.7 else '\\N')
+                        verified = 't' if status == 'COMPLETED' else 'f'
+                        transactions.add(f"{transaction_id}\t{merchant_id}\t{card_id}\t{amount:.2f}\t{status}\t"
+                                         f"{rng.randrange(1000000):06d}\t{verified}\t{at}\t{user_id}\n")
+                        holds.append((first_credit_card + offset, transaction_id, amount,
+                                      'CAPTURED' if status == 'COMPLETED' else 'RELEASED', at))
+
+                        access_logs.add(f"{at}\tINFO\t{ip}\t{username}\tPOST /bank/credit-payment\t200\t{at}\n")
+                        credit_logs.add(f"PAYMENT_INITIATED\t{transaction_id}\t{user_id}\t{merchant_id}\t"
+                                        f"{amount:.2f}\tPENDING\t\\N\t{ip}\t{at}\n")
+                        if status == 'COMPLETED':
+                            done = at + datetime.timedelta(seconds=rng.randint(5, 120))
+                            access_logs.add(f"{done}\tINFO\t{ip}\t{username}\tPOST /bank/verify-otp\t200\t{done}\n")
+                            credit_logs.add(f"PAYMENT_COMPLETED\t{transaction_id}\t{user_id}\t{merchant_id}\t"
+                                            f"{amount:.2f}\tCOMPLETED\t\\N\t{ip}\t{done}\n")
+                        elif rng.random() < 0.4:
+                            credit_logs.add(f"PAYMENT_FAILED\t0\t{user_id}\t{merchant_id}\t{amount:.2f}\tFAILED\t"
+                                            f"{{\"error\": \"{rng.choice(FAILED_PAYMENT_ERRORS)}\"}}\t{ip}\t{at}\n")
+                        transaction_id += 1
+                transactions.flush()
+
+                credit_holds = CopyWriter(cur, 'bank.credit_holds',
+                                          ('credit_card_id', 'transaction_id', 'amount', 'status',
+                                           'created_at', 'expires_at'))
+                ttl = datetime.timedelta(seconds=CREDIT_HOLD_TTL_SECONDS)
+                for credit_card_id, hold_transaction, amount, status, at in holds:
+                    credit_holds.add(f"{credit_card_id}\t{hold_transaction}\t{amount:.2f}\t{status}\t"
+                                     f"{at}\t{at + ttl}\n")
+                credit_holds.flush()
+                conn.commit()
+                for writer in (users, accounts, credit_cards, encrypted_cards, transactions, credit_holds):
+                    written[writer.sql.split()[1]] += writer.rows
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+                conn.close()
+
+        # El directorio se escribe después de los shards: un usuario solo es visible cuando existe
+        for writer in (directory, access_logs, credit_logs):
+            writer.flush()
+            written[writer.sql.split()[1]] += writer.rows
+        primary.commit()
+        return written
+    except Exception:
+        primary.rollback()
+        raise
+    finally:
+        primary_cur.close()
+        primary.close()
+
+
+def analyze():
+    for _, connect in _databases():
+        conn = connect()
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            cur.execute("ANALYZE")
+        finally:
+            cur.close()
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--part-users', type=int, default=2000, help='usuarios por trozo')
+    parser.add_argument('--days', type=int, default=90, help='días hacia atrás de la actividad generada')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password', default='datagen')
+    args = parser.parse_args()
+
+    user_count = int(USERS_PER_SCALE * args.scale)
+    merchant_count = max(10, int(MERCHANTS_PER_SCALE * args.scale))
+    started = time.perf_counter()
+
+    first_merchant = create_merchants(merchant_count)
+    primary = get_connection()
+    try:
+        first_user = _reserve_ids(primary, 'bank.global_user_id_seq', 'bank.user_directory', 'user_id',
+                                  user_count)
+    finally:
+        primary.close()
+    password_hash = hash_password(args.password)
+    end = datetime.datetime.now().replace(microsecond=0)
+    parts = [Part(index, first_user + offset, min(args.part_users, user_count - offset), merchant_count,
+                  first_merchant, password_hash, args.days, args.seed, end)
+             for index, offset in enumerate(range(0, user_count, args.part_users))]
+    print(f"Generando {user_count} usuarios (ids {first_user}-{first_user + user_count - 1}) y "
+          f"{merchant_count} comercios en {len(parts)} trozos con {args.workers} procesos")
+
+    written = Counter({'bank.merchants': merchant_count})
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             mp_context=multiprocessing.get_context('fork')) as executor:
+        futures = {executor.submit(generate_part, part): part for part in parts}
+        for future in as_completed(futures):
+            part = futures[future]
+            try:
+                written.update(future.result())
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"Error en el trozo {part.index} (usuarios {part.first_user}-"
+                      f"{part.first_user + part.users - 1}): {str(e)}")
+            elapsed = time.perf_counter() - started
+            rows = sum(written.values())
+            print(f"  {done + failed}/{len(parts)} trozos, {rows} filas, {rows / elapsed:.0f} filas/s")
+
+    analyze()
+    elapsed = time.perf_counter() - started
+    print(f"{'tabla':<34}{'filas':>12}")
+    for table, rows in sorted(written.items()):
+        print(f"{table:<34}{rows:>12}")
+    rows = sum(written.values())
+    print(f"{'total':<34}{rows:>12}  en {elapsed:.1f} s ({rows / elapsed:.0f} filas/s, {failed} trozos con error)")
+
+
+if __name__ == "__main__":
+    main()
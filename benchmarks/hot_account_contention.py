@@ -0,0 +1,90 @@
+"""
+Benchmark de contención: depósitos concurrentes sobre una misma cuenta en
+modo de una sola fila frente al modo hot con sub-saldos.
+
+Uso (desde la raíz del proyecto, con la base de datos inicializada):
+    python -m benchmarks.hot_account_contention --account 1 --threads 32 --seconds 10 --slots 16
+"""
+
+import argparse
+import threading
+import time
+from app.db import get_shard_connection, shard_for_account
+from app.services.account_service import account_service
+
+
+def run_deposits(account_id, threads, seconds, amount):
+    """Lanza `threads` hilos depositando durante `seconds` y devuelve depósitos/s."""
+    counts = [0] * threads
+    errors = [0] * threads
+    stop = threading.Event()
+
+    def worker(index):
+        conn = get_shard_connection(shard_for_account(account_id))
+        cur = conn.cursor()
+        try:
+            while not stop.is_set():
+                try:
+                    account_service.credit(cur, account_id, amount)
+                    conn.commit()
+                    counts[index] += 1
+                except Exception:
+                    conn.rollback()
+                    errors[index] += 1
+        finally:
+            cur.close()
+            conn.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return sum(counts) / elapsed, sum(errors)
+
+
+def total_balance(account_id):
+    conn = get_shard_connection(shard_for_account(account_id))
+    cur = conn.cursor()
+    try:
+        return account_service.get_total_balance(cur, account_id, column='id')
+    finally:
+        cur.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--account', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--slots', type=int, default=16)
+    parser.add_argument('--amount', type=float, default=0.01)
+    args = parser.parse_args()
+
+    account_service.disable_hot_mode(args.account)
+    before = total_balance(args.account)
+    single_rate, single_errors = run_deposits(args.account, args.threads, args.seconds, args.amount)
+
+    account_service.enable_hot_mode(args.account, args.slots)
+    try:
+        sharded_rate, sharded_errors = run_deposits(args.account, args.threads, args.seconds, args.amount)
+        account_service.compact()
+    finally:
+        account_service.disable_hot_mode(args.account)
+    after = total_balance(args.account)
+
+    print(f"Hilos: {args.threads}  Duración: {args.seconds}s  Slots: {args.slots}")
+    print(f"{'modo':<12}{'depósitos/s':>14}{'errores':>10}")
+    print(f"{'una fila':<12}{single_rate:>14.1f}{single_errors:>10}")
+    print(f"{'hot':<12}{sharded_rate:>14.1f}{sharded_errors:>10}")
+    print(f"Mejora: x{sharded_rate / single_rate:.2f}" if single_rate else "Mejora: n/a")
+    print(f"Saldo antes: {before:.2f}  después: {after:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Micro-benchmark de serialización JSON de la ruta de exportación de logs de
+crédito y del payload extra_data de log_transaction.
+
+Compara la ruta anterior (dict por fila + isoformat + json.dumps con un
+DecimalEncoder) con app.json_provider (orjson si está instalado). No necesita
+base de datos: genera filas con la misma forma que bank.credit_transaction_logs.
+Uso:
+    python -m benchmarks.json_serialization --rows 10000 --repeat 20
+"""
+
+import argparse
+import datetime
+import json
+import random
+import timeit
+from decimal import Decimal
+from app import json_provider
+from app.loggers.credit_logger import LOG_COLUMNS
+
+
+class DecimalEncoder(json.JSONEncoder):
+    """Codificador que usaba el credit logger antes de app.json_provider."""
+
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super(DecimalEncoder, self).default(obj)
+
+
+def make_rows(count):
+    started = datetime.datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        rows.append((
+            i + 1,
+            random.choice(['PAYMENT_INITIATED', 'PAYMENT_COMPLETED', 'PAYMENT_FAILED']),
+            random.randint(1, 10 ** 6),
+            random.randint(1, 10 ** 5),
+            random.randint(1, 500),
+            Decimal(random.randint(100, 100000)) / 100,
+            random.choice(['PENDING', 'COMPLETED', 'FAILED']),
+            {'card_type': 'VISA', 'error': None} if i % 3 else None,
+            '10.0.%d.%d' % (i % 255, i % 7),
+            started + datetime.timedelta(seconds=i * 13),
+        ))
+    return rows
+
+
+def legacy_export(rows):
+    result = []
+    for log in rows:
+        result.append({
+            'id': log[0],
+            'log_type': log[1],
+            'transaction_id': log[2],
+            'user_id': log[3],
+            'merchant_id': log[4],
+            'amount': float(log[5]) if log[5] else None,
+            'status': log[6],
+            'extra_data': log[7],
+            'ip_address': log[8],
+            'created_at': log[9].isoformat()
+        })
+    return json.dumps(result).encode()
+
+
+def provider_export(rows):
+    return json_provider.dumps([dict(zip(LOG_COLUMNS, log)) for log in rows])
+
+
+def legacy_extra(extra):
+    safe = {k: float(v) if isinstance(v, Decimal) else v
+            for k, v in extra.items() if k not in ['card_number', 'cvv', 'encrypted_data']}
+    return json.dumps(safe, cls=DecimalEncoder)
+
+
+def provider_extra(extra):
+    return json_provider.dumps_str(extra)
+
+
+def best(fn, arg, repeat, number):
+    return min(timeit.repeat(lambda: fn(arg), repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    backend = 'orjson' if json_provider.orjson is not None else 'json (stdlib)'
+    rows = make_rows(args.rows)
+    assert json.loads(legacy_export(rows)) == json.loads(provider_export(rows)), "Salidas distintas"
+
+    legacy = best(legacy_export, rows, args.repeat, 1)
+    provider = best(provider_export, rows, args.repeat, 1)
+    print(f"Serializador: {backend}  Filas: {args.rows}")
+    print(f"{'ruta':<32}{'anterior':>12}{'nueva':>12}{'mejora':>10}")
+    print(f"{'export logs (ms/export)':<32}{legacy * 1000:>12.2f}{provider * 1000:>12.2f}{legacy / provider:>9.1f}x")
+
+    extra = {'card_type': 'VISA', 'amount': Decimal('125.40'), 'attempt': 2}
+    legacy = best(legacy_extra, extra, args.repeat, 10000)
+    provider = best(provider_extra, extra, args.repeat, 10000)
+    print(f"{'extra_data (µs/log)':<32}{legacy * 1e6:>12.2f}{provider * 1e6:>12.2f}{legacy / provider:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
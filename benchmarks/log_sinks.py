@@ -0,0 +1,83 @@
+"""
+Benchmark de sinks de logs de acceso: registros por segundo de app.logger.Logger
+con cada sink, usando --threads hilos que escriben a la vez.
+
+El sink mmap escribe en un directorio temporal. El sink db necesita la base
+de datos; si no está disponible se indica y se sigue con el resto. Uso:
+    python -m benchmarks.log_sinks --records 200000 --threads 4 --sinks mmap,db
+"""
+
+import argparse
+import contextlib
+import io
+import shutil
+import tempfile
+import threading
+import time
+from app.db import get_connection
+from app.logger import Logger, LogType, DatabaseLogSink
+from app.loggers.mmap_sink import MmapLogSink, list_segments, read_segment
+
+
+class NullSink:
+    """Referencia: el coste de Logger.log sin escribir nada."""
+
+    def write(self, *args):
+        pass
+
+
+def run(logger, records, threads):
+    per_thread = records // threads
+
+    def worker(index):
+        for i in range(per_thread):
+            logger.log(LogType.INFO, '10.0.%d.%d' % (index, i % 255), f'user{i % 100}',
+                       'POST /bank/deposit', '200')
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--db-records', type=int, default=2000,
+                        help='registros para el sink db, mucho más lento')
+    parser.add_argument('--sinks', default='null,mmap,db')
+    args = parser.parse_args()
+
+    print(f"{'sink':<8}{'registros':>12}{'registros/s':>14}")
+    for name in args.sinks.split(','):
+        if name == 'null':
+            rate = run(Logger(NullSink()), args.records, args.threads)
+            print(f"{name:<8}{args.records:>12}{rate:>14.0f}")
+        elif name == 'mmap':
+            directory = tempfile.mkdtemp(prefix='log-sink-bench-')
+            try:
+                sink = MmapLogSink(directory, segment_bytes=16 * 1024 * 1024)
+                rate = run(Logger(sink), args.records, args.threads)
+                sink.close()
+                written = sum(1 for path in list_segments(directory) for _ in read_segment(path))
+                print(f"{name:<8}{written:>12}{rate:>14.0f}")
+            finally:
+                shutil.rmtree(directory)
+        elif name == 'db':
+            try:
+                get_connection().close()
+            except Exception as e:
+                print(f"{name:<8}{'no disponible: ' + str(e).strip():>26}")
+                continue
+            # El sink db imprime una línea por registro
+            with contextlib.redirect_stdout(io.StringIO()):
+                rate = run(Logger(DatabaseLogSink(get_connection)), args.db_records, args.threads)
+            print(f"{name:<8}{args.db_records:>12}{rate:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark de verificación de contraseñas: logins por segundo para distintos
+costes de scrypt usando el pool de procesos de app.passwords.
+
+No necesita base de datos; mide solo la verificación, que es el cuello de
+botella de /auth/login. Uso:
+    python -m benchmarks.password_hashing --costs 12 14 15 --threads 16 --seconds 5
+"""
+
+import argparse
+import threading
+import time
+from app.passwords import PasswordHasher, PasswordQueueFull, hash_password
+
+
+def run(cost_log2, threads, seconds, pool_workers, queue_limit):
+    n = 2 ** cost_log2
+    hasher = PasswordHasher(workers=pool_workers, queue_limit=queue_limit, n=n)
+    stored = hash_password('benchmark-password', n=n)
+    hasher.verify('warm-up', stored)  # arrancar el pool antes de medir
+
+    done = [0] * threads
+    rejected = [0] * threads
+    latencies = [[] for _ in range(threads)]
+    stop = threading.Event()
+
+    def worker(index):
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                hasher.verify('benchmark-password', stored)
+                done[index] += 1
+                latencies[index].append(time.perf_counter() - started)
+            except PasswordQueueFull:
+                rejected[index] += 1
+                time.sleep(0.001)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = sorted(l for per_thread in latencies for l in per_thread)
+    p50 = all_latencies[len(all_latencies) // 2] * 1000 if all_latencies else 0
+    p99 = all_latencies[int(len(all_latencies) * 0.99)] * 1000 if all_latencies else 0
+    hasher._executor().shutdown()
+    return sum(done) / elapsed, sum(rejected), p50, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--costs', type=int, nargs='+', default=[12, 14, 15], help='log2(N) de scrypt')
+    parser.add_argument('--threads', type=int, default=16, help='logins concurrentes')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pool-workers', type=int, default=2)
+    parser.add_argument('--queue-limit', type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"Hilos: {args.threads}  Pool: {args.pool_workers} procesos  Cola: {args.queue_limit}")
+    print(f"{'N':>8}{'memoria':>10}{'logins/s':>12}{'rechazados':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for cost in args.costs:
+        rate, rejected, p50, p99 = run(cost, args.threads, args.seconds, args.pool_workers, args.queue_limit)
+        memory_mb = 128 * (2 ** cost) * 8 / (1024 * 1024)
+        print(f"{2 ** cost:>8}{memory_mb:>8.0f}MB{rate:>12.1f}{rejected:>12}{p50:>10.1f}{p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
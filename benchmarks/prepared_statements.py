@@ -0,0 +1,139 @@
+"""
+Benchmark de sentencias preparadas: para cada sentencia caliente de
+app.db.STATEMENTS compara el SQL enviado tal cual con PREPARE/EXECUTE sobre
+la misma conexión del pool.
+
+Mide el tiempo por llamada visto desde el cliente y el tiempo de
+planificación que informa Postgres (EXPLAIN ANALYZE del SQL frente a
+EXPLAIN ANALYZE EXECUTE, ya con el plan en caché). Antes de medir comprueba
+que una conexión devuelta al pool y recuperada conserva sus sentencias
+preparadas y las sigue ejecutando. Las escrituras se hacen dentro de una
+transacción que se deshace. Necesita la base de datos
+inicializada, mejor con volumen (benchmarks.datagen). Uso:
+    python -m benchmarks.prepared_statements --iterations 5000
+"""
+
+import argparse
+import time
+from datetime import datetime
+from app.db import get_connection, get_shard_connection, execute_statement, connection_pool, STATEMENTS
+
+
+def sample_params(primary, shard):
+    """Parámetros reales de cada sentencia y la conexión (base) en la que se ejecuta."""
+    cur = shard.cursor()
+    try:
+        cur.execute("SELECT id, username FROM bank.users ORDER BY id LIMIT 1")
+        user_id, username = cur.fetchone()
+        cur.execute("SELECT id FROM bank.merchants ORDER BY id LIMIT 1")
+        merchant_id = cur.fetchone()[0]
+        cur.execute("SELECT COALESCE(max(id), 0) FROM bank.credit_transactions")
+        transaction_id = cur.fetchone()[0]
+    finally:
+        cur.close()
+        shard.rollback()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        'user_directory': (primary, (username,)),
+        'login_user': (shard, (user_id,)),
+        'account_balance': (shard, (user_id,)),
+        'account_debit': (shard, (0, user_id)),
+        'credit_card_balance': (shard, (user_id,)),
+        'credit_card_payment': (shard, (0, user_id)),
+        'active_merchant': (shard, (merchant_id,)),
+        'pending_credit_transaction': (shard, (transaction_id,)),
+        'access_log_insert': (primary, (now, 'INFO', '127.0.0.1', username, 'POST /benchmark', '200')),
+        'credit_log_insert': (primary, ('PAYMENT_INITIATED', transaction_id, user_id, merchant_id,
+                                        1.0, 'PENDING', None, '127.0.0.1')),
+    }
+
+
+def check_pool_reuse(shard, user_id):
+    """
+    Devuelve una conexión al pool, la recupera y vuelve a ejecutar una
+    sentencia preparada: falla si el reinicio de la sesión la borró.
+    """
+    conn = get_shard_connection(shard)
+    cur = conn.cursor()
+    execute_statement(cur, 'login_user', (user_id,))
+    expected = cur.fetchone()
+    cur.close()
+    conn.close()
+
+    again = get_shard_connection(shard)
+    try:
+        if again is not conn:
+            raise RuntimeError("El pool no devolvió la misma conexión")
+        if 'login_user' not in again.prepared:
+            raise RuntimeError("La conexión recuperada no recuerda sus sentencias preparadas")
+        cur = again.cursor()
+        execute_statement(cur, 'login_user', (user_id,))
+        if cur.fetchone() != expected:
+            raise RuntimeError("La sentencia preparada devolvió otro resultado tras volver al pool")
+        cur.close()
+    finally:
+        again.close()
+
+
+def per_call_us(run, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        run()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def planning_ms(cur, query, params, runs):
+    """Media de 'Planning Time' de EXPLAIN ANALYZE sobre runs ejecuciones."""
+    total = 0.0
+    for _ in range(runs):
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", params)
+        total += cur.fetchone()[0][0]['Planning Time']
+    return total / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--explain-runs', type=int, default=50)
+    parser.add_argument('--shard', type=int, default=0)
+    args = parser.parse_args()
+
+    # Solo las conexiones del pool preparan sentencias
+    connection_pool.size = max(connection_pool.size, 2)
+    primary = get_connection()
+    shard = get_shard_connection(args.shard)
+    samples = sample_params(primary, shard)
+    check_pool_reuse(args.shard, samples['login_user'][1][0])
+    print("Pool: la conexión recuperada conserva y ejecuta sus sentencias preparadas")
+
+    print(f"{'sentencia':<28}{'SQL µs':>10}{'EXECUTE µs':>12}{'x':>7}{'plan SQL ms':>13}{'plan EXEC ms':>14}"
+          f"{'ahorro µs/llamada':>19}")
+    saved_total = 0.0
+    try:
+        for name, statement in STATEMENTS.items():
+            conn, params = samples[name]
+            cur = conn.cursor()
+            try:
+                plain = per_call_us(lambda: (cur.execute(statement.query, params), cur.fetchall()
+                                             if cur.description else None), args.iterations)
+                prepared = per_call_us(lambda: (execute_statement(cur, name, params), cur.fetchall()
+                                                if cur.description else None), args.iterations)
+                execute = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * statement.params)})"
+                                               if statement.params else '')
+                plan_plain = planning_ms(cur, statement.query, params, args.explain_runs)
+                plan_prepared = planning_ms(cur, execute, params, args.explain_runs)
+            finally:
+                cur.close()
+                conn.rollback()
+            saved = (plan_plain - plan_prepared) * 1000
+            saved_total += saved
+            print(f"{name:<28}{plain:>10.1f}{prepared:>12.1f}{plain / prepared:>7.2f}"
+                  f"{plan_plain:>13.3f}{plan_prepared:>14.3f}{saved:>19.1f}")
+    finally:
+        primary.close()
+        shard.close()
+    print(f"Planificación ahorrada con una llamada de cada sentencia: {saved_total:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+Reproducción de tráfico real a partir de los logs de acceso.
+
+Lee una ventana de bank.logs (o un export JSONL, incluido el de
+`python -m app.loggers.mmap_sink decode --json`), genera para cada petición
+registrada un payload equivalente y la lanza contra una instancia local
+respetando los tiempos entre llegadas (escalados con --speed) y la
+concurrencia por usuario: las peticiones de un mismo usuario e IP se envían
+en orden y nunca se solapan. Al final compara la ventana original con la
+reproducción y da los percentiles de latencia por acción.
+
+Los usuarios deben existir en la instancia con la contraseña --password
+(la de benchmarks.datagen por defecto). Los logins se registran como
+'anonymous', así que se atribuyen a la siguiente petición autenticada desde
+la misma IP; si un usuario no tiene token se inicia sesión fuera de la
+medición. Los OTP se leen de la base de datos. Uso:
+    python -m benchmarks.replay export --start 2024-05-01T10:00 --end 2024-05-01T11:00 --output window.jsonl
+    python -m benchmarks.replay run --file window.jsonl --speed 2 --concurrency 64
+    python -m benchmarks.replay run --start 2024-05-01T10:00 --end 2024-05-01T10:15 --port 8000
+"""
+
+import argparse
+import datetime
+import http.client
+import random
+import threading
+import time
+import uuid
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from app.db import get_connection, get_shard_connection, lookup_user
+from app.json_provider import dumps_str, loads
+
+# Tarjeta de prueba que pasa la validación de Luhn
+TEST_CARD = '4532015112830366'
+# Acciones que no terminan (streams SSE) y no se pueden medir como peticiones
+UNREPLAYABLE = {'GET /events/credit-transactions'}
+
+
+# ---------------- Fuentes ----------------
+
+def load_db(start, end):
+    """Peticiones de bank.logs en [start, end) ordenadas por llegada."""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        # log_request escribe una fila INFO al llegar cada petición; las ERROR la repiten
+        cur.execute("""
+            SELECT timestamp, remote_ip, username, action FROM bank.logs
+            WHERE log_type = 'INFO' AND timestamp >= %s AND timestamp < %s
+            ORDER BY timestamp, id
+        """, (start, end))
+        return [{'timestamp': ts, 'remote_ip': ip, 'username': user, 'action': action}
+                for ts, ip, user, action in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def load_file(path, start=None, end=None):
+    """Peticiones de un export JSONL (una fila de log por línea)."""
+    records = []
+    with open(path) as export:
+        for line in export:
+            if not line.strip():
+                continue
+            row = loads(line)
+            if row.get('log_type', 'INFO') != 'INFO':
+                continue
+            ts = datetime.datetime.fromisoformat(row['timestamp'])
+            if (start is not None and ts < start) or (end is not None and ts >= end):
+                continue
+            records.append({'timestamp': ts, 'remote_ip': row.get('remote_ip') or '',
+                            'username': row['username'], 'action': row['action']})
+    records.sort(key=lambda r: r['timestamp'])
+    return records
+
+
+def attribute_logins(records):
+    """
+    Asigna cada login anónimo al usuario de la siguiente petición autenticada
+    desde la misma IP. Los que no se pueden atribuir se descartan.
+    """
+    pending = {}
+    for record in records:
+        if record['action'] == 'POST /auth/login' and record['username'] == 'anonymous':
+            pending.setdefault(record['remote_ip'], []).append(record)
+        elif record['username'] != 'anonymous':
+            for login in pending.pop(record['remote_ip'], ()):
+                login['username'] = record['username']
+    return [r for r in records if r['username'] != 'anonymous']
+
+
+# ---------------- Reproducción ----------------
+
+class Replayer:
+    """
+    Lanza las peticiones en su instante escalado. Cada carril (usuario, IP) es
+    una cola que un hilo del pool vacía en orden, así que la concurrencia de
+    la reproducción es la de usuarios activos a la vez, limitada por el pool.
+    """
+
+    def __init__(self, host, port, password, concurrency, seed=0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.concurrency = concurrency
+        self.rng = random.Random(seed)
+        self.users = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._busy = set()
+        self._tokens = {}
+        self._accounts = {}
+        self._payments = {}
+        self._merchants = None
+        self.latencies = {}
+        self.statuses = {}
+        self.lags = []
+        self.sent_at = []
+        self.skipped = Counter()
+        self.setup_logins = 0
+
+    # ---------------- HTTP ----------------
+
+    def _request(self, method, path, body=None, token=None, headers=None):
+        """Devuelve (status, cuerpo JSON o None, segundos)."""
+        headers = dict(headers or {})
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = dumps_str(body) if body is not None else None
+        started = time.perf_counter()
+        try:
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            raw = response.read()
+            elapsed = time.perf_counter() - started
+        except (OSError, http.client.HTTPException):
+            self._local.conn = None
+            return 0, None, time.perf_counter() - started
+        try:
+            data = loads(raw) if raw else None
+        except ValueError:
+            data = None
+        return response.status, data, elapsed
+
+    # ---------------- Contexto de cada usuario ----------------
+
+    def _login(self, username):
+        status, data, elapsed = self._request('POST', '/auth/login',
+                                              {'username': username, 'password': self.password})
+        if status == 200:
+            self._tokens[username] = data['token']
+        return status, elapsed
+
+    def _token(self, username):
+        token = self._tokens.get(username)
+        if token is None:
+            with self._lock:
+                self.setup_logins += 1
+            self._login(username)
+            token = self._tokens.get(username)
+        return token
+
+    def _shard_scalar(self, username, query, params):
+        entry = lookup_user(username)
+        if entry is None:
+            return None
+        conn = get_shard_connection(entry[1])
+        cur = conn.cursor()
+        try:
+            cur.execute(query, params(entry[0]))
+            row = cur.fetchone()
+            return row[0] if row else None
+        finally:
+            cur.close()
+            conn.close()
+
+    def _account(self, username):
+        if username not in self._accounts:
+            self._accounts[username] = self._shard_scalar(
+                username, "SELECT id FROM bank.accounts WHERE user_id = %s ORDER BY id LIMIT 1",
+                lambda user_id: (user_id,))
+        return self._accounts[username]
+
+    def _merchant(self):
+        if self._merchants is None:
+            conn = get_connection()
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT id FROM bank.merchants WHERE status = true ORDER BY id")
+                self._merchants = [row[0] for row in cur.fetchall()]
+            finally:
+                cur.close()
+                conn.close()
+        return self.rng.choice(self._merchants) if self._merchants else None
+
+    def _amount(self):
+        return round(self.rng.uniform(1, 50), 2)
+
+    # ---------------- Payloads ----------------
+
+    def build(self, username, action):
+        """
+        Traduce una acción del log a (method, path, body, headers, token), o
+        None si no se puede reproducir (se cuenta como omitida).
+        """
+        idempotency = {'Idempotency-Key': uuid.uuid4().hex}
+        if action == 'POST /auth/login':
+            return 'POST', '/auth/login', {'username': username, 'password': self.password}, None, None
+        token = self._token(username)
+        if token is None:
+            return None
+        if action == 'POST /auth/logout':
+            return 'POST', '/auth/logout', None, None, token
+        if action == 'POST /bank/deposit':
+            account = self._account(username)
+            if account is None:
+                return None
+            return 'POST', '/bank/deposit', {'account_number': account, 'amount': self._amount()}, idempotency, token
+        if action in ('POST /bank/withdraw', 'POST /bank/pay-credit-balance'):
+            return 'POST', action.split(' ', 1)[1], {'amount': self._amount()}, None, token
+        if action == 'POST /bank/transfer':
+            targets = [u for u in self.rng.sample(self.users, min(len(self.users), 4)) if u != username]
+            if not targets:
+                return None
+            body = {'target_username': targets[0], 'amount': self._amount()}
+            return 'POST', '/bank/transfer', body, idempotency, token
+        if action == 'POST /bank/credit-payment':
+            merchant = self._merchant()
+            if merchant is None:
+                return None
+            body = {'merchant_id': merchant, 'card_number': TEST_CARD, 'cvv': '123', 'expiry_month': 12,
+                    'expiry_year': datetime.date.today().year + 2, 'amount': self._amount()}
+            return 'POST', '/bank/credit-payment', body, idempotency, token
+        if action == 'POST /bank/verify-otp':
+            pending = self._payments.get(username)
+            if not pending:
+                return None
+            transaction_id = pending.popleft()
+            otp = self._shard_scalar(username, "SELECT otp_code FROM bank.credit_transactions "
+                                               "WHERE id = %s AND user_id = %s",
+                                     lambda user_id: (transaction_id, user_id))
+            if otp is None:
+                return None
+            body = {'transaction_id': transaction_id, 'otp_code': otp}
+            return 'POST', '/bank/verify-otp', body, None, token
+        if action == 'GET /bank/credit-logs':
+            return 'GET', '/bank/credit-logs?limit=100', None, None, token
+        if action == 'GET /analytics/merchant-hourly':
+            return 'GET', '/analytics/merchant-hourly', None, None, token
+        return None
+
+    def _execute(self, item):
+        due, username, action = item
+        lag = time.perf_counter() - due
+        if lag < 0:
+            time.sleep(-lag)
+            lag = 0
+        request = self.build(username, action)
+        if request is None:
+            with self._lock:
+                self.skipped[action] += 1
+            return
+        method, path, body, headers, token = request
+        with self._lock:
+            self.sent_at.append(time.perf_counter())
+            self.lags.append(lag)
+        status, data, elapsed = self._request(method, path, body, token, headers)
+        if action == 'POST /auth/login' and status == 200:
+            self._tokens[username] = data['token']
+        elif action == 'POST /auth/logout':
+            self._tokens.pop(username, None)
+        elif action == 'POST /bank/credit-payment' and status == 200 and data:
+            self._payments.setdefault(username, deque()).append(data['transaction_id'])
+        with self._lock:
+            self.latencies.setdefault(action, []).append(elapsed)
+            self.statuses.setdefault(action, Counter())[status] += 1
+
+    # ---------------- Planificación ----------------
+
+    def _drain(self, lane):
+        while True:
+            with self._lock:
+                pending = self._lanes[lane]
+                if not pending:
+                    del self._lanes[lane]
+                    self._busy.discard(lane)
+                    return
+                item = pending.popleft()
+            try:
+                self._execute(item)
+            except Exception as e:
+                print(f"Error reproduciendo {item[2]} de {item[1]}: {e}")
+
+    def run(self, records, speed=1.0):
+        """Reproduce los registros; devuelve la duración de la reproducción en segundos."""
+        self.users = sorted({r['username'] for r in records})
+        if not records:
+            return 0.0
+        t0 = records[0]['timestamp']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for record in records:
+                if record['action'] in UNREPLAYABLE:
+                    self.skipped[record['action']] += 1
+                    continue
+                due = started + (record['timestamp'] - t0).total_seconds() / speed
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                lane = (record['username'], record['remote_ip'])
+                with self._lock:
+                    self._lanes.setdefault(lane, deque()).append((due, record['username'], record['action']))
+                    if lane in self._busy:
+                        continue
+                    self._busy.add(lane)
+                executor.submit(self._drain, lane)
+        return time.perf_counter() - started
+
+
+# ---------------- Informe ----------------
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0
+
+
+def gaps(times):
+    return sorted(b - a for a, b in zip(times, times[1:]))
+
+
+def report(records, replayer, elapsed, speed):
+    original = (records[-1]['timestamp'] - records[0]['timestamp']).total_seconds() if records else 0
+    sent = len(replayer.sent_at)
+    original_gaps = gaps([(r['timestamp'] - records[0]['timestamp']).total_seconds() for r in records])
+    replay_gaps = gaps(sorted(replayer.sent_at))
+    lags = sorted(replayer.lags)
+
+    print(f"Original:     {len(records)} peticiones de {len(replayer.users)} usuarios en {original:.1f} s "
+          f"({len(records) / original if original else 0:.1f} req/s)")
+    print(f"Reproducción: {sent} peticiones a x{speed:g} en {elapsed:.1f} s "
+          f"({sent / elapsed if elapsed else 0:.1f} req/s); omitidas {sum(replayer.skipped.values())}, "
+          f"logins previos {replayer.setup_logins}")
+    print(f"Entre llegadas ms (p50/p99): original {percentile(original_gaps, 0.5) * 1000:.1f}/"
+          f"{percentile(original_gaps, 0.99) * 1000:.1f}, reproducción {percentile(replay_gaps, 0.5) * 1000:.1f}/"
+          f"{percentile(replay_gaps, 0.99) * 1000:.1f} (escalado x{speed:g})")
+    print(f"Retraso sobre el plan ms (p50/p99/máx): {percentile(lags, 0.5) * 1000:.1f}/"
+          f"{percentile(lags, 0.99) * 1000:.1f}/{(lags[-1] if lags else 0) * 1000:.1f}")
+    print()
+
+    counts = Counter(r['action'] for r in records)
+    print(f"{'acción':<34}{'orig':>7}{'orig/s':>8}{'enviadas':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"  estados")
+    for action, count in counts.most_common():
+        samples = sorted(replayer.latencies.get(action, []))
+        statuses = ' '.join(f"{code}:{n}" for code, n in sorted(replayer.statuses.get(action, {}).items()))
+        if replayer.skipped[action]:
+            statuses += f" omitidas:{replayer.skipped[action]}"
+        print(f"{action:<34}{count:>7}{count / original if original else 0:>8.1f}{len(samples):>10}"
+              f"{percentile(samples, 0.5) * 1000:>9.1f}{percentile(samples, 0.95) * 1000:>9.1f}"
+              f"{percentile(samples, 0.99) * 1000:>9.1f}  {statuses}")
+
+
+def export(records, path):
+    with open(path, 'w') as output:
+        for record in records:
+            output.write(dumps_str(dict(record, log_type='INFO')) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('export', 'run'):
+        command = sub.add_parser(name)
+        command.add_argument('--start', type=datetime.datetime.fromisoformat)
+        command.add_argument('--end', type=datetime.datetime.fromisoformat)
+        command.add_argument('--file', help='Export JSONL en lugar de bank.logs')
+    sub.choices['export'].add_argument('--output', required=True)
+    run = sub.choices['run']
+    run.add_argument('--host', default='127.0.0.1')
+    run.add_argument('--port', type=int, default=8000)
+    run.add_argument('--speed', type=float, default=1.0, help='Factor de aceleración de los tiempos originales')
+    run.add_argument('--concurrency', type=int, default=64, help='Carriles de usuario activos a la vez')
+    run.add_argument('--password', default='datagen')
+    run.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.file:
+        records = load_file(args.file, args.start, args.end)
+    else:
+        if args.start is None or args.end is None:
+            parser.error("--start y --end son obligatorios al leer de bank.logs")
+        records = load_db(args.start, args.end)
+
+    if args.command == 'export':
+        export(records, args.output)
+        print(f"Exportadas {len(records)} peticiones a {args.output}")
+        return
+
+    records = attribute_logins(records)
+    if not records:
+        print("No hay peticiones en la ventana")
+        return
+    replayer = Replayer(args.host, args.port, args.password, args.concurrency, args.seed)
+    elapsed = replayer.run(records, args.speed)
+    report(records, replayer, elapsed, args.speed)
+
+
+if __name__ == "__main__":
+    main()
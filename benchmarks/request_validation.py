@@ -0,0 +1,90 @@
+"""
+Benchmark de validación de payloads: coste por petición de Model.validate de
+Flask-RESTX (jsonschema Draft4Validator) frente a los validadores compilados
+de app.validation, para cada modelo de app.main.
+
+Antes de medir comprueba que ambos devuelven exactamente el mismo cuerpo de
+error 400 para una batería de payloads válidos e inválidos. No necesita base
+de datos. Uso:
+    python -m benchmarks.request_validation --iterations 20000
+"""
+
+import argparse
+import time
+from werkzeug.exceptions import HTTPException
+from flask_restx import Model
+from app.main import api
+from app.validation import compile_schema, CompiledValidator
+
+# Valores de cada tipo de Draft 4 y otros que no encajan en ninguno
+SAMPLES = {
+    'string': 'user1',
+    'integer': 7,
+    'number': 12.5,
+}
+WRONG = [None, True, 1.0, '12', [], {}]
+
+
+def payloads(model):
+    """Un payload válido completo y variantes inválidas derivadas de él."""
+    schema = model.__schema__
+    valid = {name: SAMPLES[prop['type']] for name, prop in schema['properties'].items()}
+    cases = [valid, {}, None, [], 'text', dict(valid, extra='ignored')]
+    for name in schema['properties']:
+        cases.append({k: v for k, v in valid.items() if k != name})
+        cases.extend(dict(valid, **{name: wrong}) for wrong in WRONG)
+    return valid, cases
+
+
+def outcome(validate, data):
+    try:
+        validate(data)
+        return None
+    except HTTPException as e:
+        return getattr(e, 'data', None)
+
+
+def per_call_us(validate, data, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        try:
+            validate(data)
+        except HTTPException:
+            pass
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'modelo':<18}{'casos':>7}{'jsonschema µs':>16}{'compilado µs':>15}{'x':>7}"
+          f"{'inválido js µs':>17}{'inválido µs':>14}")
+    for name, model in api.models.items():
+        check = compile_schema(model.__schema__, api.format_checker)
+        if check is None:
+            print(f"{name:<18}{'no compilable':>22}")
+            continue
+
+        def original(data, model=model):
+            Model.validate(model, data, api.refresolver, api.format_checker)
+        compiled = CompiledValidator(check)
+
+        valid, cases = payloads(model)
+        with api.app.test_request_context():
+            mismatches = [data for data in cases if outcome(original, data) != outcome(compiled, data)]
+            if mismatches:
+                print(f"{name:<18} errores distintos para: {mismatches}")
+                continue
+            invalid = cases[-1]
+            before = per_call_us(original, valid, args.iterations)
+            after = per_call_us(compiled, valid, args.iterations)
+            before_invalid = per_call_us(original, invalid, args.iterations // 10)
+            after_invalid = per_call_us(compiled, invalid, args.iterations // 10)
+        print(f"{name:<18}{len(cases):>7}{before:>16.2f}{after:>15.2f}{before / after:>7.0f}"
+              f"{before_invalid:>17.2f}{after_invalid:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
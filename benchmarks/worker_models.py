@@ -0,0 +1,137 @@
+"""
+Benchmark de modelos de worker de gunicorn (sync, gthread, gevent).
+
+Para cada modelo arranca gunicorn con gunicorn.conf.py, lanza carga concurrente
+contra un endpoint que consulta Postgres (por defecto /ops/ready) y mide
+peticiones por segundo, latencias y memoria residente de los workers por
+conexión concurrente. Necesita la base de datos accesible con las variables
+POSTGRES_*. Uso:
+    python -m benchmarks.worker_models --models sync gthread gevent --concurrency 64 --seconds 10
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+PORT = 8765
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/ops/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def worker_rss_kb(master_pid):
+    """Suma de VmRSS de los procesos hijos del master de gunicorn."""
+    total = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as status:
+                fields = dict(line.split(':', 1) for line in status if ':' in line)
+            if int(fields['PPid']) == master_pid:
+                total += int(fields['VmRSS'].split()[0])
+        except (OSError, KeyError, ValueError):
+            continue
+    return total
+
+
+def load(port, path, concurrency, seconds):
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    stop = threading.Event()
+
+    def client(index):
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+                if response.status == 200:
+                    latencies[index].append(time.perf_counter() - started)
+                else:
+                    errors[index] += 1
+            except OSError:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    samples = sorted(l for per_client in latencies for l in per_client)
+    return samples, sum(errors), elapsed
+
+
+def run_model(model, args):
+    env = dict(os.environ,
+               WORKER_CLASS=model,
+               WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_BIND=f'127.0.0.1:{PORT}')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app.main:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_until_up(PORT):
+            raise RuntimeError(f"gunicorn ({model}) no arrancó")
+        load(PORT, args.path, min(args.concurrency, 8), 1)  # calentamiento
+        samples, errors, elapsed = load(PORT, args.path, args.concurrency, args.seconds)
+        rss_kb = worker_rss_kb(proc.pid)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000 if samples else 0
+
+    return {
+        'rps': len(samples) / elapsed,
+        'errors': errors,
+        'p50': pct(0.5),
+        'p99': pct(0.99),
+        'rss_mb': rss_kb / 1024,
+        'kb_per_conn': rss_kb / args.concurrency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--path', default='/ops/ready')
+    args = parser.parse_args()
+
+    print(f"Workers: {args.workers}  Concurrencia: {args.concurrency}  Endpoint: {args.path}")
+    print(f"{'modelo':<10}{'req/s':>10}{'errores':>10}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>10}{'KB/conn':>10}")
+    for model in args.models:
+        r = run_model(model, args)
+        print(f"{model:<10}{r['rps']:>10.1f}{r['errors']:>10}{r['p50']:>10.1f}{r['p99']:>10.1f}"
+              f"{r['rss_mb']:>10.1f}{r['kb_per_conn']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
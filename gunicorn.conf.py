@@ -0,0 +1,28 @@
+# gunicorn.conf.py
+#
+# Modelo de workers seleccionable por entorno:
+#   WORKER_CLASS=sync     un proceso atiende una petición a la vez (por defecto)
+#   WORKER_CLASS=gthread  WORKER_THREADS hilos por proceso
+#   WORKER_CLASS=gevent   WORKER_CONNECTIONS greenlets por proceso; las esperas
+#                         a Postgres ceden el control mediante el wait callback
+#                         de psycopg2 (app.db.enable_cooperative_wait)
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+threads = int(os.environ.get('WORKER_THREADS', '8'))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '200'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '2'))
+
+if worker_class not in ('sync', 'gthread', 'gevent'):
+    raise ValueError(f"Unsupported WORKER_CLASS: {worker_class}")
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from app.db import enable_cooperative_wait
+        enable_cooperative_wait()
+        server.log.info("Worker %s: espera cooperativa de psycopg2 activada", worker.pid)